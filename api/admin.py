@@ -0,0 +1,31 @@
+from django.contrib import admin
+
+from api.models import Upload
+
+
+class UploadAdmin(admin.ModelAdmin):
+    list_display = (
+        "created_at",
+        "username",
+        "method",
+        "filename",
+        "status",
+        "raw_size",
+        "compressed_size",
+        "validation_time",
+        "compression_time",
+        "hdfs_time",
+    )
+    list_filter = ("status", "method")
+    search_fields = ("=username", "filename", "=md5")
+    date_hierarchy = "created_at"
+    ordering = ("-created_at", "-id")
+    # A contagem total da tabela fica cara com o histórico crescendo
+    show_full_result_count = False
+    readonly_fields = [field.name for field in Upload._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(Upload, UploadAdmin)
@@ -0,0 +1,624 @@
+"""Benchmark do caminho de recebimento dos arquivos
+
+Usado pelo comando `manage.py benchmark`. Os arquivos sintéticos são
+gerados a partir de uma semente fixa e guardados em `workdir`, então
+execuções seguidas medem exatamente os mesmos dados. O HDFS é substituído
+por FakeHDFSClient, que grava no disco local.
+
+Cada caso roda em um processo filho (fork) para que o pico de memória
+(RSS) medido seja só dele. Os casos de inicialização (manage.py check e a
+carga da aplicação WSGI) rodam em um interpretador novo e não dependem do
+tamanho dos arquivos. Os resultados são acrescentados a um arquivo
+JSON lines; um caso é marcado como regressão quando a vazão cai, ou o pico
+de memória sobe, mais que `threshold` em relação à mediana das últimas
+execuções do mesmo caso e tamanho.
+"""
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+from hashlib import md5
+from time import monotonic
+from unittest import mock
+from uuid import uuid4
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections, transaction
+from openpyxl import Workbook
+
+from api import columnar
+from api.forms import FileUploadForm
+from api.utils import FILE_ENCODING, is_data_valid, md5reader, read_csv_sample
+from api.validation import validate_file
+from api.views import upload
+from methodmapping.models import MethodMapping
+from secret.models import Secret
+
+SEED = 20190101
+XLSX_MAX_ROWS = 1048575
+UNITS = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+UFS = ["RJ", "SP", "MG", "ES", "BA"]
+SCHEMA = {
+    "fields": [
+        {
+            "name": "id",
+            "type": "integer",
+            "constraints": {"required": True},
+        },
+        {"name": "nome", "type": "string"},
+        {"name": "valor", "type": "number", "constraints": {"minimum": 0}},
+        {"name": "uf", "type": "string", "constraints": {"enum": UFS}},
+        {"name": "data", "type": "date"},
+    ]
+}
+HEADER = [field["name"] for field in SCHEMA["fields"]]
+
+
+def parse_size(value):
+    match = re.fullmatch(r"(\d+)\s*(KB|MB|GB)", value.strip().upper())
+    if match is None:
+        raise ValueError("tamanho inválido: {0}".format(value))
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+def format_size(size):
+    for unit in ("GB", "MB", "KB"):
+        if size % UNITS[unit] == 0:
+            return "{0}{1}".format(size // UNITS[unit], unit)
+    return str(size)
+
+
+def synthetic_rows(seed=SEED):
+    rng = random.Random(seed)
+    start = date(2019, 1, 1)
+    number = 0
+    while True:
+        number += 1
+        yield [
+            number,
+            "nome {0}".format(rng.randrange(10 ** 6)),
+            "{0:.2f}".format(rng.uniform(0, 10000)),
+            rng.choice(UFS),
+            (start + timedelta(days=rng.randrange(365))).isoformat(),
+        ]
+
+
+class SyntheticFiles:
+    """Arquivos de teste de `size` bytes de csv, gerados uma única vez
+
+    A planilha tem as mesmas linhas do csv do mesmo tamanho e não existe
+    quando elas passam do limite de linhas do Excel.
+    """
+
+    def __init__(self, workdir, size):
+        self.size = size
+        self.prefix = os.path.join(
+            workdir, "synthetic-{0}".format(format_size(size))
+        )
+
+    def path(self, kind):
+        path = "{0}.{1}".format(self.prefix, kind)
+        if not os.path.exists(path):
+            getattr(self, "build_" + kind.replace(".", "_"))(path)
+        return path
+
+    @property
+    def rows(self):
+        with open(self.path("csv"), encoding=FILE_ENCODING) as fobj:
+            return sum(1 for _ in fobj) - 1
+
+    def build_csv(self, path):
+        partial_path = path + ".part"
+        with open(
+            partial_path, "w", newline="", encoding=FILE_ENCODING
+        ) as fobj:
+            writer = csv.writer(fobj)
+            writer.writerow(HEADER)
+            rows = synthetic_rows()
+            while fobj.tell() < self.size:
+                writer.writerows(next(rows) for _ in range(1000))
+        os.replace(partial_path, path)
+
+    def build_csv_gz(self, path):
+        with open(self.path("csv"), "rb") as source:
+            with gzip.open(path + ".part", "wb", compresslevel=6) as output:
+                shutil.copyfileobj(source, output, 1024 * 1024)
+        os.replace(path + ".part", path)
+
+    def build_xlsx(self, path):
+        rows = self.rows
+        if rows > XLSX_MAX_ROWS:
+            raise SkipCase("csv com mais linhas que o limite do Excel")
+
+        wb = Workbook(write_only=True)
+        sheet = wb.create_sheet()
+        sheet.append(HEADER)
+        generated = synthetic_rows()
+        for _ in range(rows):
+            sheet.append(next(generated))
+        wb.save(path + ".part")
+        os.replace(path + ".part", path)
+
+
+class SkipCase(Exception):
+    """O caso não se aplica a este tamanho de arquivo"""
+
+
+class FakeHDFSClient:
+    """Substitui hdfsclient gravando os arquivos em `root`"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, hdfs_path):
+        return os.path.join(self.root, hdfs_path.lstrip("/"))
+
+    def write(self, hdfs_path, data=None, overwrite=False, **kwargs):
+        path = self.local_path(hdfs_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fobj:
+            if hasattr(data, "read"):
+                for chunk in iter(lambda: data.read(64 * 1024), b""):
+                    fobj.write(chunk)
+            else:
+                for chunk in data:
+                    fobj.write(chunk)
+
+    def rename(self, hdfs_src_path, hdfs_dst_path):
+        destination = self.local_path(hdfs_dst_path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(self.local_path(hdfs_src_path), destination)
+
+    def delete(self, hdfs_path, recursive=False):
+        path = self.local_path(hdfs_path)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def checksum(self, hdfs_path):
+        hash_md5 = md5()
+        with open(self.local_path(hdfs_path), "rb") as fobj:
+            for chunk in iter(lambda: fobj.read(1024 * 1024), b""):
+                hash_md5.update(chunk)
+        return {"bytes": hash_md5.hexdigest()}
+
+
+def open_upload(path):
+    return UploadedFile(
+        open(path, "rb"),
+        name=os.path.basename(path),
+        size=os.path.getsize(path),
+    )
+
+
+class Case:
+    """Caso do benchmark: `setup` prepara e `run` é a parte medida
+
+    `run` devolve o número de bytes processados, usado no cálculo da vazão.
+    """
+
+    source = "csv"
+    uses_db = False
+    rusage = resource.RUSAGE_SELF
+
+    def setup(self, path):
+        self.file_ = open_upload(path)
+
+    def teardown(self):
+        self.file_.close()
+
+
+class MD5ReaderCase(Case):
+    def run(self):
+        md5reader(self.file_)
+        return self.file_.size
+
+
+class CSVSampleCase(Case):
+    def run(self):
+        read_csv_sample(self.file_)
+        return self.file_.size
+
+
+class DataValidCase(Case):
+    def setup(self, path):
+        super().setup(path)
+        self.mapping = MethodMapping(
+            method="benchmark", schema=SCHEMA, full_validation=True
+        )
+
+    def run(self):
+        valid, errors = is_data_valid(
+            "benchmark", "benchmark", self.file_, mapping=self.mapping
+        )
+        if not valid:
+            raise AssertionError(errors)
+        return self.file_.size
+
+
+class PythonValidationCase(Case):
+    """Validação do arquivo completo linha a linha, sem a amostra"""
+
+    def run(self):
+        errors = validate_file(self.file_, SCHEMA)
+        if errors:
+            raise AssertionError(errors)
+        return self.file_.size
+
+
+class ColumnarValidationCase(Case):
+    """O mesmo que PythonValidationCase, com o motor do pyarrow"""
+
+    def run(self):
+        errors = columnar.validate_columnar(self.file_, SCHEMA)
+        if errors:
+            raise AssertionError(errors)
+        return self.file_.size
+
+
+class ConvertToCSVCase(Case):
+    source = "xlsx"
+
+    def run(self):
+        output = FileUploadForm().convert_to_csv(self.file_)
+        output.close()
+        return self.file_.size
+
+
+class CompressCase(Case):
+    def run(self):
+        form = FileUploadForm(
+            files={"file": self.file_},
+            disable_md5=True,
+            mapping=MethodMapping(),
+        )
+        for _ in form.compress(self.file_):
+            pass
+        return self.file_.size
+
+
+class UploadViewCase(Case):
+    """Requisição completa à view de upload, lida de um arquivo em disco
+
+    Secret e MethodMapping são criados em uma transação desfeita ao fim
+    de cada execução, assim como o registro do upload.
+    """
+
+    source = "csv.gz"
+    uses_db = True
+
+    def setup(self, path):
+        self.atomic = transaction.atomic()
+        self.atomic.__enter__()
+        self.size = os.path.getsize(path)
+        mapping = MethodMapping.objects.create(
+            method="benchmark", uri="/benchmark", schema=SCHEMA
+        )
+        # Sem methods.add, que enviaria o e-mail de boas-vindas
+        secret = Secret.objects.create(
+            username="benchmark-{0}".format(uuid4().hex), email="a@a.com"
+        )
+        Secret.methods.through.objects.create(
+            secret=secret, methodmapping=mapping
+        )
+
+        with open(path, "rb") as fobj:
+            contents_md5 = md5reader(UploadedFile(fobj, size=self.size))
+        self.body = tempfile.TemporaryFile()
+        boundary = uuid4().hex
+        fields = {
+            "nome": secret.username,
+            "SECRET": secret.secret_key,
+            "method": mapping.method,
+            "md5": contents_md5,
+            "filename": os.path.basename(path),
+        }
+        for name, value in fields.items():
+            self.body.write(
+                '--{0}\r\nContent-Disposition: form-data; name="{1}"'
+                "\r\n\r\n{2}\r\n".format(boundary, name, value).encode()
+            )
+        self.body.write(
+            '--{0}\r\nContent-Disposition: form-data; name="file"; '
+            'filename="{1}"\r\nContent-Type: application/gzip\r\n\r\n'.format(
+                boundary, os.path.basename(path)
+            ).encode()
+        )
+        with open(path, "rb") as fobj:
+            shutil.copyfileobj(fobj, self.body, 1024 * 1024)
+        self.body.write("\r\n--{0}--\r\n".format(boundary).encode())
+
+        self.environ = {
+            "REQUEST_METHOD": "POST",
+            "PATH_INFO": "/api/upload/",
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "wsgi.url_scheme": "http",
+            "CONTENT_TYPE": "multipart/form-data; boundary=" + boundary,
+            "CONTENT_LENGTH": str(self.body.tell()),
+        }
+        self.body.seek(0)
+
+    def run(self):
+        request = WSGIRequest(dict(self.environ, **{"wsgi.input": self.body}))
+        response = upload(request)
+        if response.status_code != 201:
+            raise AssertionError(response.content.decode())
+        return self.size
+
+    def teardown(self):
+        self.body.close()
+        transaction.set_rollback(True)
+        self.atomic.__exit__(None, None, None)
+
+
+class StartupCase(Case):
+    """Tempo de inicialização de um processo Python novo
+
+    Roda fora da raiz do projeto, como o gunicorn pode rodar, para que
+    dependências do diretório atual apareçam como erro. Sem vazão: só o
+    tempo e o pico de memória contam.
+    """
+
+    source = None
+    rusage = resource.RUSAGE_CHILDREN
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def setup(self, path):
+        pass
+
+    def run(self):
+        subprocess.run(
+            [sys.executable, "-c", self.code],
+            cwd=tempfile.gettempdir(),
+            env=dict(os.environ, PYTHONPATH=self.root),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=True,
+        )
+
+    def teardown(self):
+        pass
+
+
+class CheckCase(StartupCase):
+    code = (
+        "from django.core.management import execute_from_command_line\n"
+        "execute_from_command_line(['manage.py', 'check'])"
+    )
+
+
+class WSGICase(StartupCase):
+    # Como um worker antes da primeira requisição: aplicação e urls
+    code = (
+        "from datalakecadg.wsgi import application\n"
+        "from django.urls import get_resolver\n"
+        "get_resolver().url_patterns"
+    )
+
+
+CASES = {
+    "md5reader": MD5ReaderCase,
+    "read_csv_sample": CSVSampleCase,
+    "is_data_valid": DataValidCase,
+    "validate_python": PythonValidationCase,
+    "convert_to_csv": ConvertToCSVCase,
+    "compress": CompressCase,
+    "upload": UploadViewCase,
+    "startup_check": CheckCase,
+    "startup_wsgi": WSGICase,
+}
+# pyarrow é opcional
+if columnar.available:
+    CASES["validate_columnar"] = ColumnarValidationCase
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux informa em KB, macOS em bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure(case_class, path, repeat, hdfs_root):
+    timings = []
+    size = 0
+    hdfsclient = FakeHDFSClient(hdfs_root)
+    with mock.patch("api.utils.hdfsclient", hdfsclient), mock.patch(
+        "api.ledger.hdfsclient", hdfsclient
+    ):
+        for _ in range(repeat):
+            case = case_class()
+            case.setup(path)
+            try:
+                started = monotonic()
+                size = case.run()
+                timings.append(monotonic() - started)
+            finally:
+                case.teardown()
+            shutil.rmtree(hdfs_root, ignore_errors=True)
+
+    return {
+        "seconds": timings,
+        "bytes": size,
+        "peak_rss": peak_rss(case_class.rusage),
+    }
+
+
+def _child(connection, case_class, path, repeat, hdfs_root):
+    try:
+        connection.send(measure(case_class, path, repeat, hdfs_root))
+    except BaseException as error:
+        connection.send({"error": repr(error)})
+    finally:
+        connection.close()
+
+
+def run_case(name, path, repeat, workdir):
+    """Mede o caso `name` com o arquivo `path` em um processo novo"""
+    case_class = CASES[name]
+    if case_class.uses_db:
+        # O processo filho não pode herdar as conexões abertas
+        connections.close_all()
+
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    hdfs_root = os.path.join(workdir, "hdfs")
+    process = context.Process(
+        target=_child, args=(sender, case_class, path, repeat, hdfs_root)
+    )
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {"error": "processo terminou sem resultado"}
+    process.join()
+
+    if "error" in result:
+        raise RuntimeError("{0}: {1}".format(name, result["error"]))
+
+    seconds = statistics.median(result["seconds"])
+    throughput = None
+    if result["bytes"] and seconds:
+        throughput = result["bytes"] / seconds
+    return {
+        "case": name,
+        "size": os.path.getsize(path) if path else None,
+        "seconds": seconds,
+        "throughput": throughput,
+        "peak_rss": result["peak_rss"],
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as fobj:
+        return [json.loads(line) for line in fobj if line.strip()]
+
+
+def find_regressions(result, history, threshold=0.1, window=5):
+    """Compara `result` com a mediana das últimas `window` execuções"""
+    previous = [
+        item
+        for item in history
+        if item["case"] == result["case"]
+        and item["dataset"] == result["dataset"]
+    ][-window:]
+    if not previous:
+        return []
+
+    regressions = []
+    if result["throughput"] is None:
+        seconds = statistics.median(item["seconds"] for item in previous)
+        if result["seconds"] > seconds * (1 + threshold):
+            regressions.append(
+                "tempo {0:.3f}s, mediana anterior {1:.3f}s".format(
+                    result["seconds"], seconds
+                )
+            )
+    else:
+        throughput = statistics.median(
+            item["throughput"] for item in previous if item["throughput"]
+        )
+        if result["throughput"] < throughput * (1 - threshold):
+            regressions.append(
+                "vazão {0:.1f} MB/s, mediana anterior {1:.1f} MB/s".format(
+                    result["throughput"] / UNITS["MB"],
+                    throughput / UNITS["MB"],
+                )
+            )
+
+    rss = statistics.median(item["peak_rss"] for item in previous)
+    if result["peak_rss"] > rss * (1 + threshold):
+        regressions.append(
+            "pico de memória {0} MB, mediana anterior {1} MB".format(
+                result["peak_rss"] // UNITS["MB"], int(rss) // UNITS["MB"]
+            )
+        )
+
+    return regressions
+
+
+def run_benchmark(
+    cases, sizes, workdir, history_path, repeat=3, threshold=0.1, log=print
+):
+    """Roda os casos para cada tamanho e registra os resultados
+
+    Devolve a lista de resultados; os que pioraram trazem as mensagens em
+    `regressions`.
+    """
+    history = load_history(history_path)
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    commit = current_commit()
+    results = []
+
+    def record(name, path, dataset):
+        result = run_case(name, path, repeat, workdir)
+        result.update(dataset=dataset, timestamp=timestamp, commit=commit)
+        result["regressions"] = find_regressions(result, history, threshold)
+        results.append(result)
+
+        summary = "{0} {1}: {2:.3f}s".format(name, dataset, result["seconds"])
+        if result["throughput"] is not None:
+            summary += ", {0:.1f} MB/s".format(
+                result["throughput"] / UNITS["MB"]
+            )
+        summary += ", pico de memória {0} MB".format(
+            result["peak_rss"] // UNITS["MB"]
+        )
+        if result["regressions"]:
+            summary += " REGRESSÃO: " + "; ".join(result["regressions"])
+        log(summary)
+
+    for name in cases:
+        if CASES[name].source is None:
+            record(name, None, "-")
+
+    for size in sizes:
+        files = SyntheticFiles(workdir, size)
+        for name in cases:
+            if CASES[name].source is None:
+                continue
+            try:
+                path = files.path(CASES[name].source)
+            except SkipCase as reason:
+                log(
+                    "{0} {1}: ignorado, {2}".format(
+                        name, format_size(size), reason
+                    )
+                )
+                continue
+
+            record(name, path, format_size(size))
+
+    with open(history_path, "a") as fobj:
+        for result in results:
+            item = {
+                key: value
+                for key, value in result.items()
+                if key != "regressions"
+            }
+            fobj.write(json.dumps(item) + "\n")
+
+    return results
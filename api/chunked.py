@@ -0,0 +1,81 @@
+import os
+import re
+import shutil
+from hashlib import md5
+
+from django.conf import settings
+
+CHUNK_NAME = "{0:08d}"
+CHUNK_RE = re.compile(r"\d{8}")
+MAX_CHUNK_NUMBER = 10 ** 8 - 1
+
+
+def chunk_dir(upload):
+    return os.path.join(settings.UPLOAD_SPOOL_DIR, "chunked", str(upload.id))
+
+
+def save_chunk(upload, number, file_):
+    """Grava a parte `number` no spool e devolve o md5 do conteúdo
+
+    A parte é escrita em um arquivo temporário e só depois renomeada, então
+    reenviar uma parte interrompida substitui a anterior por inteiro. Partes
+    recebidas por SpoolingUploadHandler já estão em disco com o md5
+    calculado: o arquivo é só movido para o spool.
+    """
+    directory = chunk_dir(upload)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, CHUNK_NAME.format(number))
+    partial_path = path + ".part"
+
+    digest = getattr(file_, "md5", None)
+    if digest is not None and hasattr(file_, "temporary_file_path"):
+        shutil.move(file_.temporary_file_path(), partial_path)
+    else:
+        hash_md5 = md5()
+        with open(partial_path, "wb") as fobj:
+            for chunk in file_.chunks():
+                hash_md5.update(chunk)
+                fobj.write(chunk)
+        digest = hash_md5.hexdigest()
+
+    os.replace(partial_path, path)
+    return digest
+
+
+def delete_chunk(upload, number):
+    path = os.path.join(chunk_dir(upload), CHUNK_NAME.format(number))
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def received_chunks(upload):
+    directory = chunk_dir(upload)
+    if not os.path.isdir(directory):
+        return []
+
+    return sorted(
+        int(name) for name in os.listdir(directory) if CHUNK_RE.fullmatch(name)
+    )
+
+
+def missing_chunks(numbers):
+    expected = range(1, max(numbers, default=0) + 1)
+    return sorted(set(expected) - set(numbers))
+
+
+def assemble_chunks(upload, destination):
+    """Junta as partes, em ordem, em `destination` e devolve o md5 final"""
+    hash_md5 = md5()
+    with open(destination, "wb") as output:
+        for number in received_chunks(upload):
+            path = os.path.join(chunk_dir(upload), CHUNK_NAME.format(number))
+            with open(path, "rb") as fobj:
+                for chunk in iter(lambda: fobj.read(1024 * 1024), b""):
+                    hash_md5.update(chunk)
+                    output.write(chunk)
+
+    return hash_md5.hexdigest()
+
+
+def discard_chunks(upload):
+    shutil.rmtree(chunk_dir(upload), ignore_errors=True)
@@ -1,4 +1,58 @@
 from django.conf import settings
+from django.utils.functional import SimpleLazyObject, empty
 from hdfs.ext.kerberos import KerberosClient
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-hdfsclient = KerberosClient(settings.HDFS_URL)
+# Apenas requisições sem corpo podem ser repetidas com segurança. Erros de
+# conexão são repetidos para qualquer método, já que nada foi enviado.
+RETRY_METHODS = frozenset(["GET", "HEAD", "DELETE", "OPTIONS"])
+RETRY_STATUS = (502, 503, 504)
+
+
+def build_session():
+    retries = Retry(
+        total=settings.HDFS_MAX_RETRIES,
+        backoff_factor=settings.HDFS_RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUS,
+        method_whitelist=RETRY_METHODS,
+        raise_on_status=False,
+    )
+    # Um pool por host (namenode e datanodes), com conexões mantidas abertas
+    # entre as requisições das threads do worker
+    adapter = HTTPAdapter(
+        pool_connections=settings.HDFS_POOL_CONNECTIONS,
+        pool_maxsize=settings.HDFS_POOL_MAXSIZE,
+        max_retries=retries,
+    )
+    session = Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def build_hdfsclient():
+    return KerberosClient(
+        settings.HDFS_URL,
+        max_concurrency=settings.HDFS_POOL_MAXSIZE,
+        timeout=settings.HDFS_TIMEOUT,
+        session=build_session(),
+        force_preemptive=settings.HDFS_KERBEROS_PREEMPTIVE,
+    )
+
+
+# Criado no primeiro uso, e não na importação, para não atrasar o boot dos
+# workers nem exigir o HDFS em comandos que não o usam
+hdfsclient = SimpleLazyObject(build_hdfsclient)
+
+
+def close_hdfs_connections():
+    """Fecha as conexões mantidas pela sessão do cliente, se ele já existe
+
+    Usado antes do fork dos workers do gunicorn: sockets herdados seriam
+    compartilhados entre os processos. A sessão continua utilizável e abre
+    novas conexões quando necessário.
+    """
+    if hdfsclient._wrapped is not empty:
+        hdfsclient._session.close()
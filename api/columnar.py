@@ -0,0 +1,368 @@
+"""Validação colunar do arquivo completo com pyarrow
+
+Os blocos do csv são lidos como arrays de texto e cada restrição do Table
+Schema vira uma operação sobre a coluna inteira. Essas operações só apontam
+as células suspeitas: o erro de cada uma é montado por FieldChecker, então
+o resultado é o mesmo da validação linha a linha. Quando uma checagem não
+tem equivalente colunar (formatos de data além de %Y %m %d %H %M %S,
+unique em colunas que não são string ou integer, padrões fora do RE2...)
+todas as células da coluna são checadas por FieldChecker.
+
+pyarrow é opcional; sem ele `available` é False e validate_file usa só a
+validação linha a linha.
+"""
+import gzip
+import re
+from itertools import compress
+
+from api.validation import (
+    FALSE_VALUES,
+    TRUE_VALUES,
+    TableChecker,
+    error_position,
+    make_error,
+    unique_key,
+)
+
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import csv as pa_csv
+except ImportError:
+    pa = None
+
+available = pa is not None
+
+BLOCK_SIZE = 4 * 1024 * 1024
+INTEGER_PATTERN = r"^[+-]?\d+$"
+NUMBER_PATTERN = r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$"
+# Diretivas de data com largura fixa, iguais no strftime do arrow e no
+# strptime do python
+DATE_DIRECTIVES = re.compile(r"%[YmdHMS]")
+
+
+class StructureError(Exception):
+    """O bloco não tem o número de colunas do schema"""
+
+
+class ColumnFilter:
+    """Marca as células de uma coluna que podem conter erro
+
+    `suspects` devolve uma máscara numpy ou None quando a coluna inteira
+    precisa ser checada por FieldChecker. A máscara nunca deixa de marcar
+    uma célula com erro; células marcadas sem erro são descartadas depois.
+    """
+
+    def __init__(self, field, checker):
+        self.checker = checker
+        self.type = checker.type
+        self.constraints = checker.constraints
+        self.missing_values = pa.array(sorted(checker.missing_values))
+        self.type_pattern = None
+        self.numeric = False
+        self.boolean_values = None
+        self.date_format = None
+        self.unique = False
+        self.columnar = self.build(field)
+
+    def build(self, field):
+        if self.constraints.get("unique", False):
+            if self.type not in ("string", "integer"):
+                return False
+            self.unique = True
+
+        if self.type in ("integer", "year"):
+            self.type_pattern = INTEGER_PATTERN
+            self.numeric = self.type == "integer"
+        elif self.type == "number":
+            if field.get("decimalChar", ".") != ".":
+                return False
+            if field.get("groupChar", ""):
+                return False
+            self.type_pattern = NUMBER_PATTERN
+            self.numeric = True
+        elif self.type == "boolean":
+            self.boolean_values = pa.array(
+                field.get("trueValues", TRUE_VALUES)
+                + field.get("falseValues", FALSE_VALUES)
+            )
+        elif self.checker.strptime_format is not None:
+            self.date_format = self.checker.strptime_format
+            if "%" in DATE_DIRECTIVES.sub("", self.date_format):
+                return False
+        elif self.checker.cast is not str:
+            return False
+
+        if "minimum" in self.constraints or "maximum" in self.constraints:
+            if not self.numeric:
+                return False
+
+        enum = self.constraints.get("enum")
+        if enum is not None and not all(isinstance(i, str) for i in enum):
+            return False
+
+        if "pattern" in self.constraints:
+            try:
+                pc.match_substring_regex(
+                    pa.array([""]), "^(?:{0})$".format(self.pattern)
+                )
+            except pa.ArrowInvalid:
+                # Padrão sem equivalente no RE2
+                return False
+
+        return True
+
+    @property
+    def pattern(self):
+        return self.constraints["pattern"]
+
+    def suspects(self, column):
+        if not self.columnar:
+            return None
+
+        missing = to_numpy(pc.is_in(column, value_set=self.missing_values))
+        invalid = np.zeros(len(column), dtype=bool)
+        if self.type_pattern is not None:
+            invalid |= ~to_numpy(
+                pc.match_substring_regex(column, self.type_pattern)
+            )
+        elif self.boolean_values is not None:
+            invalid |= ~to_numpy(
+                pc.is_in(column, value_set=self.boolean_values)
+            )
+        elif self.date_format is not None:
+            invalid |= self.invalid_dates(column)
+
+        if "pattern" in self.constraints:
+            invalid |= ~to_numpy(
+                pc.match_substring_regex(
+                    column, "^(?:{0})$".format(self.pattern)
+                )
+            )
+        if "enum" in self.constraints:
+            invalid |= ~to_numpy(
+                pc.is_in(column, value_set=pa.array(self.constraints["enum"]))
+            )
+        if "minLength" in self.constraints:
+            invalid |= to_numpy(
+                pc.less(
+                    pc.utf8_length(column), self.constraints["minLength"]
+                )
+            )
+        if "maxLength" in self.constraints:
+            invalid |= to_numpy(
+                pc.greater(
+                    pc.utf8_length(column), self.constraints["maxLength"]
+                )
+            )
+        if self.numeric:
+            invalid |= self.out_of_range(column, ~(invalid | missing))
+
+        if self.checker.required:
+            return invalid | missing
+        return invalid & ~missing
+
+    def invalid_dates(self, column):
+        parsed = pc.strptime(
+            column, format=self.date_format, unit="s", error_is_null=True
+        )
+        # O strptime do arrow aceita 30 de fevereiro, espaços antes do valor
+        # e o ano 0; só vale a data que volta ao mesmo texto
+        valid = pc.equal(pc.strftime(parsed, format=self.date_format), column)
+        if "%Y" in self.date_format:
+            valid = pc.and_(valid, pc.greater_equal(pc.year(parsed), 1))
+        return ~to_numpy(pc.fill_null(valid, False))
+
+    def repeated(self, column, suspects, blank, first_row_number):
+        """Marca as células de unique cujo valor aparece mais de uma vez
+
+        Os valores que aparecem uma única vez, sem outro erro, são
+        registrados direto em FieldChecker.seen; os demais passam por
+        check_cell na ordem do arquivo. Devolve None quando a coluna inteira
+        precisa de check_cell (inteiro fora do int64).
+        """
+        candidates = ~blank & ~to_numpy(
+            pc.is_in(column, value_set=self.missing_values)
+        )
+        if self.type == "integer":
+            candidates &= to_numpy(
+                pc.match_substring_regex(column, INTEGER_PATTERN)
+            )
+        indices = np.flatnonzero(candidates)
+        values = column.take(pa.array(indices))
+        if self.type == "integer":
+            try:
+                values = pc.cast(values, pa.int64())
+            except pa.ArrowInvalid:
+                return None
+
+        counts = pc.value_counts(values)
+        repeated = to_numpy(
+            pc.is_in(
+                values,
+                value_set=counts.field("values").filter(
+                    pc.greater(counts.field("counts"), 1)
+                ),
+            )
+        )
+        keys = values.to_pylist()
+        if self.type == "string":
+            keys = list(map(unique_key, keys))
+        seen = self.checker.seen
+        earlier = seen.keys() & set(keys)
+        if earlier:
+            repeated |= np.array([key in earlier for key in keys], dtype=bool)
+
+        fresh = (~repeated & ~suspects[indices]).tolist()
+        rows = (indices + first_row_number).tolist()
+        seen.update(zip(compress(keys, fresh), compress(rows, fresh)))
+
+        result = np.zeros(len(column), dtype=bool)
+        result[indices[repeated]] = True
+        return result
+
+    def out_of_range(self, column, valid):
+        result = np.zeros(len(column), dtype=bool)
+        bounds = [
+            (name, self.checker.cast_constraint(self.constraints[name]))
+            for name in ("minimum", "maximum")
+            if name in self.constraints
+        ]
+        if not bounds:
+            return result
+
+        indices = np.flatnonzero(valid)
+        try:
+            values = to_numpy(
+                pc.cast(column.take(pa.array(indices)), pa.float64())
+            )
+        except pa.ArrowInvalid:
+            result[indices] = True
+            return result
+
+        for name, bound in bounds:
+            # Inclui o limite: o arredondamento para float não esconde erros
+            if name == "minimum":
+                result[indices] |= values <= float(bound)
+            else:
+                result[indices] |= values >= float(bound)
+
+        return result
+
+
+class ColumnarChecker:
+    """Valida os blocos lidos pelo pyarrow com os mesmos erros de TableChecker
+    """
+
+    def __init__(self, descriptor):
+        self.table = TableChecker(descriptor)
+        fields = descriptor.get("fields", [])
+        self.filters = [
+            ColumnFilter(field, checker)
+            for field, checker in zip(fields, self.table.fields)
+        ]
+
+    def check(self, batch, first_row_number):
+        if batch.num_columns != self.table.width:
+            raise StructureError()
+
+        columns = batch.columns
+        rows = {}
+
+        def row(index):
+            if index not in rows:
+                rows[index] = [column[index].as_py() for column in columns]
+            return rows[index]
+
+        blank = np.ones(batch.num_rows, dtype=bool)
+        for column in columns:
+            blank &= to_numpy(pc.equal(column, ""))
+
+        errors = [
+            make_error("blank-row", row(index), first_row_number + index)
+            for index in np.flatnonzero(blank).tolist()
+        ]
+        for checker, column_filter, column in zip(
+            self.table.fields, self.filters, columns
+        ):
+            suspects = column_filter.suspects(column)
+            if suspects is not None and column_filter.unique:
+                repeated = column_filter.repeated(
+                    column, suspects, blank, first_row_number
+                )
+                suspects = None if repeated is None else suspects | repeated
+            if suspects is None:
+                values = column.to_pylist()
+                indices = np.flatnonzero(~blank)
+            else:
+                values = None
+                indices = np.flatnonzero(suspects & ~blank)
+
+            for index in indices.tolist():
+                if values is not None:
+                    text = values[index]
+                else:
+                    text = column[index].as_py()
+                error = checker.check_cell(
+                    text, row(index), first_row_number + index
+                )
+                if error is not None:
+                    errors.append(error)
+
+        errors.sort(key=error_position)
+        return errors
+
+
+def to_numpy(array):
+    return array.to_numpy(zero_copy_only=False)
+
+
+def open_binary(file_):
+    file_.seek(0)
+    raw = getattr(file_, "file", file_)
+    if file_.name.endswith(".csv.gz"):
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    return raw
+
+
+def validate_columnar(file_, descriptor, max_errors=100):
+    """Mesmo resultado de validation.validate_file usando pyarrow
+
+    Levanta StructureError quando alguma linha não tem o número de colunas
+    do schema; esses arquivos ficam com a validação linha a linha.
+    """
+    checker = ColumnarChecker(descriptor)
+    width = checker.table.width
+    try:
+        reader = pa_csv.open_csv(
+            open_binary(file_),
+            read_options=pa_csv.ReadOptions(
+                skip_rows=1,
+                column_names=["f{0}".format(i) for i in range(width)],
+                block_size=BLOCK_SIZE,
+            ),
+            parse_options=pa_csv.ParseOptions(
+                newlines_in_values=True, ignore_empty_lines=False
+            ),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={
+                    "f{0}".format(i): pa.string() for i in range(width)
+                },
+                strings_can_be_null=False,
+                quoted_strings_can_be_null=False,
+            ),
+        )
+        errors = []
+        row_number = 2
+        for batch in reader:
+            errors.extend(checker.check(batch, row_number))
+            if len(errors) >= max_errors:
+                return errors[:max_errors]
+            row_number += batch.num_rows
+    except pa.ArrowInvalid as error:
+        raise StructureError(str(error))
+    finally:
+        file_.seek(0)
+
+    return errors
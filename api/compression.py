@@ -0,0 +1,156 @@
+import codecs
+import zlib
+from collections import deque
+from time import monotonic
+
+import zstandard
+
+GZIP = "gzip"
+ZSTD = "zstd"
+NONE = "none"
+
+EXTENSIONS = {GZIP: ".gz", ZSTD: ".zst", NONE: ""}
+LEVELS = {GZIP: (1, 9), ZSTD: (1, 22)}
+
+GZIP_WBITS = zlib.MAX_WBITS | 16
+CHUNK_SIZE = 64 * 1024
+BLOCK_SIZE = 1024 * 1024
+
+
+class Passthrough:
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+def gzip_member(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def get_compressor(codec, level):
+    if codec == GZIP:
+        return zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    elif codec == ZSTD:
+        return zstandard.ZstdCompressor(level=level).compressobj()
+
+    return Passthrough()
+
+
+class CompressedStream:
+    """Arquivo somente leitura que comprime `source` conforme é lido
+
+    Pode ser passado diretamente para hdfsclient.write, que envia o conteúdo
+    em blocos sem precisar do arquivo comprimido inteiro em memória. Se
+    `encoding` for informado, `source` é lido como texto e codificado antes
+    da compressão. `size` conta os bytes já lidos; ao fim da leitura é o
+    tamanho do arquivo comprimido. `elapsed` soma os segundos gastos na
+    compressão, fora o tempo de quem consome o stream.
+    """
+
+    def __init__(
+        self,
+        source,
+        codec=GZIP,
+        level=9,
+        encoding=None,
+        chunk_size=CHUNK_SIZE,
+    ):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.compressor = get_compressor(codec, level)
+        self.encoder = (
+            codecs.getincrementalencoder(encoding)() if encoding else None
+        )
+        self.buffer = bytearray()
+        self.eof = False
+        self.size = 0
+        self.elapsed = 0.0
+
+    def _fill(self):
+        data = self.source.read(self.chunk_size)
+        if self.encoder is not None:
+            data = self.encoder.encode(data, final=not data)
+
+        if data:
+            self.buffer += self.compressor.compress(data)
+        else:
+            self.buffer += self.compressor.flush()
+            self.eof = True
+
+    def read(self, size=-1):
+        started = monotonic()
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            self._fill()
+        self.elapsed += monotonic() - started
+
+        if size < 0:
+            size = len(self.buffer)
+        chunk = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.size += len(chunk)
+        return chunk
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class ParallelGzipStream(CompressedStream):
+    """Variante de CompressedStream que comprime blocos em paralelo
+
+    Como no pigz, o arquivo é dividido em blocos de `block_size` e cada bloco
+    vira um membro gzip independente, comprimido em `executor` (o zlib libera
+    o GIL). A concatenação dos membros, na ordem original, é um .gz válido.
+    Apenas `max_pending` blocos ficam em memória ao mesmo tempo.
+    """
+
+    def __init__(
+        self,
+        source,
+        executor,
+        level=9,
+        encoding=None,
+        chunk_size=CHUNK_SIZE,
+        block_size=BLOCK_SIZE,
+        max_pending=8,
+    ):
+        super().__init__(
+            source,
+            codec=GZIP,
+            level=level,
+            encoding=encoding,
+            chunk_size=chunk_size,
+        )
+        self.executor = executor
+        self.level = level
+        self.block_size = block_size
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.source_eof = False
+
+    def _read_block(self):
+        data = self.source.read(self.block_size)
+        if self.encoder is not None:
+            data = self.encoder.encode(data, final=not data)
+        return data
+
+    def _fill(self):
+        while not self.source_eof and len(self.pending) < self.max_pending:
+            block = self._read_block()
+            if not block:
+                self.source_eof = True
+                break
+            self.pending.append(
+                self.executor.submit(gzip_member, block, self.level)
+            )
+
+        if self.pending:
+            self.buffer += self.pending.popleft().result()
+        else:
+            self.eof = True
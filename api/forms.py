@@ -1,12 +1,34 @@
 import csv
-import gzip
-from io import BytesIO, StringIO
+from tempfile import SpooledTemporaryFile
 
-import xlrd
-from api.utils import FILE_ENCODING, is_data_valid, md5reader
+from api.compression import (
+    EXTENSIONS,
+    GZIP,
+    CompressedStream,
+    ParallelGzipStream,
+)
+from api.metrics import stage
+from api.utils import (
+    CSVSampler,
+    FILE_ENCODING,
+    StagedHDFSWriter,
+    UNRESOLVED,
+    discard_on_error,
+    feed_sinks,
+    is_data_valid,
+    md5reader,
+    resolve_method,
+    thread_pool,
+    xlsx_cell_value,
+)
 from django import forms
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
 from django.forms.utils import ErrorDict
+from methodmapping.models import MethodMapping
+from openpyxl import load_workbook
+
+compress_executor = thread_pool(settings.GZIP_PARALLEL_WORKERS)
 
 
 class FileUploadForm(forms.Form):
@@ -18,14 +40,73 @@ class FileUploadForm(forms.Form):
     md5 = forms.CharField(max_length=32, label="Valor MD5", required=False)
     file = forms.FileField(label="Arquivo")
 
-    def __init__(self, disable_md5=False, good_exts=None, *args, **kwargs):
+    def __init__(
+        self,
+        disable_md5=False,
+        good_exts=None,
+        staged=False,
+        mapping=UNRESOLVED,
+        *args,
+        **kwargs
+    ):
         super().__init__(*args, **kwargs)
         self.disable_md5 = disable_md5
+        self.staged = staged
+        self.mapping_resolved = mapping is not UNRESOLVED
+        self.mapping = mapping if self.mapping_resolved else None
+        self.sampler = None
+        self.staging = None
         self.md5_ = self.prepare_md5(self.files.get("file"))
         self.good_exts = good_exts or (".csv.gz",)
 
     def prepare_md5(self, file_):
-        return md5reader(file_) if not self.disable_md5 and file_ else ""
+        if not file_:
+            return ""
+
+        # SpoolingUploadHandler já calculou md5 e amostra no recebimento
+        precomputed = getattr(file_, "md5", None)
+        if precomputed is not None:
+            self.sampler = file_.sampler
+        if self.disable_md5:
+            # O md5 não é conferido, mas o já calculado vai para o histórico
+            return precomputed or ""
+
+        # A amostra usada na validação do schema é extraída na mesma leitura
+        # que calcula o md5
+        sinks = []
+        name = getattr(file_, "name", "")
+        if precomputed is None and name.endswith((".csv", ".csv.gz")):
+            self.sampler = CSVSampler(
+                settings.CSV_SAMPLE_SIZE,
+                compressed=file_.name.endswith(".gz"),
+            )
+            sinks.append(self.sampler)
+
+        # Arquivos .csv.gz são enviados como recebidos, então podem seguir
+        # para o HDFS durante a leitura
+        if self.staged and file_.name.endswith(".csv.gz"):
+            mapping = self.get_mapping(
+                self.data.get("nome"), self.data.get("method")
+            )
+            if mapping is not None:
+                self.staging = StagedHDFSWriter(mapping.uri)
+                sinks.append(self.staging)
+
+        with discard_on_error(self.staging):
+            if precomputed is None:
+                return md5reader(file_, sinks=sinks)
+
+            if sinks:
+                feed_sinks(file_, sinks)
+        return precomputed
+
+    def get_mapping(self, username, method):
+        # O método pode vir resolvido pela view; senão é buscado uma única
+        # vez, mesmo quando não foi liberado para o usuário
+        if not self.mapping_resolved:
+            _, self.mapping = resolve_method(username, method)
+            self.mapping_resolved = True
+        return self.mapping
 
     # TODO: Talvez faça sentido criar uma classe sem herdar de forms.Form
     # e chamaar os métods de validação de cada campo.
@@ -87,6 +168,12 @@ class FileUploadForm(forms.Form):
     def is_xlsx(self):
         return self.files["file"].name.endswith(".xlsx")
 
+    @property
+    def compression(self):
+        # Sem método cadastrado vale o padrão do modelo
+        mapping = self.mapping or MethodMapping()
+        return mapping.compression, mapping.compression_level
+
     @property
     def base_return(self):
         if self.is_bound:
@@ -126,47 +213,67 @@ class FileUploadForm(forms.Form):
         return filename
 
     def compress(self, file_):
+        codec, level = self.compression
+        # O csv convertido do xlsx é texto
+        encoding = FILE_ENCODING if self.is_xlsx else None
         file_.seek(0)
-        if isinstance(file_.file, StringIO):
-            c_file = BytesIO(file_.read().encode(FILE_ENCODING))
-        else:
-            c_file = file_.file
+        if codec == GZIP and file_.size >= settings.GZIP_PARALLEL_THRESHOLD:
+            return ParallelGzipStream(
+                file_.file, compress_executor, level=level, encoding=encoding
+            )
 
-        return gzip.compress(c_file.read())
+        return CompressedStream(
+            file_.file, codec=codec, level=level, encoding=encoding
+        )
 
     def convert_to_csv(self, file_):
-        wb = xlrd.open_workbook(file_contents=file_.read())
-        if len(wb.sheets()) > 1:
-            raise forms.ValidationError(
-                "Os arquivos devem conter apenas uma aba. Verifique também as abas escondidas"
-            )
+        # O modo read_only lê a planilha linha a linha e o csv só fica em
+        # memória até FILE_UPLOAD_MAX_MEMORY_SIZE; acima disso vai para disco
+        with stage("xlsx_convert", file_.size):
+            wb = load_workbook(file_, read_only=True, data_only=True)
+            try:
+                if len(wb.sheetnames) > 1:
+                    raise forms.ValidationError(
+                        "Os arquivos devem conter apenas uma aba. Verifique também as abas escondidas"
+                    )
 
-        sh = wb.sheet_by_index(0)
-        output = StringIO()
-        writer = csv.writer(output)
-        for rownum in range(sh.nrows):
-            writer.writerow(sh.row_values(rownum))
+                output = SpooledTemporaryFile(
+                    max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+                    mode="w+",
+                    newline="",
+                    encoding=FILE_ENCODING,
+                )
+                writer = csv.writer(output)
+                rows = wb.worksheets[0].iter_rows(values_only=True)
+                for row in rows:
+                    writer.writerow([xlsx_cell_value(value) for value in row])
+            finally:
+                wb.close()
 
         size = output.tell()
         output.seek(0)
-        in_memory = InMemoryUploadedFile(
+        return UploadedFile(
             output,
             name=file_.name,
             content_type="text/csv",
             size=size,
-            field_name=file_.field_name,
             charset=file_.charset,
         )
-        in_memory.seek(0)
-        return in_memory
 
     def clean(self):
         cleaned_data = super().clean()
+        mapping = self.get_mapping(
+            cleaned_data["nome"], cleaned_data["method"]
+        )
         if self.is_xlsx:
             cleaned_data["file"] = self.convert_to_csv(cleaned_data["file"])
 
         valid_data, status = is_data_valid(
-            cleaned_data["nome"], cleaned_data["method"], cleaned_data["file"]
+            cleaned_data["nome"],
+            cleaned_data["method"],
+            cleaned_data["file"],
+            sampler=self.sampler,
+            mapping=mapping,
         )
         if not valid_data:
             self._errors["schema"] = self.error_class(
@@ -179,6 +286,14 @@ class FileUploadForm(forms.Form):
                 ".xlsx", ".csv"
             )
             cleaned_data["file"] = self.compress(cleaned_data["file"])
-            cleaned_data["filename"] = cleaned_data["filename"] + ".gz"
+            codec, _ = self.compression
+            cleaned_data["filename"] += EXTENSIONS[codec]
 
         return cleaned_data
+
+
+class ChunkedUploadForm(forms.Form):
+    nome = forms.CharField(max_length=255, label="Nome")
+    method = forms.CharField(max_length=255, label="Método")
+    filename = forms.CharField(max_length=255, label="Nome do arquivo")
+    md5 = forms.CharField(min_length=32, max_length=32, label="Valor MD5")
@@ -0,0 +1,270 @@
+import json
+import logging
+import os
+import shutil
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from api.chunked import assemble_chunks, discard_chunks, received_chunks
+from api.forms import FileUploadForm
+from api.ledger import hdfs_timer, record_upload, timer
+from api.metrics import current_context, upload_context
+from api.models import ChunkedUpload, Upload, UploadJob
+from api.utils import (
+    discard_on_error,
+    get_destination,
+    green,
+    thread_pool,
+    upload_to_hdfs,
+)
+
+logger = logging.getLogger(__name__)
+executor = thread_pool(settings.UPLOAD_WORKERS)
+# Validação, compressão e envio ao HDFS das requisições síncronas no worker
+# gevent, com tantos uploads simultâneos quanto as threads do gthread
+request_executor = thread_pool(settings.GUNICORN_THREADS)
+
+
+def job_spool_path(job_id, filename):
+    job_dir = os.path.join(settings.UPLOAD_SPOOL_DIR, str(job_id))
+    os.makedirs(job_dir, exist_ok=True)
+    return os.path.join(job_dir, os.path.basename(filename))
+
+
+def spool_upload(job_id, file_):
+    spool_path = job_spool_path(job_id, file_.name)
+
+    # Arquivos grandes já estão em disco: basta movê-los para o spool
+    if hasattr(file_, "temporary_file_path"):
+        shutil.move(file_.temporary_file_path(), spool_path)
+    else:
+        with open(spool_path, "wb") as fobj:
+            for chunk in file_.chunks():
+                fobj.write(chunk)
+
+    return spool_path
+
+
+def enqueue_upload(data, file_):
+    job = UploadJob(
+        username=data.get("nome", ""),
+        method=data.get("method", ""),
+        filename=data.get("filename", ""),
+        md5=data.get("md5", ""),
+    )
+    job.spool_path = spool_upload(job.id, file_)
+    return submit_job(job)
+
+
+def submit_job(job):
+    job.save()
+    transaction.on_commit(lambda: executor.submit(run_queued_job, job.id))
+    return job
+
+
+def commit_chunked_upload(upload):
+    """Finaliza `upload` e enfileira o job do arquivo completo
+
+    As partes são juntadas e conferidas com o md5 informado no início do
+    upload pelo próprio job (assemble_job_file), fora da requisição.
+    Devolve o UploadJob criado, ou None se o upload já foi finalizado.
+    """
+    claimed = ChunkedUpload.objects.filter(
+        id=upload.id, status=ChunkedUpload.OPEN
+    ).update(status=ChunkedUpload.COMMITTED)
+    if not claimed:
+        return None
+
+    job = UploadJob(
+        username=upload.username,
+        method=upload.method,
+        filename=upload.filename,
+        md5=upload.md5,
+    )
+    job.spool_path = job_spool_path(job.id, upload.filename)
+    # O job só começa depois que o upload aponta para ele
+    with transaction.atomic():
+        submit_job(job)
+        ChunkedUpload.objects.filter(id=upload.id).update(job=job)
+    return job
+
+
+def assemble_job_file(job):
+    """Junta no spool de `job` as partes do upload em partes, se houver
+
+    Devolve o md5 do arquivo montado quando ele não confere com o informado
+    no início do upload; nesse caso as partes continuam disponíveis e o
+    upload volta a aceitar partes e commit. As partes só são removidas
+    depois de juntadas, então um job reenfileirado junta tudo de novo.
+    """
+    upload = ChunkedUpload.objects.filter(job=job).first()
+    if upload is None or not received_chunks(upload):
+        return None
+
+    digest = assemble_chunks(upload, job.spool_path)
+    if digest != upload.md5:
+        ChunkedUpload.objects.filter(id=upload.id).update(
+            status=ChunkedUpload.OPEN
+        )
+        return digest
+
+    discard_chunks(upload)
+    return None
+
+
+def run_blocking(func, *args, **kwargs):
+    """Executa `func` fora do loop de eventos quando o worker é gevent
+
+    O greenlet da requisição espera o resultado sem travar os demais, que
+    continuam recebendo seus arquivos. Nos outros workers `func` roda na
+    própria thread da requisição.
+    """
+    if not green():
+        return func(*args, **kwargs)
+
+    return request_executor.submit(
+        run_in_thread, current_context(), func, args, kwargs
+    ).result()
+
+
+def run_in_thread(context, func, args, kwargs):
+    close_old_connections()
+    try:
+        with upload_context(**context):
+            return func(*args, **kwargs)
+    finally:
+        connection.close()
+
+
+def run_queued_job(job_id):
+    # As threads do pool não passam pelo ciclo de request que abre e fecha
+    # as conexões com o banco
+    close_old_connections()
+    try:
+        run_upload_job(job_id)
+    finally:
+        connection.close()
+
+
+def requeue_stale_jobs(timeout=None):
+    """Devolve à fila os jobs em processamento há mais de `timeout` segundos
+
+    São jobs de um worker encerrado no meio do processamento; o arquivo
+    continua no spool. Devolve a quantidade de jobs reenfileirados.
+    """
+    if timeout is None:
+        timeout = settings.UPLOAD_JOB_TIMEOUT
+    return UploadJob.objects.filter(
+        status=UploadJob.RUNNING,
+        updated_at__lt=timezone.now() - timedelta(seconds=timeout),
+    ).update(status=UploadJob.PENDING, updated_at=timezone.now())
+
+
+def run_upload_job(job_id):
+    # update() não atualiza updated_at, que marca o início do processamento
+    claimed = UploadJob.objects.filter(
+        id=job_id, status=UploadJob.PENDING
+    ).update(status=UploadJob.RUNNING, updated_at=timezone.now())
+    if not claimed:
+        return
+
+    job = UploadJob.objects.get(id=job_id)
+    try:
+        digest = assemble_job_file(job)
+        if digest is not None:
+            job.status = UploadJob.DONE
+            job.status_code = 400
+            job.result = {
+                "md5": digest,
+                "error": {"md5": ["valor md5 não confere!"]},
+            }
+            return
+
+        with open(job.spool_path, "rb") as fobj, upload_context(
+            username=job.username, method=job.method, job=str(job.id)
+        ):
+            file_ = UploadedFile(
+                fobj,
+                name=os.path.basename(job.spool_path),
+                size=os.path.getsize(job.spool_path),
+            )
+            form = FileUploadForm(
+                data={
+                    "nome": job.username,
+                    "method": job.method,
+                    "filename": job.filename,
+                    "md5": job.md5,
+                },
+                files={"file": file_},
+                staged=settings.HDFS_STAGED_WRITES,
+            )
+            with discard_on_error(form.staging):
+                filename = job.filename or file_.name
+                timings = {}
+                with timer(timings, "validation_time"):
+                    valid = form.is_valid()
+
+                if valid:
+                    destination = get_destination(
+                        form.cleaned_data["nome"],
+                        form.cleaned_data["method"],
+                        mapping=form.mapping,
+                    )
+                    with hdfs_timer(timings, form.files["file"]):
+                        upload_to_hdfs(
+                            form.files["file"],
+                            form.cleaned_data["filename"],
+                            destination,
+                            staging=form.staging,
+                        )
+                    record_upload(
+                        job.username,
+                        job.method,
+                        filename,
+                        form.md5_,
+                        os.path.join(destination, form.cleaned_data["filename"]),
+                        raw_size=file_.size,
+                        compressed_size=file_.size,
+                        **timings
+                    )
+                    logger.info(
+                        "username %s -> %s successfully uploaded to HDFS"
+                        % (
+                            form.cleaned_data["nome"],
+                            form.cleaned_data["filename"],
+                        )
+                    )
+                else:
+                    if form.staging is not None:
+                        form.staging.discard()
+                    record_upload(
+                        job.username,
+                        job.method,
+                        filename,
+                        form.md5_,
+                        status=Upload.INVALID,
+                        raw_size=file_.size,
+                        **timings
+                    )
+
+        job.status = UploadJob.DONE
+        job.status_code = form.status_code
+        job.result = json.loads(
+            json.dumps(form.base_return, cls=DjangoJSONEncoder)
+        )
+    except Exception:
+        logger.exception("Erro ao processar upload {0}".format(job.id))
+        job.status = UploadJob.FAILED
+        job.status_code = 500
+        job.result = {
+            "md5": "",
+            "error": {"__all__": ["erro ao processar o arquivo"]},
+        }
+    finally:
+        job.save()
+        shutil.rmtree(os.path.dirname(job.spool_path), ignore_errors=True)
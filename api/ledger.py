@@ -0,0 +1,169 @@
+import base64
+import logging
+from contextlib import contextmanager
+from datetime import datetime, time
+from time import monotonic
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from hdfs.util import HdfsError
+
+from api.clients import hdfsclient
+from api.models import Upload
+
+logger = logging.getLogger(__name__)
+
+
+def hdfs_checksum(path):
+    return hdfsclient.checksum(path)["bytes"]
+
+
+def find_duplicate(username, method, hdfs_path, file_, md5):
+    """Último Upload em `hdfs_path`, se ele tiver o mesmo conteúdo de `file_`
+
+    Só vale para arquivos cujo md5 foi calculado no recebimento e confere
+    com o informado. A comparação é com o último envio gravado no mesmo
+    caminho do HDFS, por qualquer via (API ou envio manual): um conteúdo
+    que já foi enviado antes, mas depois sobrescrito, é gravado de novo.
+    Com HDFS_DEDUP_CHECKSUM a cópia gravada também é conferida.
+    """
+    digest = getattr(file_, "md5", None)
+    if digest is None or digest != md5:
+        return None
+
+    upload = (
+        Upload.objects.filter(
+            username=username,
+            method=method,
+            path=hdfs_path,
+            status=Upload.SUCCESS,
+        )
+        .order_by("-created_at", "-id")
+        .first()
+    )
+    if upload is None or upload.md5 != digest:
+        return None
+
+    if settings.HDFS_DEDUP_CHECKSUM:
+        try:
+            if hdfs_checksum(upload.path) != upload.hdfs_checksum:
+                return None
+        except HdfsError as error:
+            logger.info(
+                "Cópia de {0} não encontrada: {1}".format(upload.path, error)
+            )
+            return None
+
+    return upload
+
+
+@contextmanager
+def timer(timings, name):
+    """Guarda em timings[name] a duração, em segundos, do bloco"""
+    started = monotonic()
+    try:
+        yield
+    finally:
+        timings[name] = monotonic() - started
+
+
+@contextmanager
+def hdfs_timer(timings, file_):
+    """Como timer, para o envio de `file_` ao HDFS
+
+    CompressedStream comprime enquanto é lido pelo hdfsclient; esse tempo
+    fica em compression_time e sai de hdfs_time.
+    """
+    with timer(timings, "hdfs_time"):
+        yield
+
+    compression_time = getattr(file_, "elapsed", None)
+    if compression_time is not None:
+        timings["compression_time"] = compression_time
+        timings["hdfs_time"] -= compression_time
+
+
+def record_upload(
+    username, method, filename, md5, path="", status=Upload.SUCCESS, **fields
+):
+    """Registra um envio no histórico
+
+    O checksum da cópia no HDFS só é obtido para arquivos gravados.
+    `fields` recebe os tamanhos e tempos medidos durante o envio.
+    """
+    checksum = ""
+    if status == Upload.SUCCESS and settings.HDFS_DEDUP_CHECKSUM:
+        try:
+            checksum = hdfs_checksum(path)
+        except HdfsError as error:
+            logger.info(
+                "Erro ao obter checksum de {0}: {1}".format(path, error)
+            )
+
+    return Upload.objects.create(
+        username=username,
+        method=method,
+        filename=filename,
+        md5=md5,
+        path=path,
+        hdfs_checksum=checksum,
+        status=status,
+        **fields
+    )
+
+
+def encode_cursor(upload):
+    key = "{0}|{1}".format(upload.created_at.isoformat(), upload.id)
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, id_ = (
+            base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        )
+        created_at = parse_datetime(created_at)
+        id_ = int(id_)
+    except ValueError:
+        raise ValueError("cursor inválido")
+
+    if created_at is None:
+        raise ValueError("cursor inválido")
+    return created_at, id_
+
+
+def parse_timestamp(value):
+    """Data ou data e hora ISO 8601; datas valem a partir da meia-noite"""
+    timestamp = parse_datetime(value)
+    if timestamp is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError("data inválida: {0}".format(value))
+        timestamp = datetime.combine(date, time())
+
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp
+
+
+def upload_history(queryset, cursor=None, limit=100):
+    """Uma página do histórico, do envio mais recente para o mais antigo
+
+    A paginação é por chave (keyset): `cursor` aponta o último registro da
+    página anterior, então cada página é uma busca no índice
+    (username, method, created_at) sem OFFSET. Devolve os registros e o
+    cursor da próxima página, ou None na última.
+    """
+    queryset = queryset.order_by("-created_at", "-id")
+    if cursor:
+        created_at, id_ = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=id_)
+        )
+
+    uploads = list(queryset[: limit + 1])
+    if len(uploads) > limit:
+        return uploads[:limit], encode_cursor(uploads[limit - 1])
+    return uploads, None
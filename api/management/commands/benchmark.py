@@ -0,0 +1,78 @@
+import logging
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import CASES, parse_size, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede vazão e pico de memória do recebimento de arquivos com dados "
+        "sintéticos e aponta regressões em relação às execuções anteriores"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--cases",
+            default=",".join(CASES),
+            help="Casos separados por vírgula: {0}".format(", ".join(CASES)),
+        )
+        parser.add_argument(
+            "--sizes",
+            default="1MB,16MB,128MB",
+            help="Tamanhos do csv sintético, de 1MB a 2GB",
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument(
+            "--workdir",
+            default=os.path.join(tempfile.gettempdir(), "datalake-benchmark"),
+            help="Onde os arquivos sintéticos são gerados e reaproveitados",
+        )
+        parser.add_argument("--history", default="benchmarks.jsonl")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.1,
+            help="Piora relativa que conta como regressão",
+        )
+        parser.add_argument(
+            "--fail-on-regression",
+            action="store_true",
+            help="Termina com erro se alguma regressão for encontrada",
+        )
+
+    def handle(self, *args, **options):
+        cases = [case for case in options["cases"].split(",") if case]
+        unknown = set(cases) - set(CASES)
+        if unknown:
+            raise CommandError(
+                "Casos desconhecidos: {0}".format(", ".join(sorted(unknown)))
+            )
+
+        try:
+            sizes = [parse_size(size) for size in options["sizes"].split(",")]
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        if options["verbosity"] < 2:
+            # Os logs de cada etapa só aparecem com --verbosity 2
+            logging.getLogger("api.metrics").setLevel(logging.WARNING)
+
+        os.makedirs(options["workdir"], exist_ok=True)
+        results = run_benchmark(
+            cases,
+            sizes,
+            options["workdir"],
+            options["history"],
+            repeat=options["repeat"],
+            threshold=options["threshold"],
+            log=self.stdout.write,
+        )
+
+        regressions = [result for result in results if result["regressions"]]
+        if regressions and options["fail_on_regression"]:
+            raise CommandError(
+                "{0} caso(s) com regressão".format(len(regressions))
+            )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from api.jobs import requeue_stale_jobs, run_upload_job
+from api.models import UploadJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Processa uploads assíncronos que ainda estão aguardando, inclusive "
+        "os abandonados em processamento há mais de UPLOAD_JOB_TIMEOUT"
+    )
+
+    def handle(self, *args, **options):
+        stale = requeue_stale_jobs()
+        if stale:
+            self.stdout.write("{0} upload(s) reenfileirado(s)".format(stale))
+
+        pending = UploadJob.objects.filter(
+            status=UploadJob.PENDING
+        ).order_by("created_at")
+        for job_id in pending.values_list("id", flat=True):
+            run_upload_job(job_id)
+            self.stdout.write("Upload {0} processado".format(job_id))
@@ -0,0 +1,127 @@
+"""Tempo e volume de cada etapa do upload
+
+Cada etapa medida gera uma linha de log no formato chave=valor, com os
+mesmos campos em `extra` para formatters estruturados, e alimenta as
+métricas do Prometheus expostas em /metrics. As etapas são:
+
+    md5              cálculo do md5 (md5reader ou no recebimento)
+    sinks            repasse da leitura à amostra do csv e à escrita no HDFS
+    sample           leitura da amostra do csv
+    validate         validação da amostra pelo goodtables
+    full_validation  validação do arquivo completo
+    xlsx_convert     conversão da planilha para csv
+    compress         compressão do csv, medida durante o envio ao HDFS
+    hdfs_write       envio ao HDFS, sem o tempo gasto na compressão
+
+Com vários workers do gunicorn as métricas de cada processo são somadas
+quando a variável de ambiente `prometheus_multiproc_dir` aponta para um
+diretório compartilhado.
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from time import monotonic
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+logger = logging.getLogger(__name__)
+
+STAGE_SECONDS = Histogram(
+    "datalake_upload_stage_seconds",
+    "Duração de cada etapa do upload",
+    ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+STAGE_BYTES = Counter(
+    "datalake_upload_stage_bytes",
+    "Bytes processados em cada etapa do upload",
+    ["stage"],
+)
+
+_context = threading.local()
+
+
+@contextmanager
+def upload_context(**fields):
+    """Acrescenta `fields` (username, method, job) aos logs das etapas"""
+    previous = getattr(_context, "fields", {})
+    _context.fields = dict(previous, **fields)
+    try:
+        yield
+    finally:
+        _context.fields = previous
+
+
+def current_context():
+    return dict(getattr(_context, "fields", {}))
+
+
+def request_context(view):
+    # Identifica nos logs das etapas o usuário e o método do upload
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with upload_context(
+            username=request.POST.get("nome", ""),
+            method=request.POST.get("method", ""),
+        ):
+            return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def observe(stage_name, seconds, size=None):
+    STAGE_SECONDS.labels(stage_name).observe(seconds)
+    if size is not None:
+        STAGE_BYTES.labels(stage_name).inc(size)
+
+    fields = dict(
+        getattr(_context, "fields", {}),
+        stage=stage_name,
+        seconds=round(seconds, 6),
+    )
+    if size is not None:
+        fields["bytes"] = size
+    logger.info(
+        " ".join(
+            "{0}={1}".format(key, value) for key, value in fields.items()
+        ),
+        extra=fields,
+    )
+
+
+class Stage:
+    def __init__(self, size=None):
+        self.size = size
+
+
+@contextmanager
+def stage(stage_name, size=None):
+    """Mede o bloco como a etapa `stage_name`
+
+    O tamanho pode ser informado depois, em `size` do objeto devolvido.
+    Etapas interrompidas por exceção não são registradas.
+    """
+    measured = Stage(size)
+    started = monotonic()
+    yield measured
+    observe(stage_name, monotonic() - started, measured.size)
+
+
+def render():
+    if "prometheus_multiproc_dir" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
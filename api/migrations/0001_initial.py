@@ -0,0 +1,32 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:00
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('username', models.CharField(max_length=255)),
+                ('method', models.CharField(max_length=255)),
+                ('filename', models.CharField(blank=True, max_length=255)),
+                ('md5', models.CharField(blank=True, max_length=32)),
+                ('spool_path', models.CharField(max_length=1024)),
+                ('status', models.CharField(choices=[('pending', 'Aguardando'), ('running', 'Processando'), ('done', 'Concluído'), ('failed', 'Falhou')], default='pending', max_length=16)),
+                ('status_code', models.PositiveSmallIntegerField(null=True)),
+                ('result', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
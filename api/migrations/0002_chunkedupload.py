@@ -0,0 +1,29 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('username', models.CharField(max_length=255)),
+                ('method', models.CharField(max_length=255)),
+                ('filename', models.CharField(max_length=255)),
+                ('md5', models.CharField(max_length=32)),
+                ('status', models.CharField(choices=[('open', 'Recebendo partes'), ('committed', 'Finalizado')], default='open', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('job', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.UploadJob')),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=255)),
+                ('method', models.CharField(max_length=255)),
+                ('filename', models.CharField(max_length=255)),
+                ('md5', models.CharField(max_length=32)),
+                ('path', models.CharField(max_length=1024)),
+                ('hdfs_checksum', models.CharField(blank=True, max_length=128)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['username', 'method', 'md5'], name='api_upload_usernam_c99349_idx'),
+        ),
+    ]
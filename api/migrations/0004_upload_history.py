@@ -0,0 +1,52 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='compressed_size',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='hdfs_time',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='raw_size',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='status',
+            field=models.CharField(choices=[('success', 'Gravado no HDFS'), ('invalid', 'Recusado'), ('duplicate', 'Reenvio ignorado')], default='success', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='validation_time',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='upload',
+            name='md5',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='upload',
+            name='path',
+            field=models.CharField(blank=True, max_length=1024),
+        ),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['username', 'method', 'created_at'], name='api_upload_usernam_bad2af_idx'),
+        ),
+    ]
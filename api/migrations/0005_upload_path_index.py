@@ -0,0 +1,21 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_upload_history'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='upload',
+            name='api_upload_usernam_c99349_idx',
+        ),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['username', 'method', 'path'], name='api_upload_usernam_31119f_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_upload_path_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='compression_time',
+            field=models.FloatField(null=True),
+        ),
+    ]
@@ -0,0 +1,116 @@
+import uuid
+
+from django.contrib.postgres.fields import JSONField
+from django.db import models
+
+
+class UploadJob(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Aguardando"),
+        (RUNNING, "Processando"),
+        (DONE, "Concluído"),
+        (FAILED, "Falhou"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    username = models.CharField(max_length=255)
+    method = models.CharField(max_length=255)
+    filename = models.CharField(max_length=255, blank=True)
+    md5 = models.CharField(max_length=32, blank=True)
+    spool_path = models.CharField(max_length=1024)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=PENDING
+    )
+    status_code = models.PositiveSmallIntegerField(null=True)
+    result = JSONField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def __str__(self):
+        return "{username} - {method}: {status}".format(
+            username=self.username, method=self.method, status=self.status
+        )
+
+
+class ChunkedUpload(models.Model):
+    """Upload enviado em partes numeradas e finalizado com commit
+
+    As partes ficam no spool local até o commit, que cria um UploadJob para
+    o arquivo completo; o job junta as partes antes de processá-lo.
+    """
+
+    OPEN = "open"
+    COMMITTED = "committed"
+    STATUS_CHOICES = ((OPEN, "Recebendo partes"), (COMMITTED, "Finalizado"))
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    username = models.CharField(max_length=255)
+    method = models.CharField(max_length=255)
+    filename = models.CharField(max_length=255)
+    md5 = models.CharField(max_length=32)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=OPEN
+    )
+    job = models.ForeignKey(UploadJob, null=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{username} - {filename}: {status}".format(
+            username=self.username, filename=self.filename, status=self.status
+        )
+
+
+class Upload(models.Model):
+    """Histórico dos arquivos recebidos
+
+    Cada envio gera um registro, inclusive os recusados na validação e os
+    reenvios ignorados. O último registro com status SUCCESS de cada
+    (username, method, path) diz o que está gravado no HDFS e serve
+    para reconhecer reenvios do mesmo conteúdo. Tamanhos em bytes e tempos
+    em segundos.
+    """
+
+    SUCCESS = "success"
+    INVALID = "invalid"
+    DUPLICATE = "duplicate"
+    STATUS_CHOICES = (
+        (SUCCESS, "Gravado no HDFS"),
+        (INVALID, "Recusado"),
+        (DUPLICATE, "Reenvio ignorado"),
+    )
+
+    username = models.CharField(max_length=255)
+    method = models.CharField(max_length=255)
+    filename = models.CharField(max_length=255)
+    md5 = models.CharField(max_length=32, blank=True)
+    path = models.CharField(max_length=1024, blank=True)
+    hdfs_checksum = models.CharField(max_length=128, blank=True)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=SUCCESS
+    )
+    raw_size = models.BigIntegerField(null=True)
+    compressed_size = models.BigIntegerField(null=True)
+    validation_time = models.FloatField(null=True)
+    compression_time = models.FloatField(null=True)
+    hdfs_time = models.FloatField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["username", "method", "path"]),
+            models.Index(fields=["username", "method", "created_at"]),
+        ]
+
+    def __str__(self):
+        return "{username} - {method}: {filename}".format(
+            username=self.username, method=self.method, filename=self.filename
+        )
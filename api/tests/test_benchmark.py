@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipUnless
+
+from api import columnar
+from api.benchmark import (
+    FakeHDFSClient,
+    SyntheticFiles,
+    find_regressions,
+    parse_size,
+    run_benchmark,
+)
+
+
+class TestBenchmark(TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.history = os.path.join(self.workdir, "history.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_synthetic_files_are_reproducible(self):
+        first = SyntheticFiles(self.workdir, parse_size("64KB")).path("csv")
+        with open(first, "rb") as fobj:
+            contents = fobj.read()
+        os.remove(first)
+
+        second = SyntheticFiles(self.workdir, parse_size("64KB")).path("csv")
+
+        with open(second, "rb") as fobj:
+            self.assertEqual(fobj.read(), contents)
+        self.assertGreaterEqual(len(contents), 64 * 1024)
+
+    def test_record_results_in_history(self):
+        results = run_benchmark(
+            ["md5reader", "compress"],
+            [parse_size("64KB")],
+            self.workdir,
+            self.history,
+            repeat=1,
+            log=lambda message: None,
+        )
+
+        with open(self.history) as fobj:
+            history = [json.loads(line) for line in fobj]
+        self.assertEqual(
+            [(item["case"], item["dataset"]) for item in history],
+            [("md5reader", "64KB"), ("compress", "64KB")],
+        )
+        self.assertTrue(all(item["peak_rss"] > 0 for item in history))
+        self.assertEqual(results[0]["regressions"], [])
+
+    @skipUnless(columnar.available, "pyarrow não instalado")
+    def test_compare_validation_engines(self):
+        results = run_benchmark(
+            ["validate_python", "validate_columnar"],
+            [parse_size("64KB")],
+            self.workdir,
+            self.history,
+            repeat=1,
+            log=lambda message: None,
+        )
+
+        self.assertEqual(
+            [result["case"] for result in results],
+            ["validate_python", "validate_columnar"],
+        )
+        self.assertTrue(all(result["throughput"] for result in results))
+
+    def test_find_regressions(self):
+        history = [
+            {
+                "case": "compress",
+                "dataset": "1MB",
+                "throughput": 100.0,
+                "peak_rss": 1000,
+            }
+        ] * 3
+        result = dict(history[0], throughput=80.0, peak_rss=1050)
+
+        regressions = find_regressions(result, history, threshold=0.1)
+
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("vazão"))
+
+    def test_startup_regression_by_time(self):
+        history = [
+            {
+                "case": "startup_wsgi",
+                "dataset": "-",
+                "seconds": 1.0,
+                "throughput": None,
+                "peak_rss": 1000,
+            }
+        ] * 3
+        result = dict(history[0], seconds=1.5)
+
+        regressions = find_regressions(result, history, threshold=0.1)
+
+        self.assertEqual(
+            regressions, ["tempo 1.500s, mediana anterior 1.000s"]
+        )
+
+    def test_fake_hdfs_client(self):
+        client = FakeHDFSClient(self.workdir)
+
+        client.write("/user/staging/file.csv.gz", iter([b"abc", b"def"]))
+        client.rename("/user/staging/file.csv.gz", "/user/file.csv.gz")
+
+        with open(os.path.join(self.workdir, "user/file.csv.gz"), "rb") as f:
+            self.assertEqual(f.read(), b"abcdef")
@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+from hashlib import md5
+from io import BytesIO
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from model_mommy.mommy import make
+
+from api.chunked import chunk_dir
+from api.jobs import run_upload_job
+from api.models import ChunkedUpload, UploadJob
+
+
+class TestChunkedUpload(TestCase):
+    @mock.patch("secret.models.send_mail")
+    @mock.patch("secret.models.login")
+    def setUp(self, _login, _send_mail):
+        self.spool_dir = tempfile.mkdtemp()
+        self.settings = override_settings(UPLOAD_SPOOL_DIR=self.spool_dir)
+        self.settings.enable()
+
+        self.secret = make("secret.Secret", username="anyname")
+        mmap = make(
+            "methodmapping.MethodMapping",
+            method="cpf",
+            uri="/path/to/storage/cpf",
+            schema=None,
+        )
+        self.secret.methods.add(mmap)
+
+        with open("api/tests/assets/csv_example.csv.gz", "rb") as file_:
+            self.contents = file_.read()
+        self.parts = [self.contents[:20], self.contents[20:]]
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.spool_dir)
+
+    def post(self, name, data=None, **kwargs):
+        data = dict(data or {}, nome=self.secret.username)
+        data["SECRET"] = self.secret.secret_key
+        return self.client.post(reverse(name, kwargs=kwargs), data)
+
+    def init(self, contents_md5=None):
+        response = self.post(
+            "api-chunked-init",
+            {
+                "method": "cpf",
+                "filename": "csv_example.csv.gz",
+                "md5": contents_md5 or md5(self.contents).hexdigest(),
+            },
+        )
+        return response.json()["upload"]
+
+    def send_part(self, upload_id, number, contents, contents_md5=None):
+        return self.post(
+            "api-chunked-part",
+            {
+                "file": BytesIO(contents),
+                "md5": contents_md5 or md5(contents).hexdigest(),
+            },
+            upload_id=upload_id,
+            number=number,
+        )
+
+    @mock.patch("api.jobs.upload_to_hdfs")
+    def test_upload_in_parts(self, _upload_to_hdfs):
+        upload_id = self.init()
+
+        # As partes podem chegar fora de ordem
+        self.send_part(upload_id, 2, self.parts[1])
+        self.send_part(upload_id, 1, self.parts[0])
+        status = self.post("api-chunked-status", upload_id=upload_id)
+        response = self.post("api-chunked-commit", upload_id=upload_id)
+        run_upload_job(response.json()["job"])
+
+        job = UploadJob.objects.get()
+        self.assertEqual(status.json()["chunks"], [1, 2])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(job.status_code, 201)
+        self.assertFalse(
+            os.path.exists(chunk_dir(ChunkedUpload.objects.get()))
+        )
+        _upload_to_hdfs.assert_called_once_with(
+            mock.ANY,
+            "csv_example.csv.gz",
+            "/path/to/storage/cpf/anyname",
+            staging=None,
+        )
+
+    def test_keep_part_received_by_upload_handler(self):
+        upload_id = self.init()
+
+        # O md5 e o arquivo em disco vêm de SpoolingUploadHandler
+        with mock.patch("api.chunked.md5") as _md5:
+            response = self.send_part(upload_id, 1, self.parts[0])
+
+        path = os.path.join(chunk_dir(ChunkedUpload.objects.get()), "00000001")
+        with open(path, "rb") as fobj:
+            self.assertEqual(fobj.read(), self.parts[0])
+        self.assertEqual(response.status_code, 201)
+        _md5.assert_not_called()
+
+    def test_reject_part_with_wrong_md5(self):
+        upload_id = self.init()
+
+        response = self.send_part(upload_id, 1, self.parts[0], "wrongmd5")
+        status = self.post("api-chunked-status", upload_id=upload_id)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(status.json()["chunks"], [])
+
+    def test_commit_with_missing_parts(self):
+        upload_id = self.init()
+        self.send_part(upload_id, 2, self.parts[1])
+
+        response = self.post("api-chunked-commit", upload_id=upload_id)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["missing"], [1])
+
+    def test_final_md5_does_not_match(self):
+        upload_id = self.init(contents_md5="0" * 32)
+        self.send_part(upload_id, 1, self.parts[0])
+        self.send_part(upload_id, 2, self.parts[1])
+
+        response = self.post("api-chunked-commit", upload_id=upload_id)
+        run_upload_job(response.json()["job"])
+        status = self.post("api-chunked-status", upload_id=upload_id)
+
+        job = UploadJob.objects.get()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(job.status_code, 400)
+        self.assertEqual(job.result["md5"], md5(self.contents).hexdigest())
+        # As partes continuam lá para serem corrigidas e enviadas de novo
+        self.assertEqual(status.json()["status"], "open")
+        self.assertEqual(status.json()["chunks"], [1, 2])
+
+    def test_reject_part_number_out_of_range(self):
+        upload_id = self.init()
+
+        response = self.send_part(upload_id, 10 ** 8, self.parts[0])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(
+            os.path.exists(chunk_dir(ChunkedUpload.objects.get()))
+        )
+
+    def test_no_parts_after_commit(self):
+        upload_id = self.init()
+        self.send_part(upload_id, 1, self.contents)
+        self.post("api-chunked-commit", upload_id=upload_id)
+
+        response = self.send_part(upload_id, 2, self.parts[1])
+
+        self.assertEqual(response.status_code, 409)
+
+    def test_method_not_allowed(self):
+        response = self.post(
+            "api-chunked-init",
+            {"method": "cnpj", "filename": "file.csv.gz", "md5": "0" * 32},
+        )
+
+        self.assertEqual(response.status_code, 403)
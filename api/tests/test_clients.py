@@ -0,0 +1,43 @@
+import importlib
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from api import clients
+from api.clients import RETRY_METHODS, build_session
+
+
+class TestHDFSSession(SimpleTestCase):
+    @override_settings(
+        HDFS_POOL_CONNECTIONS=4,
+        HDFS_POOL_MAXSIZE=6,
+        HDFS_MAX_RETRIES=5,
+        HDFS_RETRY_BACKOFF=0.1,
+    )
+    def test_pooled_session_with_retries(self):
+        session = build_session()
+        adapter = session.get_adapter("http://namenode:50070/webhdfs/v1/")
+
+        self.assertEqual(adapter._pool_connections, 4)
+        self.assertEqual(adapter._pool_maxsize, 6)
+        self.assertEqual(adapter.max_retries.total, 5)
+        self.assertEqual(adapter.max_retries.backoff_factor, 0.1)
+        self.assertEqual(adapter.max_retries.method_whitelist, RETRY_METHODS)
+        self.assertIs(
+            session.get_adapter("https://datanode:50075/webhdfs/v1/"), adapter
+        )
+
+
+class TestLazyHDFSClient(SimpleTestCase):
+    def tearDown(self):
+        importlib.reload(clients)
+
+    @mock.patch("hdfs.ext.kerberos.KerberosClient")
+    def test_build_on_first_use(self, _KerberosClient):
+        importlib.reload(clients)
+        _KerberosClient.assert_not_called()
+
+        clients.hdfsclient.write("/path", b"data")
+        clients.hdfsclient.delete("/path")
+
+        _KerberosClient.assert_called_once()
@@ -0,0 +1,88 @@
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import TestCase
+
+import zstandard
+
+from api.compression import (
+    CompressedStream,
+    GZIP,
+    NONE,
+    ParallelGzipStream,
+    ZSTD,
+)
+
+
+class TestCompressedStream(TestCase):
+    def test_compress_binary_source(self):
+        contents = b"field1,field2,field3\n1,2,3\n" * 10000
+        stream = CompressedStream(BytesIO(contents), chunk_size=1024)
+
+        self.assertEqual(gzip.decompress(stream.read()), contents)
+
+    def test_compress_text_source(self):
+        contents = "campo1,campo2\nação,ñ\n" * 1000
+        stream = CompressedStream(StringIO(contents), encoding="utf-8-sig")
+
+        self.assertEqual(
+            gzip.decompress(stream.read()), contents.encode("utf-8-sig")
+        )
+
+    def test_iterate_in_chunks(self):
+        contents = bytes(range(256)) * 4096
+        stream = CompressedStream(
+            BytesIO(contents), codec=GZIP, level=1, chunk_size=512
+        )
+        chunks = list(stream)
+
+        self.assertTrue(all(len(chunk) <= 512 for chunk in chunks))
+        self.assertEqual(gzip.decompress(b"".join(chunks)), contents)
+        self.assertEqual(stream.read(), b"")
+        self.assertEqual(stream.size, sum(len(chunk) for chunk in chunks))
+
+    def test_zstd_codec(self):
+        contents = b"field1,field2,field3\n1,2,3\n" * 10000
+        stream = CompressedStream(BytesIO(contents), codec=ZSTD, level=3)
+
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        self.assertEqual(decompressor.decompress(stream.read()), contents)
+
+    def test_passthrough_codec(self):
+        contents = "campo1,campo2\nação,ñ\n"
+        stream = CompressedStream(
+            StringIO(contents), codec=NONE, encoding="utf-8"
+        )
+
+        self.assertEqual(stream.read(), contents.encode("utf-8"))
+
+
+class TestParallelGzipStream(TestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_concatenated_members(self):
+        contents = b"field1,field2,field3\n1,2,3\n" * 10000
+        stream = ParallelGzipStream(
+            BytesIO(contents), self.executor, block_size=4096, max_pending=3
+        )
+        compressed = b"".join(stream)
+
+        self.assertEqual(gzip.decompress(compressed), contents)
+        self.assertGreater(compressed.count(b"\x1f\x8b\x08"), 1)
+
+    def test_compress_text_source(self):
+        contents = "campo1,campo2\nação,ñ\n" * 1000
+        stream = ParallelGzipStream(
+            StringIO(contents),
+            self.executor,
+            encoding="utf-8-sig",
+            block_size=1000,
+        )
+
+        self.assertEqual(
+            gzip.decompress(stream.read()), contents.encode("utf-8-sig")
+        )
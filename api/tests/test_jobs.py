@@ -0,0 +1,310 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import timedelta
+from hashlib import md5
+from importlib.util import find_spec
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from model_mommy.mommy import make
+
+from api.jobs import enqueue_upload, run_blocking, run_upload_job
+from api.metrics import current_context
+from api.models import UploadJob
+
+
+class TestUploadJob(TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.settings = override_settings(UPLOAD_SPOOL_DIR=self.spool_dir)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.spool_dir)
+
+    def enqueue(self, contents_md5=None):
+        with open("api/tests/assets/csv_example.csv.gz", "rb") as file_:
+            contents = file_.read()
+
+        data = {
+            "nome": "anyname",
+            "method": "cpf",
+            "md5": contents_md5 or md5(contents).hexdigest(),
+            "filename": "csv_example.csv.gz",
+        }
+        return enqueue_upload(
+            data, SimpleUploadedFile("csv_example.csv.gz", contents)
+        )
+
+    @mock.patch("secret.models.send_mail")
+    @mock.patch("secret.models.login")
+    def make_method(self, _login, _send_mail):
+        secret = make("secret.Secret", username="anyname")
+        mmap = make(
+            "methodmapping.MethodMapping",
+            method="cpf",
+            uri="/path/to/storage/cpf",
+            schema=None,
+        )
+        secret.methods.add(mmap)
+        return secret
+
+    def test_spool_upload(self):
+        job = self.enqueue()
+
+        self.assertEqual(job.status, UploadJob.PENDING)
+        self.assertTrue(os.path.exists(job.spool_path))
+        self.assertTrue(job.spool_path.startswith(self.spool_dir))
+
+    @mock.patch("api.jobs.upload_to_hdfs")
+    def test_run_job(self, _upload_to_hdfs):
+        self.make_method()
+        job = self.enqueue()
+
+        run_upload_job(job.id)
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, UploadJob.DONE)
+        self.assertEqual(job.status_code, 201)
+        self.assertEqual(job.result["error"], {})
+        self.assertFalse(os.path.exists(job.spool_path))
+        _upload_to_hdfs.assert_called_once_with(
+            mock.ANY,
+            "csv_example.csv.gz",
+            "/path/to/storage/cpf/anyname",
+            staging=None,
+        )
+
+    @mock.patch("api.jobs.upload_to_hdfs")
+    def test_run_job_wrong_md5(self, _upload_to_hdfs):
+        self.make_method()
+        job = self.enqueue(contents_md5="wrongmd5")
+
+        run_upload_job(job.id)
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, UploadJob.DONE)
+        self.assertEqual(job.status_code, 400)
+        self.assertEqual(job.result["error"]["md5"], ["valor md5 não confere!"])
+        _upload_to_hdfs.assert_not_called()
+
+    @mock.patch("api.jobs.upload_to_hdfs", side_effect=Exception("hdfs"))
+    def test_run_job_failed(self, _upload_to_hdfs):
+        self.make_method()
+        job = self.enqueue()
+
+        run_upload_job(job.id)
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, UploadJob.FAILED)
+        self.assertEqual(job.status_code, 500)
+
+    @override_settings(HDFS_STAGED_WRITES=True)
+    @mock.patch("api.forms.is_data_valid", side_effect=RuntimeError)
+    @mock.patch("api.utils.hdfsclient")
+    def test_discard_staged_write_when_job_fails(
+        self, _hdfsclient, _is_data_valid
+    ):
+        self.make_method()
+        job = self.enqueue()
+
+        run_upload_job(job.id)
+        job.refresh_from_db()
+
+        staging_path = _hdfsclient.write.call_args[0][0]
+        self.assertEqual(job.status, UploadJob.FAILED)
+        _hdfsclient.rename.assert_not_called()
+        _hdfsclient.delete.assert_called_once_with(staging_path)
+
+    @mock.patch("api.jobs.upload_to_hdfs")
+    def test_upload_status(self, _upload_to_hdfs):
+        secret = self.make_method()
+        with open("api/tests/assets/csv_example.csv.gz", "rb") as file_:
+            contents_md5 = md5(file_.read()).hexdigest()
+            file_.seek(0)
+            response = self.client.post(
+                reverse("api-upload"),
+                {
+                    "SECRET": secret.secret_key,
+                    "nome": secret.username,
+                    "md5": contents_md5,
+                    "method": "cpf",
+                    "file": file_,
+                    "filename": "csv_example.csv.gz",
+                    "async": "true",
+                },
+            )
+
+        job_id = response.json()["job"]
+        status_url = reverse("api-upload-status", kwargs={"job_id": job_id})
+        credentials = {"SECRET": secret.secret_key, "nome": secret.username}
+        pending = self.client.post(status_url, credentials)
+        run_upload_job(job_id)
+        done = self.client.post(status_url, credentials)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(pending.status_code, 202)
+        self.assertEqual(pending.json()["status"], UploadJob.PENDING)
+        self.assertEqual(done.status_code, 201)
+        self.assertEqual(done.json(), {"md5": contents_md5, "error": {}})
+
+    @mock.patch("secret.models.send_mail")
+    @mock.patch("secret.models.login")
+    def test_upload_status_of_other_user(self, _login, _send_mail):
+        other = make("secret.Secret", username="other")
+        job = self.enqueue()
+        status_url = reverse("api-upload-status", kwargs={"job_id": job.id})
+
+        anonymous = self.client.get(status_url)
+        response = self.client.post(
+            status_url, {"SECRET": other.secret_key, "nome": other.username}
+        )
+
+        self.assertEqual(anonymous.status_code, 405)
+        self.assertEqual(response.status_code, 404)
+
+    @mock.patch("api.jobs.upload_to_hdfs")
+    def test_requeue_stale_job(self, _upload_to_hdfs):
+        self.make_method()
+        job = self.enqueue()
+        UploadJob.objects.filter(id=job.id).update(
+            status=UploadJob.RUNNING,
+            updated_at=timezone.now() - timedelta(hours=2),
+        )
+        running = self.enqueue()
+        UploadJob.objects.filter(id=running.id).update(
+            status=UploadJob.RUNNING
+        )
+
+        call_command("process_upload_jobs", stdout=StringIO())
+        job.refresh_from_db()
+        running.refresh_from_db()
+
+        self.assertEqual(job.status, UploadJob.DONE)
+        self.assertFalse(os.path.exists(job.spool_path))
+        self.assertEqual(running.status, UploadJob.RUNNING)
+
+
+GEVENT_CHECK = """
+from gevent import monkey
+
+monkey.patch_all()
+
+import gzip
+import json
+import threading
+from io import BytesIO
+from unittest import mock
+
+import django
+import gevent
+
+django.setup()
+
+from api import forms, utils
+from api.compression import ParallelGzipStream
+from api.jobs import run_blocking
+from api.metrics import current_context, upload_context
+
+
+class FakeClient:
+    def __init__(self):
+        self.files = {}
+
+    def write(self, path, data, overwrite):
+        self.files[path] = sum(len(chunk) for chunk in data)
+
+
+def upload():
+    staging = utils.StagedHDFSWriter("/staging")
+    for _ in range(256):
+        staging.write(b"x" * 4096)
+    staging.wait()
+
+    contents = b"a,b\\n1,2\\n" * 20000
+    stream = ParallelGzipStream(
+        BytesIO(contents), forms.compress_executor, block_size=16384
+    )
+    compressed = b"".join(iter(lambda: stream.read(8192), b""))
+    return (
+        threading.get_ident(),
+        client.files[staging.path],
+        gzip.decompress(compressed) == contents,
+        current_context().get("username"),
+    )
+
+
+def tick():
+    while True:
+        ticks.append(1)
+        gevent.sleep(0.001)
+
+
+def request():
+    with upload_context(username="anyname"):
+        return run_blocking(upload)
+
+
+client = FakeClient()
+ticks = []
+ticker = gevent.spawn(tick)
+with mock.patch("api.utils.hdfsclient", client):
+    with mock.patch("api.jobs.request_executor", utils.thread_pool(4)):
+        greenlets = [gevent.spawn(request) for _ in range(4)]
+        gevent.joinall(greenlets, raise_error=True)
+ticker.kill()
+results = [greenlet.value for greenlet in greenlets]
+print(
+    json.dumps(
+        {
+            "main": threading.get_ident(),
+            "threads": [result[0] for result in results],
+            "sizes": [result[1] for result in results],
+            "gzip": all(result[2] for result in results),
+            "context": [result[3] for result in results],
+            "ticks": len(ticks),
+        }
+    )
+)
+"""
+
+
+class TestRunBlocking(TestCase):
+    def where(self):
+        return threading.current_thread(), current_context()
+
+    def test_run_in_request_thread(self):
+        thread, _ = run_blocking(self.where)
+
+        self.assertIs(thread, threading.current_thread())
+
+    @skipUnless(find_spec("gevent"), "gevent não instalado")
+    def test_run_in_pool_with_gevent(self):
+        # O gevent precisa ser aplicado antes de qualquer import, como em
+        # gunicorn.conf.py, então o teste roda em outro processo
+        output = subprocess.check_output(
+            [sys.executable, "-c", GEVENT_CHECK],
+            cwd=settings.BASE_DIR.parent,
+            timeout=60,
+        )
+        result = json.loads(output.decode().splitlines()[-1])
+
+        self.assertNotIn(result["main"], result["threads"])
+        self.assertEqual(len(set(result["threads"])), 4)
+        self.assertEqual(result["sizes"], [1024 * 1024] * 4)
+        self.assertTrue(result["gzip"])
+        self.assertEqual(result["context"], ["anyname"] * 4)
+        # O loop de eventos continuou rodando durante os uploads
+        self.assertGreater(result["ticks"], 0)
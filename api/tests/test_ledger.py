@@ -0,0 +1,203 @@
+import gzip
+from hashlib import md5
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from hdfs.util import HdfsError
+from model_mommy.mommy import make
+
+from api.models import Upload
+
+
+class TestDuplicateUpload(TestCase):
+    @mock.patch("secret.models.send_mail")
+    @mock.patch("secret.models.login")
+    def setUp(self, _login, _send_mail):
+        self.secret = make("secret.Secret", username="anyname")
+        mmap = make(
+            "methodmapping.MethodMapping",
+            method="cpf",
+            uri="/path/to/storage/cpf",
+            schema=None,
+        )
+        self.secret.methods.add(mmap)
+
+    def post(self, filename="csv_example.csv.gz", contents=None):
+        if contents is None:
+            with open("api/tests/assets/csv_example.csv.gz", "rb") as file_:
+                contents = file_.read()
+
+        return self.client.post(
+            reverse("api-upload"),
+            {
+                "SECRET": self.secret.secret_key,
+                "nome": self.secret.username,
+                "md5": md5(contents).hexdigest(),
+                "method": "cpf",
+                "file": SimpleUploadedFile(filename, contents),
+                "filename": filename,
+            },
+        )
+
+    @mock.patch("api.views.upload_to_hdfs")
+    def test_skip_repeated_upload(self, _upload_to_hdfs):
+        first = self.post()
+        second = self.post()
+
+        upload = Upload.objects.get(status=Upload.SUCCESS)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertTrue(second.json()["duplicate"])
+        self.assertEqual(
+            upload.path, "/path/to/storage/cpf/anyname/csv_example.csv.gz"
+        )
+        _upload_to_hdfs.assert_called_once()
+        self.assertEqual(
+            Upload.objects.filter(status=Upload.DUPLICATE).count(), 1
+        )
+
+    @mock.patch("api.views.upload_to_hdfs")
+    def test_record_sizes_and_times(self, _upload_to_hdfs):
+        self.post()
+
+        upload = Upload.objects.get()
+        self.assertEqual(upload.status, Upload.SUCCESS)
+        self.assertEqual(upload.raw_size, 56)
+        self.assertEqual(upload.compressed_size, 56)
+        self.assertGreaterEqual(upload.validation_time, 0)
+        self.assertGreaterEqual(upload.hdfs_time, 0)
+
+    @mock.patch("api.views.upload_to_hdfs")
+    def test_invalid_upload_is_not_a_duplicate(self, _upload_to_hdfs):
+        with mock.patch("api.forms.is_data_valid", return_value=(False, [])):
+            first = self.post()
+        second = self.post()
+
+        self.assertEqual(first.status_code, 400)
+        self.assertEqual(second.status_code, 201)
+        statuses = Upload.objects.order_by("id").values_list(
+            "status", flat=True
+        )
+        self.assertEqual(list(statuses), [Upload.INVALID, Upload.SUCCESS])
+
+    @mock.patch("api.views.upload_to_hdfs")
+    def test_same_contents_other_filename(self, _upload_to_hdfs):
+        self.post()
+        response = self.post(filename="other.csv.gz")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(_upload_to_hdfs.call_count, 2)
+
+    @mock.patch("api.views.upload_to_hdfs")
+    def test_upload_again_after_overwritten(self, _upload_to_hdfs):
+        with open("api/tests/assets/csv_example.csv.gz", "rb") as file_:
+            first = file_.read()
+        # Mesmo csv, outro arquivo gzip
+        second = gzip.compress(gzip.decompress(first), mtime=1)
+
+        self.post(contents=first)
+        self.post(contents=second)
+        response = self.post(contents=first)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(_upload_to_hdfs.call_count, 3)
+
+    @mock.patch("core.views.upload_to_hdfs")
+    @mock.patch("api.views.upload_to_hdfs")
+    def test_upload_again_after_manual_upload(
+        self, _upload_to_hdfs, _manual_upload_to_hdfs
+    ):
+        self.post()
+        # Envio manual de um csv que é gravado no mesmo caminho .csv.gz
+        self.client.post(
+            reverse("core:upload-manual"),
+            {
+                "SECRET": self.secret.secret_key,
+                "nome": self.secret.username,
+                "method": "cpf",
+                "file": SimpleUploadedFile(
+                    "csv_example.csv", b"field1,field2\n1,2\n"
+                ),
+            },
+        )
+        response = self.post()
+
+        self.assertEqual(response.status_code, 201)
+        _manual_upload_to_hdfs.assert_called_once()
+        self.assertEqual(_upload_to_hdfs.call_count, 2)
+
+    @mock.patch("api.views.upload_to_hdfs")
+    def test_upload_again_after_uri_change(self, _upload_to_hdfs):
+        self.post()
+        self.secret.methods.update(uri="/path/to/new/storage/cpf")
+
+        response = self.post()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(_upload_to_hdfs.call_count, 2)
+
+    @override_settings(HDFS_DEDUP_CHECKSUM=True)
+    @mock.patch("api.ledger.hdfsclient")
+    @mock.patch("api.views.upload_to_hdfs")
+    def test_upload_again_if_copy_is_missing(
+        self, _upload_to_hdfs, _hdfsclient
+    ):
+        _hdfsclient.checksum.return_value = {"bytes": "0001"}
+        self.post()
+        _hdfsclient.checksum.side_effect = HdfsError("File does not exist")
+
+        response = self.post()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(_upload_to_hdfs.call_count, 2)
+
+
+class TestUploadList(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(
+            "admin", password="password", is_staff=True
+        )
+        self.client.force_login(user)
+        for i in range(5):
+            make("api.Upload", username="anyname", method="cpf")
+        make("api.Upload", username="other", method="cpf")
+
+    def get(self, **params):
+        return self.client.get(reverse("api-upload-list"), params).json()
+
+    def test_keyset_pagination(self):
+        first = self.get(username="anyname", limit=3)
+        second = self.get(username="anyname", limit=3, cursor=first["next"])
+
+        ids = [upload["id"] for upload in first["results"]]
+        ids += [upload["id"] for upload in second["results"]]
+        expected = Upload.objects.filter(username="anyname").order_by(
+            "-created_at", "-id"
+        )
+        self.assertEqual(ids, [upload.id for upload in expected])
+        self.assertIsNone(second["next"])
+
+    def test_invalid_filters(self):
+        response = self.client.get(
+            reverse("api-upload-list"), {"since": "ontem"}
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_login_required(self):
+        self.client.logout()
+
+        response = self.client.get(reverse("api-upload-list"))
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_staff_required(self):
+        user = User.objects.create_user("parceiro", password="password")
+        self.client.force_login(user)
+
+        response = self.client.get(reverse("api-upload-list"))
+
+        self.assertEqual(response.status_code, 302)
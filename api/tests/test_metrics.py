@@ -0,0 +1,79 @@
+from io import BytesIO
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+
+from api.compression import CompressedStream
+from api.metrics import STAGE_BYTES, stage, upload_context
+from api.utils import md5reader, upload_to_hdfs
+
+
+class TestStageMetrics(TestCase):
+    def test_log_stage_with_upload_fields(self):
+        with self.assertLogs("api.metrics", level="INFO") as logs:
+            with upload_context(username="anyname", method="cpf"):
+                with stage("sample", size=10):
+                    pass
+
+        record = logs.records[0]
+        self.assertTrue(
+            record.getMessage().startswith(
+                "username=anyname method=cpf stage=sample seconds="
+            )
+        )
+        self.assertEqual(record.stage, "sample")
+        self.assertEqual(record.bytes, 10)
+
+    @mock.patch("api.utils.hdfsclient")
+    def test_compression_measured_apart_from_hdfs(self, _hdfsclient):
+        contents = b"field1,field2\n1,2\n" * 1000
+        _hdfsclient.write.side_effect = lambda path, data, overwrite: list(
+            data
+        )
+        stream = CompressedStream(BytesIO(contents))
+        before = STAGE_BYTES.labels("compress")._value.get()
+
+        with self.assertLogs("api.metrics", level="INFO") as logs:
+            upload_to_hdfs(stream, "file.csv.gz", "/path/to/storage")
+
+        self.assertEqual(
+            [record.stage for record in logs.records],
+            ["compress", "hdfs_write"],
+        )
+        self.assertEqual(logs.records[0].bytes, stream.size)
+        self.assertEqual(
+            STAGE_BYTES.labels("compress")._value.get() - before, stream.size
+        )
+
+    @mock.patch("api.utils.monotonic")
+    def test_sink_wait_measured_apart_from_md5(self, _monotonic):
+        class SlowSink:
+            # Simula um StagedHDFSWriter com a fila cheia
+            def write(self, chunk):
+                _monotonic.return_value += 5
+
+            def close(self):
+                pass
+
+        _monotonic.return_value = 0.0
+        uploadedfile = mock.Mock(size=3)
+        uploadedfile.chunks.return_value = [b"a", b"b", b"c"]
+
+        with self.assertLogs("api.metrics", level="INFO") as logs:
+            md5reader(uploadedfile, sinks=[SlowSink()])
+
+        seconds = {record.stage: record.seconds for record in logs.records}
+        self.assertEqual(seconds, {"md5": 0, "sinks": 15})
+
+    def test_metrics_endpoint(self):
+        with stage("md5", size=1):
+            pass
+
+        response = self.client.get(reverse("metrics"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            b'datalake_upload_stage_seconds_count{stage="md5"}',
+            response.content,
+        )
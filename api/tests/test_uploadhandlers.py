@@ -0,0 +1,61 @@
+import gzip
+from hashlib import md5
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from api.forms import FileUploadForm
+from api.uploadhandlers import SpoolingUploadHandler
+
+
+def receive(filename, contents, chunk_size=10):
+    handler = SpoolingUploadHandler()
+    handler.new_file("file", filename, "application/octet-stream", None)
+    for start in range(0, len(contents), chunk_size):
+        handler.receive_data_chunk(contents[start:start + chunk_size], start)
+    return handler.file_complete(len(contents))
+
+
+class TestSpoolingUploadHandler(TestCase):
+    def setUp(self):
+        with open("api/tests/assets/csv_example.csv.gz", "rb") as file_:
+            self.contents = file_.read()
+
+    def test_compute_md5_and_sample_while_receiving(self):
+        file_ = receive("csv_example.csv.gz", self.contents)
+
+        self.assertEqual(file_.md5, md5(self.contents).hexdigest())
+        self.assertEqual(file_.sampler.text, "field1,field2,field3\n1,2,3\n")
+        self.assertEqual(file_.read(), self.contents)
+        self.assertTrue(file_.temporary_file_path())
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024 * 1024)
+    def test_bound_sample_of_gzip_bomb(self):
+        contents = gzip.compress(b"a" * 100 * 1024 * 1024)
+
+        file_ = receive("bomb.csv.gz", contents, chunk_size=64 * 1024)
+
+        # A descompressão para logo depois do limite
+        self.assertTrue(file_.sampler.failed)
+        self.assertIsNone(file_.sampler.text)
+        self.assertLessEqual(
+            file_.sampler.size, 1024 * 1024 + file_.sampler.MAX_CHUNK
+        )
+        self.assertEqual(file_.md5, md5(contents).hexdigest())
+
+    @mock.patch("api.forms.is_data_valid", return_value=(True, {}))
+    @mock.patch("api.forms.md5reader")
+    def test_form_uses_precomputed_values(self, _md5reader, _is_data_valid):
+        file_ = receive("csv_example.csv.gz", self.contents)
+        form = FileUploadForm(
+            data={
+                "nome": "USERNAME",
+                "method": "METHOD-NAME",
+                "md5": md5(self.contents).hexdigest(),
+            },
+            files={"file": file_},
+        )
+
+        self.assertTrue(form.is_valid())
+        self.assertIs(form.sampler, file_.sampler)
+        _md5reader.assert_not_called()
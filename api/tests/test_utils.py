@@ -1,16 +1,24 @@
+import gzip
+from datetime import date, datetime
 from hashlib import md5
 from unittest import mock
 
 from api.utils import (
+    CSVSampler,
+    StagedHDFSWriter,
     get_destination,
     is_data_valid,
     md5reader,
     read_csv_sample,
+    resolve_method,
     securedecorator,
+    upload_to_hdfs,
+    xlsx_cell_value,
 )
 from django.core.exceptions import PermissionDenied
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import RequestFactory, TestCase
+from hdfs.util import HdfsError
 from model_mommy.mommy import make
 
 
@@ -82,6 +90,16 @@ class TestMd5Reader(TestCase):
             md5reader(uploadedfile), md5(b"lerolero").hexdigest()
         )
 
+    def test_feed_sinks_with_every_chunk(self):
+        contents = b"filecontents"
+        uploadedfile = SimpleUploadedFile("file", contents)
+        sink = mock.Mock()
+
+        md5reader(uploadedfile, sinks=[sink])
+
+        sink.write.assert_called_once_with(contents)
+        sink.close.assert_called_once_with()
+
 
 class TestValidHeader(TestCase):
     @mock.patch("secret.models.login")
@@ -240,6 +258,25 @@ class TestMethodDestination(TestCase):
         )
 
 
+class TestResolveMethod(TestCase):
+    @mock.patch("secret.models.login")
+    def test_resolve_secret_and_method_in_one_query(self, _mail_login):
+        secret = make("secret.Secret", username="anyname")
+        mmap_1 = make("methodmapping.MethodMapping", method="cpf")
+        mmap_2 = make("methodmapping.MethodMapping", method="cnpj")
+        secret.methods.add(mmap_1, mmap_2)
+
+        with self.assertNumQueries(1):
+            resolved_secret, mapping = resolve_method("anyname", "cnpj")
+            self.assertEqual(resolved_secret.username, "anyname")
+            self.assertEqual(mapping.uri, mmap_2.uri)
+
+    def test_method_not_found(self):
+        make("methodmapping.MethodMapping", method="cpf")
+
+        self.assertEqual(resolve_method("anyname", "cpf"), (None, None))
+
+
 class ReadCSVUtilsTest(TestCase):
     def test_read_gz_sample(self):
         with open("api/tests/assets/csv_example.csv.gz", "rb") as gz_csv:
@@ -256,3 +293,166 @@ class ReadCSVUtilsTest(TestCase):
         expected = [["field1", "field2", "field3"], ["1", "2", "3"]]
 
         self.assertEqual(sample_data, expected)
+
+    def test_read_sample_from_sampler(self):
+        with open("api/tests/assets/csv_example.csv.gz", "rb") as gz_csv:
+            sampler = CSVSampler(sample_size=100)
+            sampler.write(gz_csv.read())
+            sampler.close()
+
+        file_ = mock.Mock()
+        sample_data = read_csv_sample(file_, sampler=sampler)
+
+        expected = [["field1", "field2", "field3"], ["1", "2", "3"]]
+
+        self.assertEqual(sample_data, expected)
+        file_.read.assert_not_called()
+
+
+class XLSXCellValueTest(TestCase):
+    def test_same_values_as_xlrd(self):
+        values = [None, "texto", 1, 2.5, True, date(2019, 1, 2)]
+
+        self.assertEqual(
+            [xlsx_cell_value(value) for value in values],
+            ["", "texto", 1.0, 2.5, 1, 43467],
+        )
+        self.assertEqual(
+            xlsx_cell_value(datetime(2019, 1, 2, 12)), 43467.5
+        )
+
+
+class CSVSamplerTest(TestCase):
+    def test_keep_only_sample_lines(self):
+        contents = b"".join(b"%d,%d\n" % (i, i) for i in range(1000))
+        sampler = CSVSampler(sample_size=10, compressed=False)
+        for start in range(0, len(contents), 7):
+            sampler.write(contents[start:start + 7])
+        sampler.close()
+
+        sample_data = read_csv_sample(mock.Mock(), 10, sampler=sampler)
+
+        self.assertEqual(len(sample_data), 10)
+        self.assertEqual(sample_data[-1], ["9", "9"])
+        self.assertLess(len(sampler.text), 100)
+
+    def test_quoted_field_with_newlines(self):
+        contents = b'id,texto\n1,"a\nb\nc"\n2,b\n3,c\n4,d\n5,e\n'
+        sampler = CSVSampler(sample_size=3, compressed=False)
+        for start in range(len(contents)):
+            sampler.write(contents[start:start + 1])
+        sampler.close()
+
+        sample_data = read_csv_sample(mock.Mock(), 3, sampler=sampler)
+
+        self.assertEqual(
+            sample_data,
+            [["id", "texto"], ["1", "a\nb\nc"], ["2", "b"]],
+        )
+        self.assertTrue(sampler.done)
+        self.assertNotIn("5,e", sampler.text)
+
+    def test_discard_sample_larger_than_max_size(self):
+        contents = b'id,produto\n1,TV 42" LED\n' + b"2,abc\n" * 10000
+        sampler = CSVSampler(sample_size=10, max_size=1024)
+        sampler.write(gzip.compress(contents))
+        sampler.close()
+
+        self.assertTrue(sampler.failed)
+        self.assertEqual(sampler.parts, [])
+        self.assertIsNone(sampler.text)
+
+    def test_invalid_gzip_falls_back_to_file(self):
+        sampler = CSVSampler(sample_size=10)
+        sampler.write(b"not gzip")
+        sampler.close()
+
+        self.assertTrue(sampler.failed)
+        self.assertIsNone(sampler.text)
+
+
+class StagedHDFSWriterTest(TestCase):
+    @mock.patch("api.utils.hdfsclient")
+    def test_stream_chunks_to_staging_path(self, _hdfsclient):
+        received = []
+        _hdfsclient.write.side_effect = lambda path, data, overwrite: (
+            received.extend(data)
+        )
+
+        staging = StagedHDFSWriter("/path/to/storage/cpf")
+        for _ in range(100):
+            staging.write(b"chunk")
+        staging.close()
+        staging.wait()
+
+        self.assertTrue(
+            staging.path.startswith("/path/to/storage/cpf/_incoming/")
+        )
+        self.assertEqual(received, [b"chunk"] * 100)
+
+    @mock.patch("api.utils.hdfsclient")
+    def test_commit_renames_to_destination(self, _hdfsclient):
+        _hdfsclient.status.return_value = None
+        staging = StagedHDFSWriter("/path/to/storage/cpf")
+        staging.write(b"chunk")
+
+        upload_to_hdfs(
+            None,
+            "file.csv.gz",
+            "/path/to/storage/cpf/anyname",
+            staging=staging,
+        )
+
+        _hdfsclient.rename.assert_called_once_with(
+            staging.path, "/path/to/storage/cpf/anyname/file.csv.gz"
+        )
+
+    @mock.patch("api.utils.hdfsclient")
+    def test_commit_replaces_previous_version(self, _hdfsclient):
+        final_path = "/path/to/storage/cpf/anyname/file.csv.gz"
+        staging = StagedHDFSWriter("/path/to/storage/cpf")
+
+        staging.commit("/path/to/storage/cpf/anyname", "file.csv.gz")
+
+        previous_path = staging.path + ".previous"
+        self.assertEqual(
+            _hdfsclient.rename.call_args_list,
+            [
+                mock.call(final_path, previous_path),
+                mock.call(staging.path, final_path),
+            ],
+        )
+        _hdfsclient.delete.assert_called_once_with(previous_path)
+
+    @mock.patch("api.utils.hdfsclient")
+    def test_restore_previous_version_when_commit_fails(self, _hdfsclient):
+        final_path = "/path/to/storage/cpf/anyname/file.csv.gz"
+        _hdfsclient.rename.side_effect = [None, HdfsError("erro"), None]
+        staging = StagedHDFSWriter("/path/to/storage/cpf")
+
+        with self.assertRaises(HdfsError):
+            staging.commit("/path/to/storage/cpf/anyname", "file.csv.gz")
+
+        _hdfsclient.rename.assert_called_with(
+            staging.path + ".previous", final_path
+        )
+        _hdfsclient.delete.assert_not_called()
+
+    @mock.patch("api.utils.hdfsclient")
+    def test_discard_when_staging_fails(self, _hdfsclient):
+        _hdfsclient.write.side_effect = Exception("datanode error")
+
+        staging = StagedHDFSWriter("/path/to/storage/cpf")
+        for _ in range(100):
+            staging.write(b"chunk")
+
+        with self.assertRaises(Exception):
+            upload_to_hdfs(
+                None,
+                "file.csv.gz",
+                "/path/to/storage/cpf/anyname",
+                staging=staging,
+            )
+
+        _hdfsclient.rename.assert_not_called()
+        _hdfsclient.delete.assert_called_once_with(staging.path)
@@ -0,0 +1,339 @@
+import gzip
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import md5
+from unittest import TestCase, mock, skipUnless
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase as DjangoTestCase
+from goodtables import validate
+from model_mommy.mommy import make
+
+from api import columnar
+from api.utils import (
+    get_validation_executor,
+    is_data_valid,
+    validate_all_rows,
+)
+from api.validation import (
+    FieldChecker,
+    unique_key,
+    validate_file,
+    validate_file_parallel,
+)
+
+SCHEMA = {
+    "fields": [
+        {
+            "name": "id",
+            "type": "integer",
+            "constraints": {"required": True, "unique": True},
+        },
+        {
+            "name": "valor",
+            "type": "number",
+            "constraints": {"minimum": 0, "maximum": 100},
+        },
+        {
+            "name": "uf",
+            "type": "string",
+            "constraints": {"enum": ["RJ", "SP"], "pattern": "[A-Z]{2}"},
+        },
+        {"name": "data", "type": "date"},
+    ]
+}
+
+
+def csv_file(lines, name="file.csv"):
+    return SimpleUploadedFile(name, "\n".join(lines).encode("utf-8"))
+
+
+class TestValidateFile(TestCase):
+    def test_same_errors_as_goodtables(self):
+        lines = [
+            "id,valor,uf,data",
+            "1,10.5,RJ,2019-01-31",
+            "x,101,rj,2019-02-30",
+            "3,-1,MG",
+            ",,,",
+            "1,5,SP,2019-01-01,extra",
+        ]
+        rows = [line.split(",") for line in lines]
+        expected = validate(rows, schema=SCHEMA)["tables"][0]["errors"]
+
+        errors = validate_file(csv_file(lines), SCHEMA)
+
+        keys = ("code", "row-number", "column-number", "message")
+        self.assertEqual(
+            [[error.get(key) for key in keys] for error in errors],
+            [[error.get(key) for key in keys] for error in expected],
+        )
+
+    def test_unique_across_chunks(self):
+        lines = ["id,valor,uf,data"] + [
+            "{0},1,RJ,2019-01-01".format(i % 5) for i in range(10)
+        ]
+
+        errors = validate_file(csv_file(lines), SCHEMA, chunk_rows=3)
+
+        self.assertEqual(len(errors), 5)
+        self.assertEqual(errors[0]["code"], "unique-constraint")
+        self.assertEqual(errors[0]["message-data"]["row_numbers"], "2, 7")
+
+    def test_value_repeated_many_times(self):
+        lines = ["id,valor,uf,data"] + [
+            "{0},{1},RJ,2019-01-01".format(i % 2 or i, i) for i in range(16)
+        ]
+        rows = [line.split(",") for line in lines]
+        expected = validate(rows, schema=SCHEMA)["tables"][0]["errors"]
+
+        errors = validate_file(csv_file(lines), SCHEMA, chunk_rows=3)
+
+        self.assertEqual(
+            [error["message"] for error in errors],
+            [error["message"] for error in expected],
+        )
+        self.assertEqual(errors[1]["message-data"]["row_numbers"], "3, 5, 7")
+        self.assertEqual(
+            errors[-1]["message-data"]["row_numbers"],
+            "3, 5, 7, 17 and 3 others",
+        )
+
+    def test_bounded_unique_state(self):
+        field = {"name": "nome", "type": "string"}
+        field["constraints"] = {"unique": True}
+        checker = FieldChecker(field, 1)
+        text = "nome bem maior que uma chave md5"
+
+        for row_number in range(2, 1002):
+            error = checker.check_cell(text, [text], row_number)
+
+        stored = checker.seen[unique_key(text)]
+        self.assertEqual(list(checker.seen), [md5(text.encode()).digest()])
+        self.assertEqual(stored, [1000, 2, 3, 4, 5, 6])
+        self.assertEqual(
+            error["message-data"]["row_numbers"],
+            "2, 3, 4, 1001 and 995 others",
+        )
+
+    def test_stop_after_max_errors(self):
+        lines = ["id,valor,uf,data"] + ["x,1,RJ,2019-01-01"] * 1000
+
+        errors = validate_file(
+            csv_file(lines), SCHEMA, max_errors=10, chunk_rows=100
+        )
+
+        self.assertEqual(len(errors), 10)
+        self.assertEqual(errors[-1]["row-number"], 11)
+
+    def test_read_gzip_and_keep_file_open(self):
+        contents = "id,valor,uf,data\n1,1,RJ,2019-01-01\n1,1,SP,2019-01-01\n"
+        file_ = SimpleUploadedFile(
+            "file.csv.gz", gzip.compress(contents.encode("utf-8-sig"))
+        )
+
+        errors = validate_file(file_, SCHEMA)
+
+        self.assertEqual(errors[0]["row-number"], 3)
+        self.assertFalse(file_.closed)
+        self.assertEqual(file_.tell(), 0)
+
+
+class TestParallelValidation(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.executor = ProcessPoolExecutor(max_workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+        super().tearDownClass()
+
+    def test_same_errors_as_sequential(self):
+        lines = ["id,valor,uf,data"] + [
+            "{0},{1},RJ,2019-01-01".format(i % 40, i % 120) for i in range(300)
+        ]
+        # Repetido e fora do enum: vale o erro de unique
+        lines[55] = "14,1,MG,2019-01-01"
+        lines[70] = "x,1,RJ,2019-01-01,extra"
+
+        errors = validate_file_parallel(
+            csv_file(lines),
+            SCHEMA,
+            self.executor,
+            max_errors=1000,
+            chunk_rows=7,
+        )
+
+        self.assertEqual(
+            errors,
+            validate_file(csv_file(lines), SCHEMA, max_errors=1000),
+        )
+        self.assertEqual(errors[0]["message-data"]["row_numbers"], "2, 42")
+        self.assertIn(
+            (56, "unique-constraint"),
+            [(error["row-number"], error["code"]) for error in errors],
+        )
+
+    def test_stop_after_max_errors(self):
+        lines = ["id,valor,uf,data"] + ["x,1,RJ,2019-01-01"] * 1000
+
+        errors = validate_file_parallel(
+            csv_file(lines), SCHEMA, self.executor, max_errors=5, chunk_rows=3
+        )
+
+        self.assertEqual(
+            [error["row-number"] for error in errors], [2, 3, 4, 5, 6]
+        )
+
+    @mock.patch.dict("api.utils._validation_executors", clear=True)
+    @mock.patch("api.utils._validation_executors_pid", None)
+    @mock.patch("api.utils.ProcessPoolExecutor")
+    def test_executor_created_once_per_process(self, _executor):
+        first = get_validation_executor()
+        self.assertIs(get_validation_executor(), first)
+
+        # Worker do gunicorn criado depois da importação no master
+        with mock.patch("api.utils.os.getpid", return_value=-1):
+            get_validation_executor()
+
+        self.assertEqual(_executor.call_count, 2)
+
+
+@skipUnless(columnar.available, "pyarrow não instalado")
+class TestColumnarValidation(TestCase):
+    def test_same_errors_as_python_engine(self):
+        schema = dict(
+            SCHEMA,
+            fields=SCHEMA["fields"][1:]
+            + [{"name": "flag", "type": "boolean"}],
+        )
+        lines = ["valor,uf,data,flag"]
+        for i in range(3000):
+            lines.append("{0},RJ,2019-01-01,true".format(i % 100))
+        lines[10] = "1e2,RJ,2019-01-01,1"
+        lines[500] = "abc,SP,2019-13-01,sim"
+        lines[1500] = ',"S\nP",,'
+        lines[2999] = ",,,"
+
+        errors = columnar.validate_columnar(
+            csv_file(lines), schema, max_errors=1000
+        )
+
+        self.assertEqual(
+            errors, validate_file(csv_file(lines), schema, max_errors=1000)
+        )
+        self.assertEqual(
+            [(error["row-number"], error["code"]) for error in errors],
+            [
+                (501, "type-or-format-error"),
+                (501, "type-or-format-error"),
+                (501, "type-or-format-error"),
+                (1501, "pattern-constraint"),
+                (3000, "blank-row"),
+            ],
+        )
+
+    @mock.patch.object(columnar, "BLOCK_SIZE", 1024)
+    def test_dates_and_unique_across_blocks(self):
+        schema = {
+            "fields": [
+                {
+                    "name": "id",
+                    "type": "integer",
+                    "constraints": {"unique": True},
+                },
+                {
+                    "name": "codigo",
+                    "type": "string",
+                    "constraints": {"unique": True, "pattern": "[A-Z]+\\d+"},
+                },
+                {"name": "data", "type": "date", "format": "%d/%m/%Y"},
+                {"name": "hora", "type": "time"},
+            ]
+        }
+        lines = ["id,codigo,data,hora"]
+        for i in range(2000):
+            lines.append("{0},A{0},15/01/2019,12:30:00".format(i))
+        lines[10] = "9,A9,30/02/2019,12:30:00"
+        lines[20] = "19,A19, 15/01/2019,24:00:00"
+        lines[30] = "29,A29,15/01/0000,12:30:60"
+        lines[1500] = "015,A10,15/1/2019,1:30:00"
+        lines[1600] = "x,a1600,15/01/2019,12:30:00"
+        lines[1700] = "15,A15,15/01/2019,12:30:00"
+        lines[1800] = "1599,A1599,15/01/2019,12:30:00"
+        checker = columnar.ColumnarChecker(schema)
+
+        errors = columnar.validate_columnar(
+            csv_file(lines), schema, max_errors=1000
+        )
+
+        self.assertEqual(
+            errors, validate_file(csv_file(lines), schema, max_errors=1000)
+        )
+        self.assertEqual(
+            [(error["row-number"], error["code"]) for error in errors],
+            [
+                (11, "type-or-format-error"),
+                (21, "type-or-format-error"),
+                (21, "type-or-format-error"),
+                (31, "type-or-format-error"),
+                (31, "type-or-format-error"),
+                (1501, "unique-constraint"),
+                (1501, "unique-constraint"),
+                (1601, "type-or-format-error"),
+                (1601, "pattern-constraint"),
+                (1701, "unique-constraint"),
+                (1701, "unique-constraint"),
+            ],
+        )
+        self.assertTrue(all(item.columnar for item in checker.filters))
+
+    def test_structure_errors_use_python_engine(self):
+        lines = ["id,valor,uf,data", "1,5,SP,2019-01-01,extra"]
+
+        with self.assertRaises(columnar.StructureError):
+            columnar.validate_columnar(csv_file(lines), SCHEMA)
+
+        errors = validate_all_rows(csv_file(lines), SCHEMA, 100)
+
+        self.assertEqual(errors[0]["code"], "extra-value")
+
+
+class TestFullValidation(DjangoTestCase):
+    def setUp(self):
+        self.lines = ["id,valor,uf,data"] + [
+            "{0},1,RJ,2019-01-01".format(i) for i in range(500)
+        ]
+        self.lines[300] = "300,1,RJ,01/01/2019"
+
+    @mock.patch("secret.models.login")
+    def test_find_errors_after_sample(self, _mail_login):
+        secret = make("secret.Secret", username="anyname")
+        mmap = make(
+            "methodmapping.MethodMapping",
+            method="cpf",
+            schema=SCHEMA,
+            full_validation=True,
+        )
+        secret.methods.add(mmap)
+
+        valid, errors = is_data_valid(
+            "anyname", "cpf", csv_file(self.lines)
+        )
+
+        self.assertFalse(valid)
+        self.assertEqual(errors[0]["code"], "type-or-format-error")
+        self.assertEqual(errors[0]["row-number"], 301)
+
+    @mock.patch("secret.models.login")
+    def test_only_sample_by_default(self, _mail_login):
+        secret = make("secret.Secret", username="anyname")
+        mmap = make(
+            "methodmapping.MethodMapping", method="cpf", schema=SCHEMA
+        )
+        secret.methods.add(mmap)
+
+        valid, _ = is_data_valid("anyname", "cpf", csv_file(self.lines))
+
+        self.assertTrue(valid)
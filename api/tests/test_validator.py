@@ -1,7 +1,12 @@
+import gzip
+import zlib
 from unittest import TestCase, mock
 
+import zstandard
+from api.compression import ParallelGzipStream
 from api.forms import FileUploadForm
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase as DjangoTestCase, override_settings
 from model_mommy.mommy import make
 
 
@@ -128,6 +133,25 @@ class TestValidator(TestCase):
         self.assertEqual(form.cleaned_data["filename"], "FILENAME.csv.gz")
         _compress.assert_called_once_with(file_)
 
+    @mock.patch("api.forms.is_data_valid", return_value=(True, {}))
+    @mock.patch("api.forms.md5reader", return_value="MD5")
+    def test_stream_gzip_of_pure_csv(self, _md5reader, _is_data_valid):
+        filename = "FILENAME.csv"
+        data = {
+            "nome": "USERNAME",
+            "method": "METHOD-NAME",
+            "filename": filename,
+            "md5": "MD5",
+        }
+        file_to_send = {"file": SimpleUploadedFile(filename, b"a,b\n1,2\n")}
+        form = FileUploadForm(
+            data=data, files=file_to_send, good_exts=(".csv",)
+        )
+        form.is_valid()
+
+        compressed = b"".join(form.cleaned_data["file"])
+        self.assertEqual(gzip.decompress(compressed), b"a,b\n1,2\n")
+
     @mock.patch("api.forms.is_data_valid", return_value=(True, {}))
     @mock.patch("api.forms.md5reader", return_value="MD5")
     def test_define_file_type(self, _md5reader, _is_data_valid):
@@ -182,6 +206,36 @@ class TestValidator(TestCase):
         )
         self.assertEqual(form.errors["detail_schema"], {"error": "error-msg"})
 
+    @mock.patch("api.utils.resolve_method")
+    @mock.patch("api.forms.resolve_method")
+    @mock.patch("api.forms.md5reader", return_value="MD5")
+    def test_method_not_granted_resolved_once(
+        self, _md5reader, form_resolve, utils_resolve
+    ):
+        filename = "FILENAME.csv.gz"
+        data = {
+            "nome": "USERNAME",
+            "method": "METHOD-NAME",
+            "filename": filename,
+            "md5": "MD5",
+        }
+        file_to_send = {"file": SimpleUploadedFile(filename, b"content")}
+        # A view já buscou o método e ele não foi liberado para o usuário
+        form = FileUploadForm(
+            data=data,
+            files=file_to_send,
+            good_exts=(".csv.gz",),
+            mapping=None,
+        )
+        is_valid = form.is_valid()
+
+        self.assertFalse(is_valid)
+        self.assertEqual(
+            form.errors["detail_schema"], "Destino para upload não existe"
+        )
+        form_resolve.assert_not_called()
+        utils_resolve.assert_not_called()
+
     @mock.patch("api.forms.is_data_valid", return_value=(True, {}))
     @mock.patch("api.forms.md5reader", return_value="md5 sum")
     def test_create_base_return(self, _md5reader, _is_data_valid):
@@ -372,6 +426,18 @@ class TestValidator(TestCase):
 
         self.assertTrue(is_valid)
 
+    @mock.patch("api.forms.md5reader", return_value="md5 sum")
+    def test_convert_xlsx_rows_to_csv(self, _md5reader):
+        with open("api/tests/assets/csv_example.xlsx", "rb") as file_:
+            xlsx = SimpleUploadedFile("FILENAME.xlsx", file_.read())
+        form = FileUploadForm(files={"file": xlsx}, good_exts=(".xlsx",))
+
+        converted = form.convert_to_csv(xlsx)
+
+        contents = converted.read()
+        self.assertEqual(contents, "field1,field2,field3\r\n1.0,2.0,3.0\r\n")
+        self.assertEqual(converted.size, len(contents.encode("utf-8-sig")))
+
     @mock.patch("api.forms.md5reader", return_value="md5 sum")
     def test_xlsx_file_cant_have_more_than_one_sheet(self, _md5reader):
         username = "anyname"
@@ -400,3 +466,72 @@ class TestValidator(TestCase):
             form.errors["__all__"][0],
             "Os arquivos devem conter apenas uma aba. Verifique também as abas escondidas",
         )
+
+
+class TestCompressionCodec(DjangoTestCase):
+    @mock.patch("secret.models.send_mail")
+    @mock.patch("secret.models.login")
+    def make_form(self, compression, level, _login, _send_mail):
+        secret = make("secret.Secret", username="anyname")
+        mmap = make(
+            "methodmapping.MethodMapping",
+            method="cpf",
+            uri="/path/to/storage/cpf",
+            schema=None,
+            compression=compression,
+            compression_level=level,
+        )
+        secret.methods.add(mmap)
+        data = {
+            "nome": "anyname",
+            "method": "cpf",
+            "filename": "FILENAME.csv",
+        }
+        file_to_send = {
+            "file": SimpleUploadedFile("FILENAME.csv", b"a,b\n1,2\n")
+        }
+        return FileUploadForm(
+            data=data,
+            files=file_to_send,
+            disable_md5=True,
+            good_exts=(".csv",),
+        )
+
+    def test_zstd_codec(self):
+        form = self.make_form("zstd", 3)
+        is_valid = form.is_valid()
+
+        compressed = b"".join(form.cleaned_data["file"])
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        self.assertTrue(is_valid)
+        self.assertEqual(form.cleaned_data["filename"], "FILENAME.csv.zst")
+        self.assertEqual(decompressor.decompress(compressed), b"a,b\n1,2\n")
+
+    def test_no_compression(self):
+        form = self.make_form("none", 0)
+        is_valid = form.is_valid()
+
+        self.assertTrue(is_valid)
+        self.assertEqual(form.cleaned_data["filename"], "FILENAME.csv")
+        self.assertEqual(form.cleaned_data["file"].read(), b"a,b\n1,2\n")
+
+    @override_settings(GZIP_PARALLEL_THRESHOLD=4)
+    def test_parallel_gzip_above_threshold(self):
+        form = self.make_form("gzip", 6)
+        is_valid = form.is_valid()
+
+        compressed = b"".join(form.cleaned_data["file"])
+        self.assertTrue(is_valid)
+        self.assertIsInstance(form.cleaned_data["file"], ParallelGzipStream)
+        self.assertEqual(gzip.decompress(compressed), b"a,b\n1,2\n")
+
+    @mock.patch("api.compression.zlib.compressobj", wraps=zlib.compressobj)
+    def test_gzip_level(self, compressobj):
+        form = self.make_form("gzip", 1)
+        is_valid = form.is_valid()
+
+        compressed = b"".join(form.cleaned_data["file"])
+        self.assertTrue(is_valid)
+        self.assertEqual(compressobj.call_args[0][0], 1)
+        self.assertEqual(form.cleaned_data["filename"], "FILENAME.csv.gz")
+        self.assertEqual(gzip.decompress(compressed), b"a,b\n1,2\n")
@@ -2,8 +2,9 @@ from hashlib import md5
 from io import BytesIO
 from unittest import mock
 
+from django.core.cache import caches
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from model_mommy.mommy import make
 
@@ -261,3 +262,159 @@ class TestUpload(TestCase):
 
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response.json()["error"], {})
+
+    @mock.patch("secret.models.send_mail")
+    @mock.patch("api.views.upload_to_hdfs")
+    @mock.patch("secret.models.login")
+    def test_upload_query_count(self, _email_login, upload_to_hdfs, mm_added):
+        secret = make("secret.Secret", username="anyname")
+        mmap = make(
+            "methodmapping.MethodMapping",
+            method="cpf",
+            uri="/path/to/storage/cpf",
+            schema={
+                "fields": [
+                    {"name": "field1"},
+                    {"name": "field2"},
+                    {"name": "field3"},
+                ]
+            },
+        )
+        secret.methods.add(mmap)
+        caches["secrets"].clear()
+        with open("api/tests/assets/csv_example.csv.gz", "rb") as file_:
+            contents_md5 = md5(file_.read()).hexdigest()
+            file_.seek(0)
+            # Chave do usuário, método, busca de reenvio e registro do upload
+            with self.assertNumQueries(4):
+                response = self.client.post(
+                    reverse("api-upload"),
+                    {
+                        "SECRET": secret.secret_key,
+                        "nome": secret.username,
+                        "md5": contents_md5,
+                        "method": "cpf",
+                        "file": file_,
+                        "filename": "csv_example.csv.gz",
+                    },
+                )
+
+        self.assertEqual(response.status_code, 201)
+        upload_to_hdfs.assert_called_once_with(
+            mock.ANY,
+            "csv_example.csv.gz",
+            "/path/to/storage/cpf/anyname",
+            staging=None,
+        )
+
+    @override_settings(HDFS_STAGED_WRITES=True)
+    @mock.patch("secret.models.send_mail")
+    @mock.patch("api.utils.hdfsclient")
+    @mock.patch("secret.models.login")
+    def test_staged_upload(self, _email_login, _hdfsclient, mm_added):
+        _hdfsclient.status.return_value = None
+        received = []
+        _hdfsclient.write.side_effect = lambda path, data, overwrite: (
+            received.extend(data)
+        )
+        secret = make("secret.Secret", username="anyname")
+        mmap = make(
+            "methodmapping.MethodMapping",
+            method="cpf",
+            uri="/path/to/storage/cpf",
+            schema=None,
+        )
+        secret.methods.add(mmap)
+        with open("api/tests/assets/csv_example.csv.gz", "rb") as file_:
+            contents = file_.read()
+            file_.seek(0)
+            response = self.client.post(
+                reverse("api-upload"),
+                {
+                    "SECRET": secret.secret_key,
+                    "nome": secret.username,
+                    "md5": md5(contents).hexdigest(),
+                    "method": "cpf",
+                    "file": file_,
+                    "filename": "csv_example.csv.gz",
+                },
+            )
+
+        staging_path = _hdfsclient.write.call_args[0][0]
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(
+            staging_path.startswith("/path/to/storage/cpf/_incoming/")
+        )
+        self.assertEqual(b"".join(received), contents)
+        _hdfsclient.rename.assert_called_once_with(
+            staging_path, "/path/to/storage/cpf/anyname/csv_example.csv.gz"
+        )
+
+    @override_settings(HDFS_STAGED_WRITES=True)
+    @mock.patch("secret.models.send_mail")
+    @mock.patch("api.utils.hdfsclient")
+    @mock.patch("secret.models.login")
+    def test_staged_upload_discarded_on_invalid_md5(
+        self, _email_login, _hdfsclient, mm_added
+    ):
+        secret = make("secret.Secret", username="anyname")
+        mmap = make(
+            "methodmapping.MethodMapping",
+            method="cpf",
+            uri="/path/to/storage/cpf",
+            schema=None,
+        )
+        secret.methods.add(mmap)
+        with open("api/tests/assets/csv_example.csv.gz", "rb") as file_:
+            response = self.client.post(
+                reverse("api-upload"),
+                {
+                    "SECRET": secret.secret_key,
+                    "nome": secret.username,
+                    "md5": "wrongmd5",
+                    "method": "cpf",
+                    "file": file_,
+                    "filename": "csv_example.csv.gz",
+                },
+            )
+
+        staging_path = _hdfsclient.write.call_args[0][0]
+        self.assertEqual(response.status_code, 400)
+        _hdfsclient.rename.assert_not_called()
+        _hdfsclient.delete.assert_called_once_with(staging_path)
+
+    @override_settings(HDFS_STAGED_WRITES=True)
+    @mock.patch("secret.models.send_mail")
+    @mock.patch("api.forms.is_data_valid", side_effect=RuntimeError)
+    @mock.patch("api.utils.hdfsclient")
+    @mock.patch("secret.models.login")
+    def test_staged_upload_discarded_on_error(
+        self, _email_login, _hdfsclient, _is_data_valid, mm_added
+    ):
+        secret = make("secret.Secret", username="anyname")
+        mmap = make(
+            "methodmapping.MethodMapping",
+            method="cpf",
+            uri="/path/to/storage/cpf",
+            schema=None,
+        )
+        secret.methods.add(mmap)
+        with open("api/tests/assets/csv_example.csv.gz", "rb") as file_:
+            contents = file_.read()
+            file_.seek(0)
+            with self.assertRaises(RuntimeError):
+                self.client.post(
+                    reverse("api-upload"),
+                    {
+                        "SECRET": secret.secret_key,
+                        "nome": secret.username,
+                        "md5": md5(contents).hexdigest(),
+                        "method": "cpf",
+                        "file": file_,
+                        "filename": "csv_example.csv.gz",
+                    },
+                )
+
+        staging_path = _hdfsclient.write.call_args[0][0]
+        _hdfsclient.rename.assert_not_called()
+        _hdfsclient.delete.assert_called_once_with(staging_path)
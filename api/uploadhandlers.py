@@ -0,0 +1,50 @@
+from hashlib import md5
+from time import monotonic
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+from api.metrics import observe
+from api.utils import CSVSampler
+
+
+class SpoolingUploadHandler(TemporaryFileUploadHandler):
+    """Grava o upload em disco calculando md5 e amostra durante o recebimento
+
+    O arquivo devolvido tem os atributos `md5` e `sampler`, usados por
+    FileUploadForm no lugar de uma nova leitura do arquivo. A etapa md5 das
+    métricas conta só o tempo de cálculo, sem a espera pela rede.
+
+    O recebimento acontece antes da checagem do SECRET, então a amostra fica
+    limitada a FILE_UPLOAD_MAX_MEMORY_SIZE caracteres: um arquivo que não
+    cabe nela (ou um gzip que se expande demais) descarta o sampler.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.md5 = md5()
+        self.elapsed = 0.0
+        self.sampler = None
+        if self.file_name.endswith((".csv", ".csv.gz")):
+            self.sampler = CSVSampler(
+                settings.CSV_SAMPLE_SIZE,
+                compressed=self.file_name.endswith(".gz"),
+                max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+            )
+
+    def receive_data_chunk(self, raw_data, start):
+        started = monotonic()
+        self.md5.update(raw_data)
+        if self.sampler is not None:
+            self.sampler.write(raw_data)
+        self.elapsed += monotonic() - started
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file_ = super().file_complete(file_size)
+        if self.sampler is not None:
+            self.sampler.close()
+        file_.md5 = self.md5.hexdigest()
+        file_.sampler = self.sampler
+        observe("md5", self.elapsed, file_size)
+        return file_
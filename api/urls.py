@@ -1,7 +1,35 @@
 from django.urls import path
-from .views import upload
+from .views import (
+    chunked_commit,
+    chunked_init,
+    chunked_part,
+    chunked_status,
+    upload,
+    upload_list,
+    upload_status,
+)
 
 
 urlpatterns = [
     path("upload/", upload, name="api-upload"),
+    path(
+        "upload/<uuid:job_id>/", upload_status, name="api-upload-status"
+    ),
+    path("uploads/", upload_list, name="api-upload-list"),
+    path("upload/chunked/", chunked_init, name="api-chunked-init"),
+    path(
+        "upload/chunked/<uuid:upload_id>/",
+        chunked_status,
+        name="api-chunked-status",
+    ),
+    path(
+        "upload/chunked/<uuid:upload_id>/<int:number>/",
+        chunked_part,
+        name="api-chunked-part",
+    ),
+    path(
+        "upload/chunked/<uuid:upload_id>/commit/",
+        chunked_commit,
+        name="api-chunked-commit",
+    ),
 ]
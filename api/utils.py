@@ -1,20 +1,150 @@
+import codecs
 import csv
 import gzip
 import logging
+import os
+import re
+import weakref
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, time
 from functools import wraps
 from hashlib import md5
 from io import StringIO
 from os import path
+from queue import Queue
+from threading import Lock
+from time import monotonic
+from uuid import uuid4
 
+from api import columnar
 from api.clients import hdfsclient
+from api.metrics import observe, stage
+from api.validation import (
+    FILE_ENCODING,
+    validate_file,
+    validate_file_parallel,
+)
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
 from django.views.decorators.http import require_http_methods
-from goodtables import validate
+from goodtables import preset, validate
+from hdfs.util import HdfsError
+from methodmapping.schemas import get_compiled_schema
+from openpyxl.utils.datetime import to_excel
 from secret.models import Secret
+from tabulator import Stream
 
 logger = logging.getLogger(__name__)
-FILE_ENCODING = "utf-8-sig"
+_validation_executors = {}
+_validation_executors_pid = None
+_validation_executors_lock = Lock()
+# Indica que o MethodMapping ainda não foi buscado; None significa que o
+# método não foi liberado para o usuário
+UNRESOLVED = object()
+
+
+def green():
+    # Verdadeiro no worker gevent do gunicorn (ver gunicorn.conf.py)
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+
+    return monkey.is_module_patched("threading")
+
+
+def current_hub():
+    # No gevent cada thread do sistema tem o seu hub; None nos outros workers
+    if not green():
+        return None
+
+    from gevent import get_hub
+
+    return get_hub()
+
+
+def get_validation_executor():
+    """Pool de processos da validação "parallel" do processo atual
+
+    Criado no primeiro uso, e não na importação: com preload_app o módulo é
+    importado no master do gunicorn, e um pool criado ali teria as filas
+    compartilhadas por todos os workers. Depois de um fork o processo filho
+    cria o seu. No worker gevent cada thread do sistema tem um pool, porque
+    a thread que acompanha o pool vira um greenlet do hub da thread que o
+    criou e só roda quando esse hub roda.
+    """
+    global _validation_executors_pid
+    hub = current_hub()
+    with _validation_executors_lock:
+        if _validation_executors_pid != os.getpid():
+            _validation_executors.clear()
+            _validation_executors_pid = os.getpid()
+        if hub not in _validation_executors:
+            _validation_executors[hub] = ProcessPoolExecutor(
+                max_workers=settings.VALIDATION_PROCESSES
+            )
+
+        return _validation_executors[hub]
+
+
+class HubThreadPool:
+    """ThreadPoolExecutor do gevent usável a partir de qualquer thread
+
+    Os pools do gevent só aceitam tarefas da thread dona do seu hub, e este
+    código também roda nas threads do sistema de run_blocking e dos jobs.
+    Cada thread usa um pool próprio de `max_workers` threads, criado no
+    primeiro uso.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.pools = weakref.WeakKeyDictionary()
+        self.lock = Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        from gevent.threadpool import ThreadPoolExecutor as NativeExecutor
+
+        hub = current_hub()
+        with self.lock:
+            pool = self.pools.get(hub)
+            if pool is None:
+                pool = self.pools[hub] = NativeExecutor(
+                    max_workers=self.max_workers
+                )
+
+        return pool.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            pools = list(self.pools.values())
+            self.pools.clear()
+
+        for pool in pools:
+            pool.shutdown(wait=wait)
+
+
+def thread_pool(max_workers):
+    """ThreadPoolExecutor com threads do sistema também no worker gevent
+
+    Com o gevent as threads comuns viram greenlets, que não rodam em paralelo
+    e travam todas as requisições do worker enquanto usam a CPU.
+    """
+    if green():
+        return HubThreadPool(max_workers)
+
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+def native_queue(maxsize):
+    # No gevent a queue.Queue só liga greenlets de uma mesma thread
+    if green():
+        from gevent.monkey import get_original
+
+        return get_original("queue", "Queue")(maxsize=maxsize)
+
+    return Queue(maxsize=maxsize)
 
 
 class InvalidDelimiterException(Exception):
@@ -29,7 +159,7 @@ def securedecorator(func):
 
         username = request.POST.get("nome", -1)
         secret = request.POST.get("SECRET", -1)
-        if Secret.objects.filter(username=username, secret_key=secret):
+        if Secret.objects.authenticate(username, secret):
             return func(*args, **kwargs)
 
         raise PermissionDenied
@@ -37,17 +167,141 @@ def securedecorator(func):
     return wrapper
 
 
-def md5reader(uploadedfile):
+def md5reader(uploadedfile, sinks=()):
+    # Cada bloco lido também é repassado aos sinks (amostra do csv, escrita
+    # no HDFS...) para que o arquivo seja percorrido uma única vez
     hash_md5 = md5()
+    feed_sinks(uploadedfile, sinks, digest=hash_md5)
+    return hash_md5.hexdigest()
+
+
+def feed_sinks(uploadedfile, sinks, digest=None):
+    # Sem digest quando o md5 já foi calculado por SpoolingUploadHandler.
+    # A etapa md5 conta só o cálculo; o tempo nos sinks, inclusive a espera
+    # pela fila do StagedHDFSWriter, é medido como a etapa sinks
+    hashing = writing = 0.0
     for chunk in uploadedfile.chunks():
-        hash_md5.update(chunk)
+        started = monotonic()
+        if digest is not None:
+            digest.update(chunk)
+        hashed = monotonic()
+        for sink in sinks:
+            sink.write(chunk)
+        hashing += hashed - started
+        writing += monotonic() - hashed
+
+    started = monotonic()
+    for sink in sinks:
+        sink.close()
+    writing += monotonic() - started
 
     uploadedfile.file.seek(0)
-    return hash_md5.hexdigest()
+    if digest is not None:
+        observe("md5", hashing, uploadedfile.size)
+    if sinks:
+        observe("sinks", writing, uploadedfile.size)
+
+
+class CSVSampler:
+    """Guarda o início do csv enquanto o upload é lido por md5reader
+
+    Só é mantido o texto necessário para os primeiros `sample_size`
+    registros; quebras de linha dentro de campos entre aspas não encerram o
+    registro. Se o conteúdo não puder ser descomprimido ou decodificado, ou
+    se a amostra passar de `max_size` caracteres (arquivo sem quebras de
+    linha, aspas soltas...), o sampler é descartado e read_csv_sample volta
+    a ler o arquivo.
+    """
+
+    GZIP_WBITS = zlib.MAX_WBITS | 16
+    MAX_CHUNK = 64 * 1024
+    QUOTE_OR_NEWLINE = re.compile(r'["\n]')
+
+    def __init__(self, sample_size=100, compressed=True, max_size=None):
+        self.sample_size = sample_size
+        self.compressed = compressed
+        self.max_size = max_size or settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        self.size = 0
+        self.decompressor = zlib.decompressobj(self.GZIP_WBITS)
+        self.decoder = codecs.getincrementaldecoder(FILE_ENCODING)()
+        self.parts = []
+        self.records = 0
+        self.quoted = False
+        self.done = False
+        self.failed = False
+        self.text = None
+
+    def _feed(self, data, final=False):
+        text = self.decoder.decode(data, final)
+        self.parts.append(text)
+        # Aspas escapadas ("") invertem o estado duas vezes
+        for match in self.QUOTE_OR_NEWLINE.finditer(text):
+            if match.group() == '"':
+                self.quoted = not self.quoted
+            elif not self.quoted:
+                self.records += 1
+                if self.records > self.sample_size:
+                    break
+        # Um registro a mais garante que o último da amostra está completo
+        self.done = self.records > self.sample_size
+        self.size += len(text)
+        if not self.done and self.size > self.max_size:
+            self.failed = True
+            self.parts = []
+
+    def write(self, chunk):
+        if self.done or self.failed:
+            return
+
+        try:
+            if not self.compressed:
+                self._feed(chunk)
+                return
+
+            data = chunk
+            while data and not (self.done or self.failed):
+                self._feed(self.decompressor.decompress(data, self.MAX_CHUNK))
+                data = self.decompressor.unconsumed_tail
+                # gzip com mais de um membro
+                if self.decompressor.eof:
+                    data = self.decompressor.unused_data
+                    self.decompressor = zlib.decompressobj(self.GZIP_WBITS)
+        except (zlib.error, UnicodeDecodeError):
+            self.failed = True
+
+    def close(self):
+        if self.failed:
+            return
+
+        if not self.done:
+            try:
+                self._feed(b"", final=True)
+            except UnicodeDecodeError:
+                self.failed = True
+                return
+
+        self.text = "".join(self.parts)
+        self.parts = []
+
 
+def xlsx_cell_value(value):
+    # Mesma representação do xlrd: números, booleanos e datas como número
+    if value is None:
+        return ""
+    elif isinstance(value, bool):
+        return int(value)
+    elif isinstance(value, (int, float)):
+        return float(value)
+    elif isinstance(value, (date, time)):
+        return to_excel(value)
 
-def read_csv_sample(file_, sample_size=100):
-    if file_.name.endswith(".csv.gz"):
+    return value
+
+
+def read_csv_sample(file_, sample_size=100, sampler=None):
+    if sampler is not None and sampler.text is not None:
+        fobj = StringIO(sampler.text, newline="")
+    elif file_.name.endswith(".csv.gz"):
         fobj = gzip.open(file_, mode="rt", newline="", encoding=FILE_ENCODING)
     elif file_.name.endswith(".xlsx"):
         fobj = file_
@@ -77,25 +331,69 @@ def read_csv_sample(file_, sample_size=100):
     return sample_data
 
 
-def is_data_valid(username, method, file_):
-    dest = Secret.objects.filter(username=username, methods__method=method)
-    if dest.exists():
-        expected_schema = dest.first().methods.get(method=method).schema
+@preset("compiled-table")
+def compiled_table(source, schema=None, **options):
+    # Igual ao preset "table" do goodtables, mas recebe o Schema já compilado
+    options.setdefault("headers", 1)
+    table = {
+        "source": "inline",
+        "stream": Stream(source, **options),
+        "schema": schema,
+        "extra": {},
+    }
+    return [], [table]
+
+
+def resolve_method(username, method):
+    """Busca o Secret e o MethodMapping do upload em uma única consulta"""
+    grant = (
+        Secret.methods.through.objects.select_related(
+            "secret", "methodmapping"
+        )
+        .filter(secret__username=username, methodmapping__method=method)
+        .first()
+    )
+    if grant is None:
+        return None, None
+
+    return grant.secret, grant.methodmapping
+
+
+def is_data_valid(username, method, file_, sampler=None, mapping=UNRESOLVED):
+    if mapping is UNRESOLVED:
+        _, mapping = resolve_method(username, method)
+
+    if mapping is not None:
+        expected_schema = get_compiled_schema(mapping)
 
         try:
-            sample_data = read_csv_sample(
-                file_, sample_size=settings.CSV_SAMPLE_SIZE,
-            )
+            with stage("sample"):
+                sample_data = read_csv_sample(
+                    file_,
+                    sample_size=settings.CSV_SAMPLE_SIZE,
+                    sampler=sampler,
+                )
         except InvalidDelimiterException as error:
             logger.info("{0} | {1} - {2}".format(str(error), username, method))
             return False, str(error)
 
-        validation = validate(sample_data, schema=expected_schema)
-        if validation["valid"]:
-            return True, {}
-        else:
+        with stage("validate"):
+            validation = validate(
+                sample_data, preset="compiled-table", schema=expected_schema
+            )
+        if not validation["valid"]:
             return False, validation["tables"][0]["errors"]
 
+        if mapping.full_validation and expected_schema is not None:
+            with stage("full_validation", file_.size):
+                errors = validate_all_rows(
+                    file_, expected_schema.descriptor, mapping.max_errors
+                )
+            if errors:
+                return False, errors
+
+        return True, {}
+
     logger.info(
         "Erro ao encontrar método para usuário {0} - {1}".format(
             username, method
@@ -104,17 +402,174 @@ def is_data_valid(username, method, file_):
     return False, "Destino para upload não existe"
 
 
-def get_destination(username, method):
-    user_secret = Secret.objects.filter(
-        username=username, methods__method=method
+def validate_all_rows(file_, descriptor, max_errors):
+    # xlsx já convertido é texto; só .csv e .csv.gz passam pelo pyarrow
+    use_columnar = (
+        settings.VALIDATION_ENGINE == "columnar"
+        and columnar.available
+        and not file_.name.endswith(".xlsx")
     )
-    if user_secret.exists():
-        return path.join(
-            user_secret.get().methods.get(method=method).uri, username
+    if use_columnar:
+        try:
+            return columnar.validate_columnar(file_, descriptor, max_errors)
+        except columnar.StructureError as error:
+            logger.info(
+                "Validação colunar indisponível para {0}: {1}".format(
+                    file_.name, error
+                )
+            )
+
+    if settings.VALIDATION_ENGINE == "parallel":
+        return validate_file_parallel(
+            file_, descriptor, get_validation_executor(), max_errors
         )
 
+    return validate_file(file_, descriptor, max_errors)
+
+
+def get_destination(username, method, mapping=None):
+    if mapping is None:
+        _, mapping = resolve_method(username, method)
+
+    if mapping is not None:
+        return path.join(mapping.uri, username)
+
     raise PermissionDenied()
 
 
-def upload_to_hdfs(file, filename, destination):
-    hdfsclient.write(path.join(destination, filename), file, overwrite=True)
+@contextmanager
+def discard_on_error(staging):
+    """Remove o envio antecipado se o bloco falhar antes do commit"""
+    try:
+        yield
+    except Exception:
+        if staging is not None:
+            staging.discard()
+        raise
+
+
+def upload_to_hdfs(file, filename, destination, staging=None):
+    started = monotonic()
+    if staging is None:
+        hdfsclient.write(
+            path.join(destination, filename), file, overwrite=True
+        )
+    else:
+        try:
+            staging.commit(destination, filename)
+        except Exception:
+            staging.discard()
+            raise
+
+    # CompressedStream comprime enquanto é lido pelo hdfsclient; o tempo de
+    # compressão é registrado à parte para não ser confundido com o do HDFS
+    elapsed = monotonic() - started
+    compression_time = getattr(file, "elapsed", None)
+    if compression_time is not None:
+        observe("compress", compression_time, file.size)
+        elapsed -= compression_time
+    observe("hdfs_write", elapsed, getattr(file, "size", None))
+
+
+class StagedHDFSWriter:
+    """Envia o upload para `<uri>/_incoming/<uuid>` enquanto ele é validado
+
+    Usado como sink de md5reader: os blocos vão para uma fila limitada e são
+    enviados ao HDFS por uma thread do sistema (thread_pool), de forma que a
+    transferência acontece junto com a leitura do arquivo. Depois da
+    validação o arquivo é movido para o destino final com commit() ou
+    removido com discard().
+    """
+
+    MAX_PENDING_CHUNKS = 32
+
+    def __init__(self, staging_root):
+        self.path = path.join(staging_root, "_incoming", uuid4().hex)
+        self.queue = native_queue(self.MAX_PENDING_CHUNKS)
+        self.error = None
+        self.closed = False
+        self.finished = False
+        self.committed = False
+        # Um pool por envio: cada fila precisa de uma thread só para ela
+        self.sender = thread_pool(1)
+        self.sent = self.sender.submit(self._send)
+
+    def _chunks(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                self.finished = True
+                return
+            yield chunk
+
+    def _send(self):
+        try:
+            hdfsclient.write(self.path, self._chunks(), overwrite=True)
+        except Exception as error:
+            self.error = error
+        finally:
+            # Libera quem ainda estiver escrevendo na fila
+            while not self.finished:
+                self.finished = self.queue.get() is None
+
+    def write(self, chunk):
+        if self.error is None:
+            self.queue.put(chunk)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+
+    def wait(self):
+        self.close()
+        self.sent.result()
+        self.sender.shutdown(wait=False)
+        if self.error is not None:
+            raise self.error
+
+    def commit(self, destination, filename):
+        """Move o arquivo enviado para `destination/filename`
+
+        O rename do WebHDFS não sobrescreve, então a versão anterior é movida
+        para o lado e só é removida depois que a nova estiver no destino; se
+        o rename falhar ela volta ao lugar. Entre os dois renames o destino
+        fica ausente por um instante.
+        """
+        self.wait()
+        final_path = path.join(destination, filename)
+        previous_path = self.path + ".previous"
+        hdfsclient.makedirs(destination)
+        replaced = hdfsclient.status(final_path, strict=False) is not None
+        if replaced:
+            hdfsclient.rename(final_path, previous_path)
+
+        try:
+            hdfsclient.rename(self.path, final_path)
+        except Exception:
+            if replaced:
+                hdfsclient.rename(previous_path, final_path)
+            raise
+
+        self.committed = True
+        if replaced:
+            try:
+                hdfsclient.delete(previous_path)
+            except HdfsError as error:
+                logger.info(
+                    "Erro ao remover {0}: {1}".format(previous_path, error)
+                )
+
+    def discard(self):
+        if self.committed:
+            return
+
+        try:
+            self.wait()
+        except Exception as error:
+            logger.info("Erro no envio de {0}: {1}".format(self.path, error))
+
+        try:
+            hdfsclient.delete(self.path)
+        except HdfsError as error:
+            logger.info("Erro ao remover {0}: {1}".format(self.path, error))
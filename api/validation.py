@@ -0,0 +1,536 @@
+"""Validação de todas as linhas do csv contra o Table Schema do método
+
+A amostra continua sendo validada pelo goodtables. Quando o MethodMapping
+tem `full_validation` o restante do arquivo é lido em blocos de
+`CHUNK_ROWS` linhas e cada coluna do bloco é checada de uma vez, sem
+guardar o arquivo em memória. Os erros seguem o formato do goodtables.
+
+validate_file_parallel distribui os blocos entre processos; só a checagem
+de unique, que depende dos blocos anteriores, fica no processo principal.
+"""
+import csv
+import gzip
+import re
+from collections import deque
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from hashlib import md5
+from io import TextIOWrapper
+from itertools import islice, zip_longest
+
+FILE_ENCODING = "utf-8-sig"
+CHUNK_ROWS = 10000
+# Textos de colunas unique maiores que isso são guardados pelo md5
+UNIQUE_KEY_SIZE = 16
+
+MESSAGES = {
+    "blank-row": "Row {row_number} is completely blank",
+    "extra-value": "Row {row_number} has an extra value in column "
+    "{column_number}",
+    "missing-value": "Row {row_number} has a missing value in column "
+    "{column_number}",
+    "type-or-format-error": "The value {value} in row {row_number} and "
+    "column {column_number} is not type {field_type} and format "
+    "{field_format}",
+    "required-constraint": "Column {column_number} is a required field, "
+    "but row {row_number} has no value",
+    "pattern-constraint": "The value {value} in row {row_number} and column "
+    "{column_number} does not conform to the pattern constraint of "
+    "{constraint}",
+    "unique-constraint": "Rows {row_numbers} has unique constraint "
+    "violation in column {column_number}",
+    "enumerable-constraint": "The value {value} in row {row_number} and "
+    "column {column_number} does not conform to the given enumeration: "
+    "{constraint}",
+    "minimum-constraint": "The value {value} in row {row_number} and column "
+    "{column_number} does not conform to the minimum constraint of "
+    "{constraint}",
+    "maximum-constraint": "The value {value} in row {row_number} and column "
+    "{column_number} does not conform to the maximum constraint of "
+    "{constraint}",
+    "minimum-length-constraint": "The value {value} in row {row_number} and "
+    "column {column_number} does not conform to the minimum length "
+    "constraint of {constraint}",
+    "maximum-length-constraint": "The value {value} in row {row_number} and "
+    "column {column_number} does not conform to the maximum length "
+    "constraint of {constraint}",
+}
+QUOTED = ("value", "field_type", "field_format", "constraint")
+
+INTEGER_RE = re.compile(r"[+-]?\d+")
+YEAR_RE = re.compile(r"[+-]?\d{4}")
+DEFAULT_FORMATS = {
+    "date": "%Y-%m-%d",
+    "datetime": "%Y-%m-%dT%H:%M:%SZ",
+    "time": "%H:%M:%S",
+}
+TRUE_VALUES = ["true", "True", "TRUE", "1"]
+FALSE_VALUES = ["false", "False", "FALSE", "0"]
+
+
+def make_error(code, row, row_number, column_number=None, **data):
+    substitutions = {
+        key: '"{0}"'.format(value) if key in QUOTED else value
+        for key, value in data.items()
+    }
+    error = {
+        "code": code,
+        "row": row,
+        "row-number": row_number,
+        "message": MESSAGES[code].format(
+            row_number=row_number,
+            column_number=column_number,
+            **substitutions
+        ),
+        "message-data": {key: str(value) for key, value in data.items()},
+    }
+    if column_number is not None:
+        error["column-number"] = column_number
+
+    return error
+
+
+def unique_key(value):
+    """Chave de `value` em FieldChecker.seen, com tamanho limitado
+
+    Textos longos são guardados pelo md5: o conjunto de valores de uma
+    coluna unique fica em memória até o fim do arquivo.
+    """
+    if isinstance(value, str) and len(value) > UNIQUE_KEY_SIZE:
+        return md5(value.encode()).digest()
+    return value
+
+
+def repeated_rows(seen, key, row_number):
+    """Registra `key` em `seen` e devolve row_numbers se ele já apareceu
+
+    Mesmo texto do goodtables: todas as linhas anteriores e a atual ou, a
+    partir da sétima ocorrência, as três primeiras, a atual e quantas mais.
+    Até a primeira repetição só o número da linha é guardado; depois, a
+    contagem e no máximo as cinco primeiras linhas, que é o que o texto usa.
+    """
+    previous = seen.get(key)
+    if previous is None:
+        seen[key] = row_number
+        return None
+    if not isinstance(previous, list):
+        previous = seen[key] = [1, previous]
+
+    count, rows = previous[0], previous[1:]
+    if count <= 5:
+        row_numbers = ", ".join(map(str, rows + [row_number]))
+    else:
+        row_numbers = "{0} and {1} others".format(
+            ", ".join(map(str, rows[:3] + [row_number])), count - 4
+        )
+    previous[0] += 1
+    if len(rows) < 5:
+        previous.append(row_number)
+    return row_numbers
+
+
+def open_csv_text(file_):
+    """Abre o upload (.csv, .csv.gz ou xlsx já convertido) como texto"""
+    file_.seek(0)
+    if file_.name.endswith(".csv.gz"):
+        return gzip.open(file_, mode="rt", newline="", encoding=FILE_ENCODING)
+    elif file_.name.endswith(".xlsx"):
+        return file_
+
+    return TextIOWrapper(
+        getattr(file_, "file", file_), encoding=FILE_ENCODING, newline=""
+    )
+
+
+def release_csv_text(file_, text):
+    # O TextIOWrapper fecharia o upload ao ser coletado
+    if isinstance(text, TextIOWrapper):
+        text.detach()
+    file_.seek(0)
+
+
+class FieldChecker:
+    """Checagens de tipo e restrições de um campo do Table Schema
+
+    `check` recebe todos os valores da coluna em um bloco de linhas e
+    devolve os erros encontrados.
+    """
+
+    def __init__(self, field, column_number, missing_values=("",)):
+        self.column_number = column_number
+        self.missing_values = set(missing_values)
+        self.type = field.get("type", "string")
+        self.format = field.get("format", "default")
+        self.strptime_format = None
+        self.cast = self.build_cast(field)
+        self.constraints = constraints = field.get("constraints", {})
+        self.required = constraints.get("required", False)
+        self.seen = {}
+        # Com uma lista aqui, unique só é registrado para checagem posterior
+        self.deferred = None
+        # Mesma ordem do goodtables: só o primeiro erro de cada célula conta
+        self.checks = []
+        if "pattern" in constraints:
+            pattern = re.compile(constraints["pattern"])
+            self.add_check(
+                "pattern-constraint",
+                constraints["pattern"],
+                lambda text, value: pattern.fullmatch(text) is not None,
+            )
+        if constraints.get("unique", False):
+            self.add_check("unique-constraint", None, None)
+        if "enum" in constraints:
+            enum = {self.cast_constraint(item) for item in constraints["enum"]}
+            self.add_check(
+                "enumerable-constraint",
+                constraints["enum"],
+                lambda text, value: value in enum,
+            )
+        if "minimum" in constraints:
+            minimum = self.cast_constraint(constraints["minimum"])
+            self.add_check(
+                "minimum-constraint",
+                constraints["minimum"],
+                lambda text, value: value >= minimum,
+            )
+        if "maximum" in constraints:
+            maximum = self.cast_constraint(constraints["maximum"])
+            self.add_check(
+                "maximum-constraint",
+                constraints["maximum"],
+                lambda text, value: value <= maximum,
+            )
+        if "minLength" in constraints:
+            min_length = constraints["minLength"]
+            self.add_check(
+                "minimum-length-constraint",
+                min_length,
+                lambda text, value: len(text) >= min_length,
+            )
+        if "maxLength" in constraints:
+            max_length = constraints["maxLength"]
+            self.add_check(
+                "maximum-length-constraint",
+                max_length,
+                lambda text, value: len(text) <= max_length,
+            )
+
+    def add_check(self, code, constraint, test):
+        self.checks.append((code, constraint, test))
+
+    def build_cast(self, field):
+        if self.type == "integer":
+            return self.cast_integer
+        elif self.type == "number":
+            decimal_char = field.get("decimalChar", ".")
+            group_char = field.get("groupChar", "")
+            return lambda text: self.cast_number(
+                text, decimal_char, group_char
+            )
+        elif self.type == "boolean":
+            true_values = field.get("trueValues", TRUE_VALUES)
+            false_values = field.get("falseValues", FALSE_VALUES)
+            return lambda text: self.cast_boolean(
+                text, true_values, false_values
+            )
+        elif self.type == "year":
+            return self.cast_year
+        elif self.type in DEFAULT_FORMATS and self.format != "any":
+            pattern = self.format
+            if pattern == "default":
+                pattern = DEFAULT_FORMATS[self.type]
+            elif pattern.startswith("fmt:"):
+                pattern = pattern[4:]
+            self.strptime_format = pattern
+            return lambda text: datetime.strptime(text, pattern)
+
+        # string e tipos sem checagem própria (object, array, geopoint...)
+        return str
+
+    @staticmethod
+    def cast_integer(text):
+        if INTEGER_RE.fullmatch(text) is None:
+            raise ValueError(text)
+        return int(text)
+
+    @staticmethod
+    def cast_number(text, decimal_char, group_char):
+        if group_char:
+            text = text.replace(group_char, "")
+        if decimal_char != ".":
+            text = text.replace(decimal_char, ".")
+        try:
+            return Decimal(text)
+        except InvalidOperation:
+            raise ValueError(text)
+
+    @staticmethod
+    def cast_boolean(text, true_values, false_values):
+        if text in true_values:
+            return True
+        elif text in false_values:
+            return False
+        raise ValueError(text)
+
+    @staticmethod
+    def cast_year(text):
+        if YEAR_RE.fullmatch(text) is None:
+            raise ValueError(text)
+        return int(text)
+
+    def cast_constraint(self, value):
+        return value if not isinstance(value, str) else self.cast(value)
+
+    def check_constraints(self, text, value, row_number):
+        for code, constraint, test in self.checks:
+            if test is None and self.deferred is not None:
+                self.deferred.append((row_number, unique_key(value)))
+            elif test is None:
+                # unique é a única checagem que guarda estado entre blocos
+                row_numbers = repeated_rows(
+                    self.seen, unique_key(value), row_number
+                )
+                if row_numbers is not None:
+                    return code, {"row_numbers": row_numbers}
+            elif not test(text, value):
+                return code, {"value": text, "constraint": constraint}
+
+        return None
+
+    def check_cell(self, text, row, row_number):
+        """Primeiro erro da célula no formato do goodtables, se houver"""
+        if text in self.missing_values:
+            if self.required:
+                return make_error(
+                    "required-constraint", row, row_number, self.column_number
+                )
+            return None
+
+        try:
+            value = self.cast(text)
+        except ValueError:
+            return make_error(
+                "type-or-format-error",
+                row,
+                row_number,
+                self.column_number,
+                value=text,
+                field_type=self.type,
+                field_format=self.format,
+            )
+
+        error = self.check_constraints(text, value, row_number)
+        if error is not None:
+            code, data = error
+            return make_error(
+                code, row, row_number, self.column_number, **data
+            )
+
+        return None
+
+    def check(self, values, rows, first_row_number):
+        errors = []
+        for offset, text in enumerate(values):
+            # Linhas em branco e valores ausentes já foram reportados
+            if text is None:
+                continue
+
+            error = self.check_cell(
+                text, rows[offset], first_row_number + offset
+            )
+            if error is not None:
+                errors.append(error)
+
+        return errors
+
+
+class TableChecker:
+    """Valida blocos de linhas do csv contra um descriptor de Table Schema"""
+
+    def __init__(self, descriptor, defer_unique=False):
+        fields = descriptor.get("fields", [])
+        missing_values = descriptor.get("missingValues", [""])
+        primary_key = descriptor.get("primaryKey", [])
+        if isinstance(primary_key, str):
+            primary_key = [primary_key]
+
+        self.width = len(fields)
+        self.fields = []
+        for column_number, field in enumerate(fields, start=1):
+            if field.get("name") in primary_key:
+                constraints = dict(field.get("constraints", {}))
+                constraints.update(required=True, unique=True)
+                field = dict(field, constraints=constraints)
+            checker = FieldChecker(field, column_number, missing_values)
+            if defer_unique:
+                checker.deferred = []
+            self.fields.append(checker)
+
+    def check_structure(self, rows, first_row_number):
+        errors = []
+        for offset, row in enumerate(rows):
+            row_number = first_row_number + offset
+            if not any(row):
+                errors.append(make_error("blank-row", row, row_number))
+                continue
+
+            for column_number in range(self.width + 1, len(row) + 1):
+                errors.append(
+                    make_error("extra-value", row, row_number, column_number)
+                )
+            for column_number in range(len(row) + 1, self.width + 1):
+                errors.append(
+                    make_error(
+                        "missing-value", row, row_number, column_number
+                    )
+                )
+
+        return errors
+
+    def columns(self, rows):
+        # Transpõe o bloco; linhas em branco não são checadas por coluna
+        cells = (row if any(row) else [] for row in rows)
+        return islice(zip_longest(*cells, [None] * self.width), self.width)
+
+    def check(self, rows, first_row_number):
+        errors = self.check_structure(rows, first_row_number)
+        for field, values in zip(self.fields, self.columns(rows)):
+            errors.extend(field.check(values, rows, first_row_number))
+
+        errors.sort(key=lambda error: error_position(error))
+        return errors
+
+
+def error_position(error):
+    return error["row-number"], error.get("column-number", 0)
+
+
+def iter_chunks(reader, chunk_rows=CHUNK_ROWS):
+    while True:
+        rows = list(islice(reader, chunk_rows))
+        if not rows:
+            return
+        yield rows
+
+
+def validate_file(file_, descriptor, max_errors=100, chunk_rows=CHUNK_ROWS):
+    """Valida todas as linhas de `file_` e para após `max_errors` erros
+
+    A primeira linha é o cabeçalho, já checado na validação da amostra.
+    """
+    checker = TableChecker(descriptor)
+    text = open_csv_text(file_)
+    try:
+        reader = csv.reader(text)
+        next(reader, None)
+        errors = []
+        row_number = 2
+        for rows in iter_chunks(reader, chunk_rows):
+            errors.extend(checker.check(rows, row_number))
+            if len(errors) >= max_errors:
+                return errors[:max_errors]
+            row_number += len(rows)
+    finally:
+        release_csv_text(file_, text)
+
+    return errors
+
+
+def check_chunk(descriptor, rows, first_row_number):
+    """Valida um bloco em um processo de validate_file_parallel
+
+    Devolve os erros do bloco e, para cada coluna unique, os valores que
+    ainda precisam ser comparados com os blocos anteriores.
+    """
+    checker = TableChecker(descriptor, defer_unique=True)
+    errors = checker.check(rows, first_row_number)
+    deferred = [
+        (field.column_number, field.deferred)
+        for field in checker.fields
+        if field.deferred
+    ]
+    return errors, deferred
+
+
+def merge_unique(errors, deferred, rows, first_row_number, seen):
+    """Aplica unique aos valores adiados de um bloco, na ordem do arquivo
+
+    Uma célula repetida recebe o erro de unique no lugar de eventuais erros
+    das restrições checadas depois dele, como na validação sequencial.
+    """
+    positions = {
+        error_position(error): index for index, error in enumerate(errors)
+    }
+    for column_number, values in deferred:
+        column_seen = seen.setdefault(column_number, {})
+        for row_number, key in values:
+            row_numbers = repeated_rows(column_seen, key, row_number)
+            if row_numbers is None:
+                continue
+
+            error = make_error(
+                "unique-constraint",
+                rows[row_number - first_row_number],
+                row_number,
+                column_number,
+                row_numbers=row_numbers,
+            )
+            position = (row_number, column_number)
+            if position in positions:
+                errors[positions[position]] = error
+            else:
+                errors.append(error)
+
+    errors.sort(key=error_position)
+    return errors
+
+
+def validate_file_parallel(
+    file_,
+    descriptor,
+    executor,
+    max_errors=100,
+    chunk_rows=CHUNK_ROWS,
+    max_pending=8,
+):
+    """Mesmo resultado de validate_file com os blocos validados em `executor`
+
+    Os blocos são lidos em ordem e no máximo `max_pending` ficam em
+    memória; os resultados são consumidos na ordem do arquivo, então os
+    erros saem ordenados e a leitura para assim que `max_errors` é atingido.
+    """
+    seen = {}
+    pending = deque()
+    errors = []
+    text = open_csv_text(file_)
+    try:
+        reader = csv.reader(text)
+        next(reader, None)
+        chunks = iter_chunks(reader, chunk_rows)
+        row_number = 2
+        while True:
+            for rows in islice(chunks, max_pending - len(pending)):
+                future = executor.submit(
+                    check_chunk, descriptor, rows, row_number
+                )
+                pending.append((rows, row_number, future))
+                row_number += len(rows)
+
+            if not pending:
+                break
+
+            rows, first_row_number, future = pending.popleft()
+            chunk_errors, deferred = future.result()
+            errors.extend(
+                merge_unique(
+                    chunk_errors, deferred, rows, first_row_number, seen
+                )
+            )
+            if len(errors) >= max_errors:
+                return errors[:max_errors]
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+        release_csv_text(file_, text)
+
+    return errors
@@ -1,29 +1,349 @@
 import logging
+from os import path
 
-from django.http import JsonResponse
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
 
-from api.forms import FileUploadForm
-from .utils import securedecorator, get_destination, upload_to_hdfs
+from api.chunked import (
+    MAX_CHUNK_NUMBER,
+    delete_chunk,
+    missing_chunks,
+    received_chunks,
+    save_chunk,
+)
+from api.forms import ChunkedUploadForm, FileUploadForm
+from api.jobs import commit_chunked_upload, enqueue_upload, run_blocking
+from api.ledger import (
+    find_duplicate,
+    hdfs_timer,
+    parse_timestamp,
+    record_upload,
+    timer,
+    upload_history,
+)
+from api.metrics import render, request_context
+from api.models import ChunkedUpload, Upload, UploadJob
+from .utils import (
+    securedecorator,
+    discard_on_error,
+    get_destination,
+    resolve_method,
+    upload_to_hdfs,
+)
 
 logger = logging.getLogger(__name__)
+MAX_PAGE_SIZE = 1000
 
 
 @securedecorator
 @csrf_exempt
+@request_context
 def upload(request):
-    form = FileUploadForm(data=request.POST, files=request.FILES)
-    if form.is_valid():
-        # TODO: mover as linhas abaixo para método upload_file no Form
-        destination = get_destination(
-            form.cleaned_data["nome"], form.cleaned_data["method"]
+    username = request.POST.get("nome")
+    method = request.POST.get("method")
+    file_ = request.FILES.get("file")
+    filename = request.POST.get("filename") or getattr(file_, "name", "")
+    _, mapping = resolve_method(username, method)
+    if mapping is not None and file_ is not None:
+        # Reenvio de um arquivo já gravado: nada é validado ou reescrito
+        destination = get_destination(username, method, mapping=mapping)
+        duplicate = find_duplicate(
+            username,
+            method,
+            path.join(destination, filename),
+            file_,
+            request.POST.get("md5"),
         )
-        upload_to_hdfs(
-            form.files["file"], form.cleaned_data["filename"], destination
+        if duplicate is not None:
+            record_upload(
+                username,
+                method,
+                filename,
+                duplicate.md5,
+                duplicate.path,
+                status=Upload.DUPLICATE,
+                raw_size=file_.size,
+            )
+            logger.info(
+                "username %s -> %s already uploaded" % (username, filename)
+            )
+            return JsonResponse(
+                {"md5": duplicate.md5, "error": {}, "duplicate": True}
+            )
+
+    if request.POST.get("async") in ("1", "true") and file_ is not None:
+        job = enqueue_upload(request.POST, file_)
+        return JsonResponse(
+            {"job": str(job.id), "status": job.status}, status=202
+        )
+
+    base_return, status_code = run_blocking(
+        process_upload, request.POST, request.FILES, mapping, filename
+    )
+    return JsonResponse(base_return, status=status_code)
+
+
+def process_upload(data, files, mapping, filename):
+    # Validação e envio ao HDFS, fora do loop de eventos no worker gevent
+    username = data.get("nome")
+    method = data.get("method")
+    file_ = files.get("file")
+    form = FileUploadForm(
+        data=data,
+        files=files,
+        staged=settings.HDFS_STAGED_WRITES,
+        mapping=mapping,
+    )
+    with discard_on_error(form.staging):
+        timings = {}
+        with timer(timings, "validation_time"):
+            valid = form.is_valid()
+
+        if valid:
+            # TODO: mover as linhas abaixo para método upload_file no Form
+            destination = get_destination(
+                form.cleaned_data["nome"],
+                form.cleaned_data["method"],
+                mapping=mapping,
+            )
+            with hdfs_timer(timings, form.files["file"]):
+                upload_to_hdfs(
+                    form.files["file"],
+                    form.cleaned_data["filename"],
+                    destination,
+                    staging=form.staging,
+                )
+            record_upload(
+                username,
+                method,
+                filename,
+                form.md5_,
+                path.join(destination, form.cleaned_data["filename"]),
+                raw_size=file_.size,
+                compressed_size=file_.size,
+                **timings
+            )
+            logger.info(
+                "username %s -> %s successfully uploaded to HDFS"
+                % (form.cleaned_data["nome"], form.cleaned_data["filename"])
+            )
+        else:
+            if form.staging is not None:
+                form.staging.discard()
+            if file_ is not None:
+                record_upload(
+                    username,
+                    method,
+                    filename,
+                    form.md5_,
+                    status=Upload.INVALID,
+                    raw_size=file_.size,
+                    **timings
+                )
+
+    return form.base_return, form.status_code
+
+
+@securedecorator
+@csrf_exempt
+def upload_status(request, job_id):
+    # Cada parceiro só consulta os próprios jobs
+    job = get_object_or_404(
+        UploadJob, id=job_id, username=request.POST.get("nome")
+    )
+    if not job.finished:
+        return JsonResponse(
+            {"job": str(job.id), "status": job.status}, status=202
+        )
+
+    return JsonResponse(job.result, status=job.status_code)
+
+
+@require_GET
+def metrics(request):
+    body, content_type = render()
+    return HttpResponse(body, content_type=content_type)
+
+
+@staff_member_required
+@require_GET
+def upload_list(request):
+    """Histórico de envios em JSON, filtrável por usuário, método e período
+
+    Parâmetros: username, method, status, since e until (datas ISO 8601),
+    limit e cursor, este vindo de `next` da página anterior.
+    """
+    queryset = Upload.objects.all()
+    for name in ("username", "method", "status"):
+        if request.GET.get(name):
+            queryset = queryset.filter(**{name: request.GET[name]})
+
+    try:
+        if request.GET.get("since"):
+            queryset = queryset.filter(
+                created_at__gte=parse_timestamp(request.GET["since"])
+            )
+        if request.GET.get("until"):
+            queryset = queryset.filter(
+                created_at__lt=parse_timestamp(request.GET["until"])
+            )
+        limit = min(int(request.GET.get("limit", 100)), MAX_PAGE_SIZE)
+        uploads, cursor = upload_history(
+            queryset, request.GET.get("cursor"), max(limit, 1)
+        )
+    except ValueError as error:
+        return JsonResponse({"error": {"__all__": [str(error)]}}, status=400)
+
+    return JsonResponse(
+        {
+            "results": [
+                {
+                    "id": upload.id,
+                    "username": upload.username,
+                    "method": upload.method,
+                    "filename": upload.filename,
+                    "md5": upload.md5,
+                    "path": upload.path,
+                    "status": upload.status,
+                    "raw_size": upload.raw_size,
+                    "compressed_size": upload.compressed_size,
+                    "validation_time": upload.validation_time,
+                    "compression_time": upload.compression_time,
+                    "hdfs_time": upload.hdfs_time,
+                    "created_at": upload.created_at,
+                }
+                for upload in uploads
+            ],
+            "next": cursor,
+        }
+    )
+
+
+def chunked_upload_return(upload, status=200):
+    data = {
+        "upload": str(upload.id),
+        "status": upload.status,
+        "chunks": received_chunks(upload),
+    }
+    if upload.job_id is not None:
+        data["job"] = str(upload.job_id)
+
+    return JsonResponse(data, status=status)
+
+
+def md5_error_return(digest):
+    return JsonResponse(
+        {"md5": digest, "error": {"md5": ["valor md5 não confere!"]}},
+        status=400,
+    )
+
+
+def get_open_upload(request, upload_id):
+    upload = get_object_or_404(
+        ChunkedUpload, id=upload_id, username=request.POST.get("nome")
+    )
+    if upload.status != ChunkedUpload.OPEN:
+        return upload, JsonResponse(
+            {"error": {"__all__": ["upload já finalizado"]}}, status=409
         )
-        logger.info(
-            "username %s -> %s successfully uploaded to HDFS"
-            % (form.cleaned_data["nome"], form.cleaned_data["filename"])
+
+    return upload, None
+
+
+@securedecorator
+@csrf_exempt
+def chunked_init(request):
+    form = ChunkedUploadForm(data=request.POST)
+    if not form.is_valid():
+        return JsonResponse({"error": form.errors}, status=400)
+
+    _, mapping = resolve_method(
+        form.cleaned_data["nome"], form.cleaned_data["method"]
+    )
+    if mapping is None:
+        raise PermissionDenied
+
+    upload = ChunkedUpload.objects.create(
+        username=form.cleaned_data["nome"],
+        method=form.cleaned_data["method"],
+        filename=form.cleaned_data["filename"],
+        md5=form.cleaned_data["md5"],
+    )
+    return chunked_upload_return(upload, status=201)
+
+
+@securedecorator
+@csrf_exempt
+def chunked_status(request, upload_id):
+    upload = get_object_or_404(
+        ChunkedUpload, id=upload_id, username=request.POST.get("nome")
+    )
+    return chunked_upload_return(upload)
+
+
+@securedecorator
+@csrf_exempt
+def chunked_part(request, upload_id, number):
+    upload, error = get_open_upload(request, upload_id)
+    if error is not None:
+        return error
+
+    file_ = request.FILES.get("file")
+    if file_ is None or not 1 <= number <= MAX_CHUNK_NUMBER:
+        return JsonResponse(
+            {
+                "error": {
+                    "file": [
+                        "parte deve ser numerada de 1 a {0}".format(
+                            MAX_CHUNK_NUMBER
+                        )
+                    ]
+                }
+            },
+            status=400,
+        )
+
+    digest = save_chunk(upload, number, file_)
+    if digest != request.POST.get("md5"):
+        delete_chunk(upload, number)
+        return md5_error_return(digest)
+
+    return JsonResponse({"chunk": number, "md5": digest}, status=201)
+
+
+@securedecorator
+@csrf_exempt
+def chunked_commit(request, upload_id):
+    upload, error = get_open_upload(request, upload_id)
+    if error is not None:
+        return error
+
+    numbers = received_chunks(upload)
+    missing = missing_chunks(numbers)
+    if not numbers or missing:
+        return JsonResponse(
+            {
+                "missing": missing,
+                "error": {"chunks": ["upload com partes faltando"]},
+            },
+            status=400,
+        )
+
+    job = commit_chunked_upload(upload)
+    if job is None:
+        return JsonResponse(
+            {"error": {"__all__": ["upload já finalizado"]}}, status=409
         )
 
-    return JsonResponse(form.base_return, status=form.status_code)
+    logger.info(
+        "username %s -> %s enviado em %d partes"
+        % (upload.username, upload.filename, len(numbers))
+    )
+    return JsonResponse(
+        {"job": str(job.id), "status": job.status}, status=202
+    )
@@ -13,4 +13,4 @@ refresh_kinit() {
 refresh_kinit &
 sleep 1;
 
-gunicorn datalakecadg.wsgi:application --workers=12 --threads=2 --bind=0.0.0.0:8080 -t 180 --log-file -
+gunicorn datalakecadg.wsgi:application --config gunicorn.conf.py --workers=${GUNICORN_WORKERS:-12} --threads=${GUNICORN_THREADS:-2} --bind=0.0.0.0:8080 -t 180 --log-file -
@@ -1,5 +1,13 @@
+import gzip
+from hashlib import md5
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
 from django.urls import reverse
+from model_mommy.mommy import make
+
+from api.models import Upload
 
 
 class LandingPage(TestCase):
@@ -17,3 +25,38 @@ class TestUploadManual(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "core/upload_manual.html")
+
+    @mock.patch("secret.models.send_mail")
+    @mock.patch("secret.models.login")
+    def test_record_manual_upload(self, _login, _send_mail):
+        secret = make("secret.Secret", username="anyname")
+        secret.methods.add(
+            make(
+                "methodmapping.MethodMapping",
+                method="cpf",
+                uri="/path/to/storage/cpf",
+                schema=None,
+            )
+        )
+        with open("api/tests/assets/csv_example.csv.gz", "rb") as file_:
+            contents = gzip.decompress(file_.read())
+
+        with mock.patch("core.views.upload_to_hdfs") as _upload_to_hdfs:
+            # Lê o arquivo como o hdfsclient, comprimindo o csv
+            _upload_to_hdfs.side_effect = lambda file_, *args: file_.read()
+            response = self.client.post(
+                reverse("core:upload-manual"),
+                {
+                    "SECRET": secret.secret_key,
+                    "nome": secret.username,
+                    "method": "cpf",
+                    "file": SimpleUploadedFile("csv_example.csv", contents),
+                },
+            )
+
+        upload = Upload.objects.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(upload.status, Upload.SUCCESS)
+        self.assertEqual(upload.md5, md5(contents).hexdigest())
+        self.assertGreater(upload.compression_time, 0)
+        self.assertGreaterEqual(upload.hdfs_time, 0)
@@ -1,6 +1,10 @@
 import logging
+from os import path
 
 from api.forms import FileUploadForm
+from api.ledger import hdfs_timer, record_upload, timer
+from api.metrics import request_context
+from api.models import Upload
 from api.utils import get_destination, upload_to_hdfs
 from django.shortcuts import render
 from secret.models import Secret
@@ -12,6 +16,7 @@ def home(request):
     return render(request, "core/home.html")
 
 
+@request_context
 def upload_manual(request):
     template_name = "core/upload_manual.html"
     if request.method == "GET":
@@ -20,21 +25,43 @@ def upload_manual(request):
         # TODO: transformar validação abaixo em função
         username = request.POST.get("nome", -1)
         secret = request.POST.get("SECRET", -1)
-        if Secret.objects.filter(username=username, secret_key=secret).exists():
+        if Secret.objects.authenticate(username, secret):
             form = FileUploadForm(
                 data=request.POST,
                 files=request.FILES,
                 disable_md5=True,
                 good_exts=(".csv", ".csv.gz", ".xlsx"),
             )
-            if form.is_valid():
+            file_ = request.FILES.get("file")
+            filename = request.POST.get("filename") or getattr(
+                file_, "name", ""
+            )
+            timings = {}
+            with timer(timings, "validation_time"):
+                valid = form.is_valid()
+
+            if valid:
                 destination = get_destination(
-                    form.cleaned_data["nome"], form.cleaned_data["method"]
+                    form.cleaned_data["nome"],
+                    form.cleaned_data["method"],
+                    mapping=form.mapping,
                 )
-                upload_to_hdfs(
-                    form.cleaned_data["file"],
-                    form.cleaned_data["filename"],
-                    destination,
+                with hdfs_timer(timings, form.cleaned_data["file"]):
+                    upload_to_hdfs(
+                        form.cleaned_data["file"],
+                        form.cleaned_data["filename"],
+                        destination,
+                    )
+                # O arquivo enviado pode ser o csv comprimido na validação
+                record_upload(
+                    username,
+                    form.cleaned_data["method"],
+                    filename,
+                    form.md5_,
+                    path.join(destination, form.cleaned_data["filename"]),
+                    raw_size=file_.size,
+                    compressed_size=form.cleaned_data["file"].size,
+                    **timings
                 )
                 logger.info(
                     "username %s -> %s successfully uploaded to HDFS"
@@ -47,6 +74,16 @@ def upload_manual(request):
                     request, template_name, {"form": form, "success": True}
                 )
             else:
+                if file_ is not None:
+                    record_upload(
+                        username,
+                        request.POST.get("method", ""),
+                        filename,
+                        form.md5_,
+                        status=Upload.INVALID,
+                        raw_size=file_.size,
+                        **timings
+                    )
                 return render(request, template_name, {"form": form})
         else:
             return render(
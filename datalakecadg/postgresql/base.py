@@ -0,0 +1,37 @@
+from django.db.backends.postgresql import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL com verificação das conexões persistentes
+
+    Com CONN_MAX_AGE a conexão é reaproveitada entre requisições, mas pode
+    ter sido derrubada pelo servidor, por um pooler ou pela rede. Com
+    CONN_HEALTH_CHECKS a conexão reaproveitada é testada no primeiro uso de
+    cada requisição e reaberta se não responder, em vez de levar a
+    requisição ao erro. Conexões recém-abertas não são testadas.
+    """
+
+    health_check_done = False
+
+    def connect(self):
+        # set_autocommit() chama ensure_connection() durante a conexão
+        self.health_check_done = True
+        super().connect()
+
+    def close_if_unusable_or_obsolete(self):
+        # Chamado no início e no fim de cada requisição
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (
+            self.connection is not None
+            and not self.health_check_done
+            and not self.in_atomic_block
+            and self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+        ):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+
+        super().ensure_connection()
@@ -11,7 +11,8 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
-from decouple import config
+from decouple import Csv, config
+from django.core.exceptions import ImproperlyConfigured
 from dj_database_url import parse as db_url
 from unipath import Path
 
@@ -91,6 +92,26 @@ DATABASES = {
 }
 
 
+# Cache
+# O cache "secrets" guarda as chaves usadas na autenticação da API. Por padrão
+# ele fica na memória de cada worker e só é invalidado no processo que alterou
+# o Secret; com um backend compartilhado (memcached, redis...) a invalidação
+# vale para todos os workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'secrets': {
+        'BACKEND': config(
+            'SECRET_CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': config('SECRET_CACHE_LOCATION', default='secrets'),
+        'TIMEOUT': config('SECRET_CACHE_TIMEOUT', default=60, cast=int),
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -149,6 +170,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'datalakecadg': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': True,
+        },
     },
 }
 
@@ -164,5 +190,115 @@ if 'RUNTIME' in os.environ:
     HDFS_USER = config('HDFS_USER')
 
 
+# Gunicorn (mesmas variáveis usadas em app.sh)
+GUNICORN_WORKERS = config("GUNICORN_WORKERS", default=12, cast=int)
+GUNICORN_THREADS = config("GUNICORN_THREADS", default=2, cast=int)
+# gthread ou gevent (ver gunicorn.conf.py)
+GUNICORN_WORKER_CLASS = config("GUNICORN_WORKER_CLASS", default="gthread")
+GUNICORN_WORKER_CONNECTIONS = config(
+    "GUNICORN_WORKER_CONNECTIONS", default=100, cast=int
+)
+# Consulta o status da raiz do HDFS no aquecimento do master do gunicorn
+# (datalakecadg/warmup.py); sem esta opção o cliente só é criado
+WARMUP_HDFS_PROBE = config("WARMUP_HDFS_PROBE", default=False, cast=bool)
+
 # CSV
 CSV_SAMPLE_SIZE = config("CSV_SAMPLE_SIZE", default=100, cast=int)
+
+# Validação completa: "columnar" (pyarrow, se instalado), "parallel"
+# (blocos validados em VALIDATION_PROCESSES processos) ou "python"
+VALIDATION_ENGINE = config("VALIDATION_ENGINE", default="columnar")
+# Por worker do gunicorn: por padrão os workers dividem os processadores
+VALIDATION_PROCESSES = config(
+    "VALIDATION_PROCESSES",
+    default=max((os.cpu_count() or 1) // GUNICORN_WORKERS, 1),
+    cast=int,
+)
+
+# Arquivos a partir deste tamanho (bytes) são comprimidos em blocos paralelos
+GZIP_PARALLEL_THRESHOLD = config(
+    "GZIP_PARALLEL_THRESHOLD", default=64 * 1024 * 1024, cast=int
+)
+GZIP_PARALLEL_WORKERS = config(
+    "GZIP_PARALLEL_WORKERS", default=os.cpu_count() or 1, cast=int
+)
+
+# Upload assíncrono (campo async=true em /api/upload/)
+UPLOAD_SPOOL_DIR = config(
+    "UPLOAD_SPOOL_DIR", default=BASE_DIR.parent.child("spool")
+)
+UPLOAD_WORKERS = config("UPLOAD_WORKERS", default=2, cast=int)
+# Jobs em processamento há mais tempo que isto (segundos) são considerados
+# abandonados por um worker encerrado e voltam para a fila
+# (manage.py process_upload_jobs)
+UPLOAD_JOB_TIMEOUT = config("UPLOAD_JOB_TIMEOUT", default=3600, cast=int)
+
+# Conexões persistentes com o banco
+# Cada thread do gunicorn mantém sua conexão por DB_CONN_MAX_AGE segundos,
+# testada no primeiro uso de cada requisição (datalakecadg/postgresql). Por
+# padrão as conexões só são mantidas se as de todos os workers couberem em
+# DB_MAX_CONNECTIONS. Com DB_POOLER (pgbouncer em modo transaction) o limite
+# fica com o pooler e os cursores do lado do servidor são desativados.
+DB_POOLER = config("DB_POOLER", default=False, cast=bool)
+DB_MAX_CONNECTIONS = config("DB_MAX_CONNECTIONS", default=90, cast=int)
+DB_EXPECTED_CONNECTIONS = GUNICORN_WORKERS * (
+    GUNICORN_THREADS + UPLOAD_WORKERS
+)
+if GUNICORN_WORKER_CLASS == "gevent":
+    # Cada greenlet abre sua própria conexão para autenticar e procurar
+    # reenvios, além das threads de run_blocking e dos jobs
+    DB_EXPECTED_CONNECTIONS += GUNICORN_WORKERS * GUNICORN_WORKER_CONNECTIONS
+    if not DB_POOLER and DB_EXPECTED_CONNECTIONS > DB_MAX_CONNECTIONS:
+        raise ImproperlyConfigured(
+            "O worker gevent pode abrir {0} conexões com o banco, acima de "
+            "DB_MAX_CONNECTIONS ({1}). Use DB_POOLER ou reduza "
+            "GUNICORN_WORKERS e GUNICORN_WORKER_CONNECTIONS.".format(
+                DB_EXPECTED_CONNECTIONS, DB_MAX_CONNECTIONS
+            )
+        )
+# A conexão de um greenlet não seria reaproveitada depois que ele termina
+DB_CONN_MAX_AGE = config(
+    "DB_CONN_MAX_AGE",
+    default=600
+    if GUNICORN_WORKER_CLASS != "gevent"
+    and (DB_POOLER or DB_EXPECTED_CONNECTIONS <= DB_MAX_CONNECTIONS)
+    else 0,
+    cast=int,
+)
+if "postgresql" in DATABASES["default"]["ENGINE"]:
+    DATABASES["default"]["ENGINE"] = "datalakecadg.postgresql"
+DATABASES["default"].update(
+    CONN_MAX_AGE=DB_CONN_MAX_AGE,
+    CONN_HEALTH_CHECKS=config(
+        "DB_CONN_HEALTH_CHECKS", default=DB_CONN_MAX_AGE > 0, cast=bool
+    ),
+    DISABLE_SERVER_SIDE_CURSORS=DB_POOLER,
+)
+
+# Uploads vão direto para disco, com md5 e amostra do csv calculados durante
+# o recebimento
+FILE_UPLOAD_HANDLERS = config(
+    "FILE_UPLOAD_HANDLERS",
+    default="api.uploadhandlers.SpoolingUploadHandler",
+    cast=Csv(),
+)
+
+# HDFS
+# Envia o upload para <uri>/_incoming/ enquanto ele é validado
+HDFS_STAGED_WRITES = config("HDFS_STAGED_WRITES", default=False, cast=bool)
+# Confere o checksum da cópia no HDFS antes de aceitar um reenvio como
+# duplicado
+HDFS_DEDUP_CHECKSUM = config("HDFS_DEDUP_CHECKSUM", default=False, cast=bool)
+# Cada thread do gunicorn e do pool de uploads usa uma conexão por host
+HDFS_POOL_CONNECTIONS = config("HDFS_POOL_CONNECTIONS", default=10, cast=int)
+HDFS_POOL_MAXSIZE = config(
+    "HDFS_POOL_MAXSIZE", default=GUNICORN_THREADS + UPLOAD_WORKERS, cast=int
+)
+HDFS_MAX_RETRIES = config("HDFS_MAX_RETRIES", default=3, cast=int)
+HDFS_RETRY_BACKOFF = config("HDFS_RETRY_BACKOFF", default=0.5, cast=float)
+HDFS_TIMEOUT = config("HDFS_TIMEOUT", default=0, cast=float) or None
+# A sessão guarda o cookie hadoop.auth do namenode, evitando um novo SPNEGO
+# a cada requisição. Com esta opção o token vai já na primeira requisição.
+HDFS_KERBEROS_PREEMPTIVE = config(
+    "HDFS_KERBEROS_PREEMPTIVE", default=False, cast=bool
+)
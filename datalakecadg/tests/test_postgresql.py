@@ -0,0 +1,40 @@
+from unittest import mock, skipUnless
+
+from django.db import close_old_connections, connection
+from django.test import TransactionTestCase
+
+from secret.models import Secret
+
+
+@skipUnless(connection.vendor == 'postgresql', 'requer PostgreSQL')
+class HealthCheck(TransactionTestCase):
+    def setUp(self):
+        settings_dict = dict(
+            connection.settings_dict,
+            CONN_MAX_AGE=600,
+            CONN_HEALTH_CHECKS=True,
+        )
+        patcher = mock.patch.dict(connection.settings_dict, settings_dict)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        close_old_connections()
+
+    def test_reconnect_after_server_closed_connection(self):
+        Secret.objects.count()
+        # Conexão derrubada entre duas requisições
+        connection.connection.close()
+        close_old_connections()
+
+        self.assertEqual(Secret.objects.count(), 0)
+
+    def test_check_once_per_request(self):
+        Secret.objects.count()
+        close_old_connections()
+
+        with mock.patch.object(
+            connection, 'is_usable', return_value=True
+        ) as _is_usable:
+            Secret.objects.count()
+            Secret.objects.count()
+
+        _is_usable.assert_called_once_with()
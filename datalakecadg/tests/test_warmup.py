@@ -0,0 +1,36 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from model_mommy.mommy import make
+
+from datalakecadg.warmup import warm_up
+from methodmapping.schemas import _compiled, schema_hash
+
+
+@mock.patch('datalakecadg.warmup.release_connections')
+class WarmUp(TestCase):
+    def test_prime_schema_cache(self, _release_connections):
+        schema = {'fields': [{'name': 'field1'}]}
+        mapping = make('methodmapping.MethodMapping', schema=schema)
+
+        with mock.patch('api.clients.hdfsclient'):
+            warm_up()
+
+        self.assertIn((mapping.id, schema_hash(schema)), _compiled)
+        _release_connections.assert_called_once_with()
+
+    @override_settings(WARMUP_HDFS_PROBE=True)
+    def test_hdfs_probe(self, _release_connections):
+        with mock.patch('api.clients.hdfsclient') as _hdfsclient:
+            warm_up()
+
+        _hdfsclient.status.assert_called_once_with('/')
+
+    @override_settings(WARMUP_HDFS_PROBE=True)
+    def test_failures_do_not_stop_boot(self, _release_connections):
+        with mock.patch('api.clients.hdfsclient') as _hdfsclient:
+            _hdfsclient.status.side_effect = OSError('unreachable')
+            with self.assertLogs('datalakecadg.warmup', level='ERROR'):
+                warm_up()
+
+        _release_connections.assert_called_once_with()
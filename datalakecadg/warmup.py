@@ -0,0 +1,98 @@
+"""Aquecimento da aplicação no master do gunicorn, antes do fork
+
+Com preload_app (gunicorn.conf.py) a aplicação é carregada uma única vez no
+master. warm_up() completa o que só aconteceria na primeira requisição de
+cada worker: importa os módulos pesados, compila os templates, monta os
+schemas dos métodos e cria o cliente do HDFS. Os workers herdam tudo isso
+pelo fork, com a memória compartilhada em copy-on-write.
+
+As conexões abertas aqui (banco e HDFS) são fechadas antes do fork, para
+que nenhum socket seja compartilhado entre os workers.
+"""
+import logging
+import os
+from importlib import import_module
+from time import monotonic
+
+from django.conf import settings
+from django.db import connections
+from django.template import engines
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+HEAVY_MODULES = (
+    'goodtables',
+    'tableschema',
+    'tabulator',
+    'openpyxl',
+    'zstandard',
+    'api.columnar',
+    'api.validation',
+)
+
+
+def import_modules():
+    for name in HEAVY_MODULES:
+        import_module(name)
+    # Carrega as views de todos os apps, como na primeira requisição
+    get_resolver().url_patterns
+
+
+def compile_templates():
+    from secret.mail import TEMPLATE_PATH, msg_template
+
+    for engine in engines.all():
+        for directory in engine.template_dirs:
+            for root, _, files in os.walk(directory):
+                for filename in files:
+                    path = os.path.join(root, filename)
+                    # O template do e-mail é do Jinja, não do Django
+                    if filename.endswith('.html') and path != TEMPLATE_PATH:
+                        engine.get_template(os.path.relpath(path, directory))
+
+    # Acessar um atributo constrói o template do e-mail
+    msg_template.render
+
+
+def prime_schemas():
+    from methodmapping.models import MethodMapping
+    from methodmapping.schemas import get_compiled_schema
+
+    mappings = MethodMapping.objects.filter(schema__isnull=False)
+    for mapping in mappings.only('id', 'schema'):
+        get_compiled_schema(mapping)
+
+
+def probe_hdfs():
+    from api.clients import hdfsclient
+
+    if settings.WARMUP_HDFS_PROBE:
+        hdfsclient.status('/')
+    else:
+        # Só cria o cliente e a sessão, sem acessar o cluster
+        hdfsclient.url
+
+
+def release_connections():
+    from api.clients import close_hdfs_connections
+
+    connections.close_all()
+    close_hdfs_connections()
+
+
+def warm_up():
+    started = monotonic()
+    steps = (import_modules, compile_templates, prime_schemas, probe_hdfs)
+    try:
+        for step in steps:
+            try:
+                step()
+            except Exception:
+                # O worker ainda pode fazer este trabalho na primeira
+                # requisição; falhar aqui não deve impedir o boot
+                logger.exception('Falha no aquecimento: %s', step.__name__)
+    finally:
+        release_connections()
+
+    logger.info('Aquecimento concluído em %.2fs', monotonic() - started)
@@ -0,0 +1,49 @@
+# Configuração do gunicorn usada por app.sh. Número de workers, threads e
+# endereço continuam na linha de comando.
+import os
+
+# A aplicação é carregada no master e compartilhada pelos workers
+preload_app = True
+
+# Com o worker gevent (GUNICORN_WORKER_CLASS=gevent) cada conexão é atendida
+# por um greenlet, e parceiros em links lentos não ocupam uma thread enquanto
+# enviam o arquivo. A validação, a compressão e o envio ao HDFS rodam em
+# threads do sistema (api.jobs.run_blocking). Sem a variável vale o gthread
+# escolhido pelo --threads.
+if 'GUNICORN_WORKER_CLASS' in os.environ:
+    worker_class = os.environ['GUNICORN_WORKER_CLASS']
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+
+if os.environ.get('GUNICORN_WORKER_CLASS') == 'gevent':
+    # Antes do preload_app, para que a aplicação já importe os módulos
+    # adaptados e crie seus pools com threads do sistema
+    from gevent import monkey
+
+    monkey.patch_all()
+
+    # Sem isto o psycopg2 trava o worker enquanto espera o banco
+    from psycogreen.gevent import patch_psycopg
+
+    patch_psycopg()
+
+
+def when_ready(server):
+    # Roda no master depois do preload e antes do fork dos workers
+    from datalakecadg.warmup import warm_up
+
+    warm_up()
+
+
+def pre_fork(server, worker):
+    # Conexões abertas no master depois do aquecimento (por exemplo ao
+    # repor um worker) não podem ser herdadas
+    from datalakecadg.warmup import release_connections
+
+    release_connections()
+
+
+def child_exit(server, worker):
+    if 'prometheus_multiproc_dir' in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,23 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('methodmapping', '0002_methodmapping_schema'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='methodmapping',
+            name='compression',
+            field=models.CharField(choices=[('gzip', 'gzip'), ('zstd', 'zstd'), ('none', 'Sem compressão')], default='gzip', help_text='Compressão aplicada aos arquivos .csv e .xlsx', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='methodmapping',
+            name='compression_level',
+            field=models.PositiveSmallIntegerField(default=6, help_text='gzip: 1 (mais rápido) a 9, zstd: 1 a 22'),
+        ),
+    ]
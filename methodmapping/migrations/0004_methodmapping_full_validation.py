@@ -0,0 +1,23 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('methodmapping', '0003_methodmapping_compression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='methodmapping',
+            name='full_validation',
+            field=models.BooleanField(default=False, help_text='Valida todas as linhas do arquivo e não só a amostra'),
+        ),
+        migrations.AddField(
+            model_name='methodmapping',
+            name='max_errors',
+            field=models.PositiveIntegerField(default=100, help_text='A validação completa para após este número de erros'),
+        ),
+    ]
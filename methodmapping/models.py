@@ -1,8 +1,20 @@
 from django.contrib.postgres.fields import JSONField
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.compression import GZIP, LEVELS, NONE, ZSTD
+from methodmapping.schemas import invalidate_compiled_schema
 
 
 class MethodMapping(models.Model):
+    COMPRESSION_CHOICES = (
+        (GZIP, "gzip"),
+        (ZSTD, "zstd"),
+        (NONE, "Sem compressão"),
+    )
+
     method = models.CharField(max_length=255)
     uri = models.CharField(
         max_length=255,
@@ -10,6 +22,42 @@ class MethodMapping(models.Model):
     )
     description = models.TextField()
     schema = JSONField(null=True)
+    compression = models.CharField(
+        max_length=8,
+        choices=COMPRESSION_CHOICES,
+        default=GZIP,
+        help_text="Compressão aplicada aos arquivos .csv e .xlsx"
+    )
+    compression_level = models.PositiveSmallIntegerField(
+        default=6,
+        help_text="gzip: 1 (mais rápido) a 9, zstd: 1 a 22"
+    )
+    full_validation = models.BooleanField(
+        default=False,
+        help_text="Valida todas as linhas do arquivo e não só a amostra"
+    )
+    max_errors = models.PositiveIntegerField(
+        default=100,
+        help_text="A validação completa para após este número de erros"
+    )
+
+    def clean(self):
+        if self.compression not in LEVELS:
+            return
+
+        lowest, highest = LEVELS[self.compression]
+        if not lowest <= self.compression_level <= highest:
+            raise ValidationError({
+                'compression_level': 'Nível deve estar entre {0} e {1}'.format(
+                    lowest, highest
+                )
+            })
 
     def __str__(self):
         return '{method}: {uri}'.format(method=self.method, uri=self.uri)
+
+
+@receiver(post_save, sender=MethodMapping)
+@receiver(post_delete, sender=MethodMapping)
+def invalidate_schema_cache(sender, instance, **kwargs):
+    invalidate_compiled_schema(instance.id)
@@ -0,0 +1,35 @@
+import json
+from hashlib import md5
+from threading import Lock
+
+from tableschema import Schema
+
+# Schemas já compilados por (MethodMapping.id, hash do schema). O cache é do
+# processo e é limpo pelo post_save/post_delete de MethodMapping
+_compiled = {}
+_lock = Lock()
+
+
+def schema_hash(schema):
+    dumped = json.dumps(schema, sort_keys=True, ensure_ascii=False)
+    return md5(dumped.encode('utf-8')).hexdigest()
+
+
+def get_compiled_schema(mapping):
+    if mapping.schema is None:
+        return None
+
+    key = (mapping.id, schema_hash(mapping.schema))
+    compiled = _compiled.get(key)
+    if compiled is None:
+        compiled = Schema(mapping.schema)
+        with _lock:
+            _compiled[key] = compiled
+
+    return compiled
+
+
+def invalidate_compiled_schema(mapping_id):
+    with _lock:
+        for key in [key for key in _compiled if key[0] == mapping_id]:
+            del _compiled[key]
@@ -0,0 +1,19 @@
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from methodmapping.models import MethodMapping
+
+
+class CompressionLevelTest(TestCase):
+    def test_gzip_level_out_of_range(self):
+        method = MethodMapping(compression="gzip", compression_level=12)
+
+        with self.assertRaises(ValidationError) as error:
+            method.clean()
+
+        self.assertIn("compression_level", error.exception.message_dict)
+
+    def test_zstd_level_in_range(self):
+        method = MethodMapping(compression="zstd", compression_level=12)
+
+        method.clean()
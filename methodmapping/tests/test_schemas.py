@@ -0,0 +1,34 @@
+from django.test import TestCase
+from model_mommy.mommy import make
+
+from methodmapping.schemas import get_compiled_schema
+
+
+class CompiledSchemaTest(TestCase):
+    def setUp(self):
+        self.mapping = make(
+            "methodmapping.MethodMapping",
+            method="cpf",
+            schema={"fields": [{"name": "field1"}, {"name": "field2"}]},
+        )
+
+    def test_reuse_compiled_schema(self):
+        compiled = get_compiled_schema(self.mapping)
+
+        self.assertIs(get_compiled_schema(self.mapping), compiled)
+        self.assertEqual(compiled.field_names, ["field1", "field2"])
+
+    def test_recompile_after_save(self):
+        compiled = get_compiled_schema(self.mapping)
+        self.mapping.schema = {"fields": [{"name": "field3"}]}
+        self.mapping.save()
+
+        recompiled = get_compiled_schema(self.mapping)
+
+        self.assertIsNot(recompiled, compiled)
+        self.assertEqual(recompiled.field_names, ["field3"])
+
+    def test_schema_null(self):
+        self.mapping.schema = None
+
+        self.assertIsNone(get_compiled_schema(self.mapping))
@@ -3,7 +3,7 @@ from django.db.models.functions import Lower
 from django.contrib import admin
 
 from methodmapping.models import MethodMapping
-from secret.models import Secret
+from secret.models import OutgoingMail, Secret
 
 
 class SecretAdminForm(forms.ModelForm):
@@ -23,3 +23,14 @@ class SecretAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Secret, SecretAdmin)
+
+
+class OutgoingMailAdmin(admin.ModelAdmin):
+    list_display = (
+        'created_at', 'method_name', 'status', 'attempts', 'next_attempt_at'
+    )
+    list_filter = ('status',)
+    readonly_fields = ['sent_at', 'last_error']
+
+
+admin.site.register(OutgoingMail, OutgoingMailAdmin)
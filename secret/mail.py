@@ -1,11 +1,18 @@
+import os
 import smtplib
 
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 from decouple import config
+from django.utils.functional import SimpleLazyObject
 from jinja2 import Template
 
+TEMPLATE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'core', 'templates', 'core', 'email.html'
+)
+
 
 def login():
     server = smtplib.SMTP(config('EMAIL_SMTP_SERVER'))
@@ -28,5 +35,10 @@ def send_mail(server, msg, dest, method_name):
     )
 
 
-with open('core/templates/core/email.html') as fobj:
-    msg_template = Template(fobj.read())
+def load_template():
+    with open(TEMPLATE_PATH) as fobj:
+        return Template(fobj.read())
+
+
+# Lido e compilado no primeiro e-mail, independente do diretório atual
+msg_template = SimpleLazyObject(load_template)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from secret.models import OutgoingMail
+
+
+class Command(BaseCommand):
+    help = 'Envia os e-mails pendentes, inclusive os reagendados após falha'
+
+    def handle(self, *args, **options):
+        sent = OutgoingMail.objects.deliver()
+        self.stdout.write('{0} e-mail(s) enviado(s)'.format(sent))
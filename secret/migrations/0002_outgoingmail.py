@@ -0,0 +1,34 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:00
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('secret', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingMail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method_name', models.CharField(max_length=255)),
+                ('recipients', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('body', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'Aguardando envio'), ('sent', 'Enviado'), ('failed', 'Falhou')], default='pending', max_length=16)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outgoingmail',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='secret_outg_status_8da0ba_idx'),
+        ),
+    ]
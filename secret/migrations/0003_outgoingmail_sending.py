@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('secret', '0002_outgoingmail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outgoingmail',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Aguardando envio'), ('sending', 'Em envio'), ('sent', 'Enviado'), ('failed', 'Falhou')], default='pending', max_length=16),
+        ),
+    ]
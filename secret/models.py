@@ -1,12 +1,40 @@
+import logging
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from smtplib import SMTPException
 
-from django.db import models
-from django.db.models.signals import m2m_changed
+from django.contrib.postgres.fields import JSONField
+from django.core.cache import caches
+from django.db import close_old_connections, connection, models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 
-from secret.utils import create_secret
+from secret.utils import create_secret, secret_cache_key
 from secret.mail import login, send_mail, msg_template
 
+logger = logging.getLogger(__name__)
+mail_executor = ThreadPoolExecutor(max_workers=1)
+
+
+class SecretManager(models.Manager):
+    def authenticate(self, username, secret_key):
+        # Usuários inexistentes também ficam no cache, com chave vazia
+        cache = caches['secrets']
+        key = secret_cache_key(username)
+        stored_key = cache.get(key)
+        if stored_key is None:
+            stored_key = self.filter(username=username).values_list(
+                'secret_key', flat=True
+            ).first() or ''
+            cache.set(key, stored_key)
+
+        return bool(stored_key) and constant_time_compare(
+            stored_key, str(secret_key)
+        )
+
 
 class Secret(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -16,6 +44,15 @@ class Secret(models.Model):
     secret_key = models.CharField(max_length=32, editable=False)
     methods = models.ManyToManyField('methodmapping.MethodMapping')
 
+    objects = SecretManager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Permite invalidar o cache do nome antigo quando o usuário é renomeado
+        instance._loaded_username = instance.__dict__.get('username')
+        return instance
+
     def save(self, *args, **kwargs):
         self.secret_key = self.secret_key\
             if self.secret_key else create_secret()
@@ -32,24 +69,183 @@ class Secret(models.Model):
             )
 
 
+@receiver(post_save, sender=Secret)
+@receiver(post_delete, sender=Secret)
+def invalidate_secret_cache(sender, instance, **kwargs):
+    usernames = {
+        instance.username, getattr(instance, '_loaded_username', None)
+    }
+    caches['secrets'].delete_many([
+        secret_cache_key(username) for username in usernames if username
+    ])
+
+
+class OutgoingMailManager(models.Manager):
+    def deliver(self, batch_size=50):
+        """Envia os e-mails pendentes usando uma conexão SMTP por lote
+
+        Cada lote é reservado numa transação curta (SKIP LOCKED) e enviado
+        fora dela, então vários remetentes podem rodar ao mesmo tempo e o
+        status de cada e-mail é gravado logo após o envio. Falhas são
+        reagendadas com espera exponencial. Devolve o número de enviados.
+        """
+        sent = 0
+        while True:
+            batch = self._claim_batch(batch_size)
+            if not batch:
+                return sent
+
+            sent += self._send_batch(batch)
+            if len(batch) < batch_size:
+                return sent
+
+    def _claim_batch(self, batch_size):
+        # E-mails reservados por um remetente interrompido voltam a ser
+        # enviados depois de SENDING_TIMEOUT
+        now = timezone.now()
+        with transaction.atomic():
+            batch = list(
+                self.select_for_update(skip_locked=True)
+                .filter(
+                    status__in=[OutgoingMail.PENDING, OutgoingMail.SENDING],
+                    next_attempt_at__lte=now,
+                )
+                .order_by('created_at')[:batch_size]
+            )
+            self.filter(id__in=[mail.id for mail in batch]).update(
+                status=OutgoingMail.SENDING,
+                next_attempt_at=now + OutgoingMail.SENDING_TIMEOUT,
+            )
+        return batch
+
+    def _send_batch(self, batch):
+        try:
+            server = login()
+        except (OSError, SMTPException) as error:
+            for mail in batch:
+                mail.retry_later(error)
+            return 0
+
+        sent = 0
+        try:
+            for mail in batch:
+                try:
+                    send_mail(
+                        server, mail.body, mail.recipients,
+                        method_name=mail.method_name
+                    )
+                except Exception as error:
+                    # Erros que não são do SMTP (codificação da mensagem...)
+                    # também só afetam este e-mail
+                    mail.retry_later(error)
+                else:
+                    mail.status = OutgoingMail.SENT
+                    mail.sent_at = timezone.now()
+                    mail.save(update_fields=['status', 'sent_at'])
+                    sent += 1
+        finally:
+            try:
+                server.quit()
+            except (OSError, SMTPException):
+                server.close()
+
+        return sent
+
+
+class OutgoingMail(models.Model):
+    """E-mail aguardando envio pelo remetente em segundo plano"""
+
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Aguardando envio'),
+        (SENDING, 'Em envio'),
+        (SENT, 'Enviado'),
+        (FAILED, 'Falhou'),
+    )
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = timedelta(minutes=1)
+    SENDING_TIMEOUT = timedelta(minutes=10)
+
+    method_name = models.CharField(max_length=255)
+    recipients = JSONField()
+    body = models.TextField()
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True)
+
+    objects = OutgoingMailManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def retry_later(self, error):
+        self.attempts += 1
+        self.last_error = str(error)
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.status = self.FAILED
+            logger.error('E-mail {0} não enviado: {1}'.format(self.id, error))
+        else:
+            self.status = self.PENDING
+            self.next_attempt_at = timezone.now() + self.RETRY_DELAY * (
+                2 ** (self.attempts - 1)
+            )
+        self.save(update_fields=[
+            'attempts', 'last_error', 'status', 'next_attempt_at'
+        ])
+
+    def __str__(self):
+        return '{method_name} - {recipient}: {status}'.format(
+            method_name=self.method_name,
+            recipient=self.recipients[0],
+            status=self.status,
+        )
+
+
+def deliver_outbox():
+    # Roda em thread própria, fora do ciclo de request que cuida das
+    # conexões com o banco
+    close_old_connections()
+    try:
+        OutgoingMail.objects.deliver()
+    except Exception:
+        logger.exception('Erro ao enviar e-mails pendentes')
+    finally:
+        connection.close()
+
+
 @receiver(m2m_changed, sender=Secret.methods.through)
 def methodmapping_added(sender, **kwargs):
     secret = kwargs.pop('instance', None)
     action = kwargs.pop('action')
     pk_set = kwargs.pop('pk_set')
     method_manager = kwargs['model']
+    if action != 'post_add' or not pk_set:
+        return
 
+    # Os e-mails vão para a fila e são enviados depois do commit, sem
+    # prender o request do admin nas conexões SMTP
     dest = [secret.email, 'mpemmapas.cadg@mprj.mp.br']
-    mail_server = login()
-    if action == "post_add":
-        for pk in pk_set:
-            method = method_manager.objects.get(pk=pk)
-            msg = msg_template.render(
+    OutgoingMail.objects.bulk_create([
+        OutgoingMail(
+            method_name=method.method,
+            recipients=dest,
+            body=msg_template.render(
                 username=secret.username,
                 fullname=secret.fullname,
                 description=method.description,
                 method=method.method,
                 secret=secret.secret_key,
                 schema=method.schema,
-            )
-            send_mail(mail_server, msg, dest, method_name=method.method)
+            ),
+        )
+        for method in method_manager.objects.filter(pk__in=pk_set)
+    ])
+    transaction.on_commit(lambda: mail_executor.submit(deliver_outbox))
@@ -0,0 +1,19 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from secret.mail import load_template
+
+
+class LoadTemplate(TestCase):
+    def test_load_outside_project_root(self):
+        cwd = os.getcwd()
+        os.chdir(tempfile.gettempdir())
+        try:
+            template = load_template()
+        finally:
+            os.chdir(cwd)
+
+        self.assertIn(
+            "'fulano'", template.render(username='fulano', schema={})
+        )
@@ -1,10 +1,13 @@
+from smtplib import SMTPServerDisconnected
 from unittest import mock
 
+from django.core.cache import caches
 from django.test import TestCase
+from django.utils import timezone
 
 from model_mommy.mommy import make
 
-from secret.models import Secret
+from secret.models import OutgoingMail, Secret
 
 
 class SendEmail(TestCase):
@@ -21,8 +24,101 @@ class SendEmail(TestCase):
         secret.methods.add(method)
         secret.save()
 
+        # O envio acontece depois do commit, fora do request
+        _login.assert_not_called()
+        OutgoingMail.objects.deliver()
+
         _send_mail.assert_called()
 
+    @mock.patch('secret.models.send_mail')
+    @mock.patch('secret.models.login')
+    def test_one_connection_per_batch(self, _login, _send_mail):
+        methods = make('methodmapping.MethodMapping', _quantity=3)
+        secret = make(Secret, email='user@mail.com')
+        secret.methods.add(*methods)
+        secret.methods.remove(methods[0])
+
+        sent = OutgoingMail.objects.deliver()
+
+        self.assertEqual(sent, 3)
+        self.assertEqual(_send_mail.call_count, 3)
+        _login.assert_called_once_with()
+        _login.return_value.quit.assert_called_once_with()
+        self.assertFalse(
+            OutgoingMail.objects.exclude(status=OutgoingMail.SENT).exists()
+        )
+
+    @mock.patch('secret.models.send_mail')
+    @mock.patch('secret.models.login')
+    def test_retry_with_backoff(self, _login, _send_mail):
+        _send_mail.side_effect = SMTPServerDisconnected('closed')
+        mail = make(OutgoingMail, recipients=['user@mail.com'])
+
+        OutgoingMail.objects.deliver()
+        OutgoingMail.objects.filter(id=mail.id).update(
+            next_attempt_at=timezone.now()
+        )
+        OutgoingMail.objects.deliver()
+
+        mail.refresh_from_db()
+        self.assertEqual(mail.status, OutgoingMail.PENDING)
+        self.assertEqual(mail.attempts, 2)
+        self.assertGreater(
+            mail.next_attempt_at,
+            timezone.now() + OutgoingMail.RETRY_DELAY,
+        )
+
+    @mock.patch('secret.models.send_mail')
+    @mock.patch('secret.models.login')
+    def test_keep_sent_status_after_unexpected_error(self, _login,
+                                                    _send_mail):
+        _send_mail.side_effect = [
+            None, UnicodeEncodeError('ascii', 'ç', 0, 1, 'ç'), None
+        ]
+        mails = make(OutgoingMail, recipients=['user@mail.com'], _quantity=3)
+
+        sent = OutgoingMail.objects.deliver()
+
+        statuses = [
+            OutgoingMail.objects.get(id=mail.id).status for mail in mails
+        ]
+        self.assertEqual(sent, 2)
+        self.assertEqual(_send_mail.call_count, 3)
+        self.assertEqual(statuses, [
+            OutgoingMail.SENT, OutgoingMail.PENDING, OutgoingMail.SENT
+        ])
+
+    def test_resend_after_interrupted_delivery(self):
+        mail = make(
+            OutgoingMail,
+            recipients=['user@mail.com'],
+            status=OutgoingMail.SENDING,
+            next_attempt_at=timezone.now() + OutgoingMail.SENDING_TIMEOUT,
+        )
+        self.assertEqual(OutgoingMail.objects._claim_batch(10), [])
+
+        OutgoingMail.objects.filter(id=mail.id).update(
+            next_attempt_at=timezone.now()
+        )
+
+        self.assertEqual(OutgoingMail.objects._claim_batch(10), [mail])
+
+    @mock.patch('secret.models.send_mail')
+    @mock.patch('secret.models.login')
+    def test_give_up_after_max_attempts(self, _login, _send_mail):
+        _send_mail.side_effect = SMTPServerDisconnected('closed')
+        mail = make(
+            OutgoingMail,
+            recipients=['user@mail.com'],
+            attempts=OutgoingMail.MAX_ATTEMPTS - 1,
+        )
+
+        OutgoingMail.objects.deliver()
+
+        mail.refresh_from_db()
+        self.assertEqual(mail.status, OutgoingMail.FAILED)
+        self.assertEqual(mail.last_error, 'closed')
+
 
 class CreateSecret(TestCase):
     def test_dont_change_secret(self):
@@ -37,3 +133,63 @@ class CreateSecret(TestCase):
         secret.save()
 
         self.assertEqual(secret.secret_key, first_secret_key)
+
+
+class AuthenticateSecret(TestCase):
+    def setUp(self):
+        caches['secrets'].clear()
+
+    def test_authenticate(self):
+        secret = make(Secret, username='anyname')
+
+        self.assertTrue(
+            Secret.objects.authenticate('anyname', secret.secret_key)
+        )
+        self.assertFalse(Secret.objects.authenticate('anyname', 'wrongkey'))
+        self.assertFalse(
+            Secret.objects.authenticate('othername', secret.secret_key)
+        )
+
+    def test_cached_lookup(self):
+        secret = make(Secret, username='anyname')
+        Secret.objects.authenticate('anyname', secret.secret_key)
+        Secret.objects.authenticate('unknown', 'anykey')
+
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                Secret.objects.authenticate('anyname', secret.secret_key)
+            )
+            self.assertFalse(Secret.objects.authenticate('unknown', 'anykey'))
+
+    def test_invalidate_on_save(self):
+        secret = make(Secret, username='anyname')
+        old_key = secret.secret_key
+        Secret.objects.authenticate('anyname', old_key)
+
+        secret.secret_key = 'newkey'
+        secret.save()
+
+        self.assertFalse(Secret.objects.authenticate('anyname', old_key))
+        self.assertTrue(Secret.objects.authenticate('anyname', 'newkey'))
+
+    def test_invalidate_on_rename(self):
+        make(Secret, username='anyname')
+        secret = Secret.objects.get(username='anyname')
+        Secret.objects.authenticate('anyname', secret.secret_key)
+
+        secret.username = 'othername'
+        secret.save()
+
+        self.assertFalse(
+            Secret.objects.authenticate('anyname', secret.secret_key)
+        )
+
+    def test_invalidate_on_delete(self):
+        secret = make(Secret, username='anyname')
+        Secret.objects.authenticate('anyname', secret.secret_key)
+
+        secret.delete()
+
+        self.assertFalse(
+            Secret.objects.authenticate('anyname', secret.secret_key)
+        )
@@ -4,3 +4,7 @@ from time import time
 
 def create_secret():
     return md5(str(time()).encode()).hexdigest()
+
+
+def secret_cache_key(username):
+    return 'secret:' + md5(str(username).encode()).hexdigest()